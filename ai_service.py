@@ -4,6 +4,15 @@ import logging
 from datetime import datetime, date, time, timedelta
 import google.generativeai as genai
 
+from cache_intencoes import criar_cache_intencoes
+from classificador_intencoes import criar_classificador
+from cliente_ia import criar_cliente_ia
+from disponibilidade import MotorDisponibilidade, FonteSQLAlchemy
+from extracao import combinar, interpretar, preferencias_locais, resumir, tem_conteudo
+from ocupacao import minutos
+from preferencias import aplicar_preferencias, descrever_preferencias, escolher_horario
+import prompts
+
 # Configurar cliente Gemini
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
@@ -16,6 +25,13 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-1.5-flash')
 
+# Chamadas com prazo e hedge: estourado o prazo, cada handler usa sua heurística
+cliente_ia = criar_cliente_ia(model)
+
+# Extração estruturada: um JSON com todos os campos da mensagem por turno, pulando as
+# etapas já respondidas. GEMINI_EXTRACAO=0 volta a uma pergunta ao Gemini por etapa
+EXTRACAO_ESTRUTURADA = os.environ.get('GEMINI_EXTRACAO', '1') != '0'
+
 
 class ChatbotService:
     """Serviço de chatbot para agendamento médico usando Gemini"""
@@ -34,6 +50,19 @@ class ChatbotService:
         Returns:
             dict: Resposta do chatbot com próxima ação
         """
+        # Todas as chamadas ao Gemini do turno dividem um único orçamento de tempo
+        with cliente_ia.orcamento_turno():
+            resposta = self._processar_estado(mensagem, conversa)
+
+        # Guardar a lista exibida: "2", "o primeiro" ou "20/10 14:00" se referem a ela
+        if resposta.get('proximo_estado') == 'horarios' and resposta.get('horarios'):
+            dados = conversa.get_dados() or {}
+            dados['horarios_exibidos'] = resposta['horarios']
+            conversa.set_dados(dados)
+        return resposta
+
+    def _processar_estado(self, mensagem, conversa):
+        """Encaminha a mensagem ao processador do estado atual da conversa"""
         try:
             estado = conversa.estado or 'inicio'
             dados = conversa.get_dados() or {}
@@ -50,28 +79,48 @@ class ChatbotService:
                 conversa.set_dados({})
                 return self._processar_cancelamento(mensagem, conversa)
 
+            # Escolha clara da lista exibida ("2", "o primeiro", "20/10 14:00"): decisão
+            # local, sem passar pela detecção de saudação com IA
+            if estado == 'horarios' and escolher_horario(
+                    mensagem, dados.get('horarios_exibidos')) is not None:
+                return self._processar_horarios(mensagem, conversa, dados)
+
+            # Local, especialidade e horários: a extração estruturada do turno também diz
+            # se é saudação, sem uma segunda chamada ao Gemini
+            campos = None
+            if estado in ('local', 'especialidade'):
+                campos = self._extrair_campos(mensagem)
+            elif estado == 'horarios':
+                campos = self._extrair_campos(mensagem, dados.get('horarios_exibidos'))
+
             # INTELIGÊNCIA MELHORADA: Verificar se é saudação em qualquer estado
             # Se for saudação, sempre resetar conversa para evitar estados inconsistentes
-            if self._eh_saudacao(mensagem):
+            # (no início e após finalizar a mensagem já segue para _processar_inicio)
+            if estado not in ('inicio', 'finalizado') and self._eh_saudacao(mensagem, campos):
                 logging.info(
                     f"Saudação detectada, resetando conversa do estado '{estado}' para 'inicio'"
                 )
                 conversa.estado = 'inicio'
                 conversa.set_dados({})
-                return self._processar_inicio(mensagem, conversa)
+                return self._processar_inicio(mensagem, conversa, campos)
 
-            if estado == 'inicio' or estado == 'finalizado':
+            if estado == 'finalizado':
+                # Novo atendimento: médico, horário e horários exibidos do anterior não seguem
+                conversa.estado = 'inicio'
+                conversa.set_dados({})
+                return self._processar_inicio(mensagem, conversa)
+            elif estado == 'inicio':
                 return self._processar_inicio(mensagem, conversa)
             elif estado == 'aguardando_cpf':
                 return self._processar_cpf(mensagem, conversa)
             elif estado == 'cadastro':
                 return self._processar_cadastro(mensagem, conversa, dados)
             elif estado == 'local':
-                return self._processar_local(mensagem, conversa)
+                return self._processar_local(mensagem, conversa, campos)
             elif estado == 'especialidade':
-                return self._processar_especialidade(mensagem, conversa)
+                return self._processar_especialidade(mensagem, conversa, campos)
             elif estado == 'horarios':
-                return self._processar_horarios(mensagem, conversa, dados)
+                return self._processar_horarios(mensagem, conversa, dados, campos)
             elif estado == 'confirmacao':
                 return self._processar_confirmacao(mensagem, conversa, dados)
             elif estado == 'cancelamento':
@@ -93,12 +142,17 @@ class ChatbotService:
             return self._resposta_erro(
                 "Desculpe, ocorreu um erro. Vamos recomeçar o atendimento.")
 
-    def _processar_inicio(self, mensagem, conversa):
+    def _processar_inicio(self, mensagem, conversa, campos=None):
         """Processa mensagem inicial e pede CPF"""
         mensagem_lower = mensagem.lower().strip()
 
+        # Mensagem com mais do que a intenção ("cardiologista em BH sexta de manhã"): uma
+        # chamada estruturada traz todos os campos e dispensa a detecção de intenção
+        if campos is None and tem_conteudo(mensagem):
+            campos = self._extrair_campos(mensagem)
+
         # Detectar tipo de mensagem - primeiro com regras simples, depois com IA se disponível
-        tipo = self._detectar_tipo_mensagem(mensagem)
+        tipo = (campos or {}).get('intencao') or self._detectar_tipo_mensagem(mensagem)
 
         if tipo == 'cancelamento':
             conversa.estado = 'cancelamento'
@@ -164,72 +218,40 @@ class ChatbotService:
         else:
             # Agendamento ou saudação normal
             conversa.estado = 'aguardando_cpf'
+            anotado = ''
+            if campos:
+                # Local, especialidade e preferências ficam guardados até depois do CPF
+                extraido = combinar(None, campos)
+                conversa.set_dados({'extraido': extraido} if extraido else {})
+                if campos.get('cpf'):
+                    return self._processar_cpf(campos['cpf'], conversa)
+                if extraido:
+                    anotado = f"Já anotei: {resumir(extraido)}.\n\n"
             return {
                 'success': True,
                 'message':
-                "Olá! Bem-vindo ao sistema de agendamento da Clínica João Layon! 😊\n\n📄 Para começar o agendamento, preciso do CPF da pessoa que será atendida (o paciente).\n\nDigite apenas os 11 números do CPF:",
+                f"Olá! Bem-vindo ao sistema de agendamento da Clínica João Layon! 😊\n\n{anotado}📄 Para começar o agendamento, preciso do CPF da pessoa que será atendida (o paciente).\n\nDigite apenas os 11 números do CPF:",
                 'tipo': 'texto',
                 'proximo_estado': 'aguardando_cpf'
             }
 
     def _detectar_tipo_mensagem(self, mensagem):
         """Detecta o tipo de mensagem com IA e fallback inteligente"""
-        # FALLBACK 1: Regras básicas para casos críticos
-        mensagem_lower = mensagem.lower().strip()
+        # FALLBACK 1: Classificador local; só mensagens com baixa confiança vão ao Gemini
+        tipo_local = classificador_intencoes.decidir(mensagem)
+        if tipo_local:
+            return tipo_local
 
-        # Palavras-chave para detecção básica
-        if any(palavra in mensagem_lower for palavra in
-               ['cancelar', 'desmarcar', 'remover consulta', 'cancelo']):
-            return 'cancelamento'
-
-        if any(palavra in mensagem_lower for palavra in [
-                'meus agendamentos', 'minhas consultas',
-                'consultar agendamento', 'ver consultas'
-        ]):
-            return 'consulta'
-
-        if any(palavra in mensagem_lower for palavra in [
-                'telefone', 'endereço', 'onde fica', 'horário funcionamento',
-                'localização'
-        ]):
-            return 'informacao'
-
-        if any(palavra in mensagem_lower for palavra in
-               ['clima', 'tempo', 'futebol', 'política', 'receita culinária']):
-            return 'fora_escopo'
+        # Mensagens já classificadas pela IA (mesmo texto normalizado) não voltam ao Gemini
+        tipo_em_cache = cache_intencoes.obter(mensagem)
+        if tipo_em_cache:
+            return tipo_em_cache
 
         # FALLBACK 2: Tentar usar IA com tratamento robusto
         try:
-            prompt = f"""
-            Você é um assistente médico virtual especializado em agendamentos. Analise cuidadosamente a mensagem do usuário e classifique com máxima precisão.
-
-            Mensagem do usuário: "{mensagem}"
-            
-            Classifique a mensagem em uma das categorias, considerando contexto, intenção e nuances:
-            
-            1. "agendamento" - Qualquer intenção de agendar consulta, marcar horário, saudações iniciais (oi, olá, boa tarde), pedidos de ajuda para marcar consulta, menções de sintomas ou necessidade médica
-            
-            2. "cancelamento" - Intenção clara de cancelar, desmarcar ou remover agendamento existente
-            
-            3. "consulta" - Quer verificar, ver, listar seus agendamentos ou consultas já marcadas
-            
-            4. "informacao" - Perguntas sobre a clínica (telefone, endereço, horários de funcionamento, médicos disponíveis, especialidades oferecidas, localização)
-            
-            5. "fora_escopo" - Conversas casuais não relacionadas à clínica, perguntas pessoais, assuntos não médicos ou de agendamento
-            
-            Exemplos:
-            - "oi" → agendamento
-            - "preciso de uma consulta" → agendamento  
-            - "estou com dor de cabeça" → agendamento
-            - "quero cancelar minha consulta" → cancelamento
-            - "quais são meus agendamentos?" → consulta
-            - "qual o telefone da clínica?" → informacao
-            - "como está o tempo?" → fora_escopo
-            
-            Responda APENAS com uma palavra: agendamento, cancelamento, consulta, informacao, fora_escopo
-            """
+            prompt = prompts.INTENCAO.montar(mensagem)
 
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
 
             resultado = response.text.strip().lower(
             ) if response.text else "agendamento"
@@ -242,6 +264,8 @@ class ChatbotService:
                 logging.info(
                     f"IA detectou tipo '{resultado}' para mensagem: '{mensagem}'"
                 )
+                cache_intencoes.guardar(mensagem, resultado)
+                classificador_intencoes.registrar_exemplo(mensagem, resultado)
                 return resultado
             else:
                 logging.warning(
@@ -254,18 +278,131 @@ class ChatbotService:
                 f"IA temporariamente indisponível: {e}. Usando fallback inteligente."
             )
 
-            # FALLBACK 3: Lógica heurística avançada
-            # Saudações e sintomas -> agendamento
-            if any(palavra in mensagem_lower for palavra in [
-                    'oi', 'olá', 'ola', 'bom dia', 'boa tarde', 'boa noite',
-                    'hello', 'hi', 'dor', 'problema', 'consulta', 'médico',
-                    'doutor', 'sintoma', 'doença', 'preciso', 'quero marcar',
-                    'agendar', 'emergência'
-            ]):
-                return 'agendamento'
+            # FALLBACK 3: Melhor palpite do classificador local, mesmo com baixa confiança
+            return classificador_intencoes.classificar(mensagem)[0]
+
+    def _extrair_campos(self, mensagem, horarios=None):
+        """
+        Extrai em uma única chamada ao Gemini todos os campos que a mensagem traz
+
+        Args:
+            mensagem (str): Mensagem do usuário
+            horarios (list): Horários exibidos ao paciente, para reconhecer a opção
+
+        Returns:
+            dict: Campos validados (ver extracao.interpretar), ou None se a extração
+            estiver desligada ou o Gemini falhar (o chamador segue o fluxo por etapas)
+        """
+        if not EXTRACAO_ESTRUTURADA:
+            return None
+        from models import Local, Especialidade
+
+        locais = Local.query.filter_by(ativo=True).all()
+        especialidades = Especialidade.query.filter_by(ativo=True).all()
+        hoje = date.today()
+        linhas = [f"Hoje: {hoje.strftime('%Y-%m-%d')} ({self._get_dia_semana(hoje.weekday())})",
+                  "Locais:"]
+        linhas += [f"- {local.nome} (cidade: {local.cidade})" for local in locais]
+        linhas.append("Especialidades:")
+        linhas += [f"- {esp.nome}: {esp.descricao}" for esp in especialidades]
+        if horarios:
+            linhas.append("Horários exibidos:")
+            linhas += self._formatar_horarios_para_ia(horarios).splitlines()
+
+        try:
+            response = cliente_ia.gerar(
+                prompts.EXTRACAO.montar(mensagem, linhas),
+                generation_config={'response_mime_type': 'application/json'})
+            campos = interpretar(response.text,
+                                 [(local.id, local.nome, local.cidade) for local in locais],
+                                 [(esp.id, esp.nome) for esp in especialidades],
+                                 len(horarios or []), hoje)
+        except Exception as e:
+            logging.warning(f"Extração estruturada indisponível: {e}. Usando fluxo por etapas.")
+            return None
+
+        # O que o analisador local entende ("sexta de manhã", "depois das 14h") prevalece
+        campos['preferencias'].update(preferencias_locais(mensagem, hoje))
+        logging.info(f"Campos extraídos de '{mensagem}': {campos}")
+        return campos
+
+    def _avancar_agendamento(self, conversa, dados, prefixo=''):
+        """
+        Pula as etapas de agendamento já respondidas (dados['extraido'])
+
+        Preenche local e especialidade extraídos e lista os horários com as
+        preferências extraídas; para na primeira etapa que ainda falta.
+        """
+        from models import Local
+
+        campos = dados.get('extraido') or {}
+        if not dados.get('local_id') and campos.get('local_id'):
+            local = Local.query.get(campos['local_id'])
+            if local and local.ativo:
+                dados['local_id'] = local.id
+                dados['local_nome'] = local.nome
+
+        if not dados.get('local_id'):
+            conversa.set_dados(dados)
+            conversa.estado = 'local'
+            return {
+                'success': True,
+                'message':
+                f"{prefixo}Primeiro, em qual local você gostaria de ser atendido?",
+                'tipo': 'locais',
+                'proximo_estado': 'local'
+            }
+
+        especialidades_disponiveis = self._obter_especialidades_por_local(dados['local_id'])
+        if not especialidades_disponiveis:
+            local_nome = dados.pop('local_nome', 'selecionado')
+            del dados['local_id']
+            conversa.set_dados(dados)
+            conversa.estado = 'local'
+            return {
+                'success': False,
+                'message':
+                f"{prefixo}Desculpe, não há especialidades disponíveis no local {local_nome} no momento. Escolha outro local:",
+                'tipo': 'locais',
+                'proximo_estado': 'local'
+            }
+
+        especialidade = next((esp for esp in especialidades_disponiveis
+                              if esp['id'] == campos.get('especialidade_id')), None)
+        if especialidade:
+            dados['especialidade_id'] = especialidade['id']
+            dados['especialidade_nome'] = especialidade['nome']
+            medicos = motor_disponibilidade.nomes_medicos(especialidade['id'])
+            resposta = self._responder_preferencias(conversa, dados,
+                                                    campos.get('preferencias') or {}, medicos)
+            if resposta['horarios']:
+                dados.pop('extraido', None)
+                conversa.set_dados(dados)
+                conversa.estado = 'horarios'
+                resposta['message'] = (
+                    f"{prefixo}Ótima escolha! {especialidade['nome']} no {dados['local_nome']} ✅\n\n"
+                    f"{resposta['message']}")
+                return resposta
+            del dados['especialidade_id'], dados['especialidade_nome']
+            mensagem = (f"Desculpe, não há horários disponíveis para {especialidade['nome']} "
+                        f"no local {dados['local_nome']} no momento. Escolha outra especialidade:")
+        elif campos.get('especialidade_nome'):
+            mensagem = (f"{campos['especialidade_nome']} não está disponível em {dados['local_nome']}. "
+                        "Escolha uma das especialidades disponíveis:")
+        else:
+            mensagem = (f"Atendimento em **{dados['local_nome']}** selecionado ✅\n\n"
+                        "Agora me diga, qual especialidade você precisa? Pode falar naturalmente, "
+                        "como 'dor de cabeça' ou 'problema no coração'.")
 
-            # Se nada se encaixar, assumir agendamento (mais seguro)
-            return 'agendamento'
+        conversa.set_dados(dados)
+        conversa.estado = 'especialidade'
+        return {
+            'success': True,
+            'message': prefixo + mensagem,
+            'tipo': 'especialidades',
+            'especialidades': especialidades_disponiveis,
+            'proximo_estado': 'especialidade'
+        }
 
     def _processar_cpf(self, mensagem, conversa):
         """Processa CPF e verifica se existe no sistema"""
@@ -297,6 +434,8 @@ class ChatbotService:
                 'paciente_id': paciente.id,
                 'acao_desejada': acao_desejada
             }
+            if dados_temp.get('extraido'):
+                dados['extraido'] = dados_temp['extraido']
             conversa.set_dados(dados)
 
             # Verificar qual ação o usuário quer fazer
@@ -308,6 +447,10 @@ class ChatbotService:
             elif 'consultar' in mensagem_anterior or conversa.estado == 'consulta_agendamentos':
                 return self._processar_consulta_agendamentos_cpf_valido(
                     conversa, paciente)
+            elif dados.get('extraido'):
+                # Local/especialidade já informados na primeira mensagem
+                return self._avancar_agendamento(conversa, dados,
+                                                 f"Olá, {paciente.nome}! 👋\n\n")
             else:
                 # Agendar consulta - primeiro perguntar o local
                 conversa.estado = 'local'
@@ -332,6 +475,8 @@ class ChatbotService:
             # Novo paciente - precisa cadastrar para agendar
             conversa.estado = 'cadastro'
             dados = {'cpf': cpf, 'etapa_cadastro': 'nome'}
+            if dados_temp.get('extraido'):
+                dados['extraido'] = dados_temp['extraido']
             conversa.set_dados(dados)
 
             return {
@@ -509,6 +654,11 @@ class ChatbotService:
             tipo_msg = "plano de saúde 💳" if dados.get(
                 'tipo_atendimento') == 'plano' else "atendimento particular 💰"
 
+            if dados.get('extraido'):
+                return self._avancar_agendamento(
+                    conversa, dados,
+                    f"Cadastro realizado com sucesso, {dados['nome']}! 🎉\n\n📄 Tipo: {tipo_msg}\n\n")
+
             return {
                 'success': True,
                 'message':
@@ -517,7 +667,7 @@ class ChatbotService:
                 'proximo_estado': 'local'
             }
 
-    def _processar_local(self, mensagem, conversa):
+    def _processar_local(self, mensagem, conversa, campos=None):
         """Processa seleção de local de atendimento usando IA AVANÇADA"""
         from models import Local, Especialidade, HorarioDisponivel
 
@@ -530,35 +680,26 @@ class ChatbotService:
             'cidade': local.cidade
         } for local in locais]
 
-        try:
-            prompt = f"""
-            Você é um assistente médico especializado. O usuário está escolhendo um local para atendimento.
+        # Campos da extração estruturada: o local e o que mais a mensagem trouxer
+        if campos is not None:
+            if campos.get('local_id'):
+                dados = conversa.get_dados()
+                dados['extraido'] = combinar(dados.get('extraido'), campos)
+                return self._avancar_agendamento(conversa, dados)
+            return {
+                'success': False,
+                'message':
+                "Não consegui identificar o local desejado. Por favor, escolha uma das opções disponíveis:",
+                'tipo': 'locais',
+                'locais': locais_disponiveis,
+                'proximo_estado': 'local'
+            }
 
-            Mensagem do usuário: "{mensagem}"
-            
-            Locais de atendimento disponíveis:
-            {chr(10).join([f"- {local.nome} (cidade: {local.cidade})" for local in locais])}
-            
-            Analise a mensagem do usuário e identifique qual local ele deseja:
-            
-            Considere:
-            - Nomes de cidades (Contagem, Belo Horizonte, BH)
-            - Nomes dos locais
-            - Variações e apelidos (Contagem = CTG, Belo Horizonte = BH)
-            - Proximidade ou preferência mencionada
-            
-            Se o usuário mencionou um local válido, responda apenas com o nome EXATO do local da lista.
-            Se não conseguir identificar ou se a mensagem for ambígua, responda "não encontrado".
-            
-            Exemplos:
-            "quero em contagem" → Contagem
-            "prefiro bh" → Belo Horizonte  
-            "o mais próximo" → não encontrado (precisa ser mais específico)
-            
-            Resposta:
-            """
+        try:
+            prompt = prompts.LOCAL.montar(
+                mensagem, [f"- {local.nome} (cidade: {local.cidade})" for local in locais])
 
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
 
             local_nome = response.text.strip()
             local_escolhido = None
@@ -689,114 +830,13 @@ class ChatbotService:
         } for esp in especialidades_com_horarios]
 
     def _buscar_horarios_disponiveis_por_local_especialidade(
-            self, local_id, especialidade_id):
+            self, local_id, especialidade_id, preferencias=None):
         """Busca próximos horários disponíveis para uma especialidade em um local específico"""
-        from models import Medico, HorarioDisponivel, Agendamento
-        from datetime import timedelta
+        return motor_disponibilidade.buscar_horarios(especialidade_id,
+                                                     local_id=local_id,
+                                                     preferencias=preferencias)
 
-        hoje = date.today()
-        data_limite = hoje + timedelta(days=30)  # Próximos 30 dias
-
-        # Buscar médicos da especialidade
-        medicos = Medico.query.filter_by(especialidade_id=especialidade_id,
-                                         ativo=True).all()
-
-        horarios_disponiveis = []
-
-        for medico in medicos:
-            # Buscar horários configurados no local específico
-            horarios_config = HorarioDisponivel.query.filter_by(
-                medico_id=medico.id,
-                local_id=local_id,  # Filtrar por local
-                ativo=True).all()
-
-            # Gerar horários dos próximos dias
-            data_atual = hoje
-            while data_atual <= data_limite and len(horarios_disponiveis) < 10:
-                dia_semana = data_atual.weekday()  # 0=segunda
-
-                # Verificar se médico atende neste dia no local
-                horario_config = None
-                for hc in horarios_config:
-                    if hc.dia_semana == dia_semana:
-                        horario_config = hc
-                        break
-
-                if horario_config:
-                    # Gerar slots de horário
-                    hora_atual = datetime.combine(data_atual,
-                                                  horario_config.hora_inicio)
-                    hora_fim = datetime.combine(data_atual,
-                                                horario_config.hora_fim)
-                    duracao = timedelta(
-                        minutes=horario_config.duracao_consulta)
-
-                    while hora_atual + duracao <= hora_fim:
-                        # Verificar se horário já está ocupado por agendamento normal
-                        agendamento_existente = Agendamento.query.filter_by(
-                            medico_id=medico.id,
-                            data=data_atual,
-                            hora=hora_atual.time(),
-                            status='agendado').first()
-
-                        # Verificar se horário está bloqueado por agendamento recorrente
-                        from models import AgendamentoRecorrente
-                        dia_semana = data_atual.weekday()
-                        agendamento_recorrente = AgendamentoRecorrente.query.filter(
-                            AgendamentoRecorrente.medico_id == medico.id,
-                            AgendamentoRecorrente.dia_semana == dia_semana,
-                            AgendamentoRecorrente.hora == hora_atual.time(),
-                            AgendamentoRecorrente.ativo == True,
-                            AgendamentoRecorrente.data_inicio <= data_atual,
-                            (AgendamentoRecorrente.data_fim.is_(None)) |
-                            (AgendamentoRecorrente.data_fim
-                             >= data_atual)).first()
-
-                        # VERIFICAÇÃO ADICIONAL: Slots muito próximos no tempo (buffer de segurança)
-                        agora = datetime.now()
-                        horario_slot = datetime.combine(
-                            data_atual, hora_atual.time())
-
-                        # Não permitir agendamentos com menos de 2 horas de antecedência
-                        if horario_slot <= agora + timedelta(hours=2):
-                            # Pular este slot - muito próximo
-                            pass
-                        elif not agendamento_existente and not agendamento_recorrente:
-                            horarios_disponiveis.append({
-                                'medico_id':
-                                medico.id,
-                                'medico':
-                                medico.nome,
-                                'local_id':
-                                horario_config.local_id,
-                                'local':
-                                horario_config.local_rel.nome
-                                if horario_config.local_rel else 'N/A',
-                                'data':
-                                data_atual.strftime('%Y-%m-%d'),
-                                'data_formatada':
-                                data_atual.strftime('%d/%m/%Y') +
-                                f' ({self._get_dia_semana(data_atual.weekday())})',
-                                'hora':
-                                hora_atual.strftime('%H:%M'),
-                                'hora_formatada':
-                                hora_atual.strftime('%H:%M'),
-                                'dia_semana':
-                                self._get_dia_semana(data_atual.weekday()),
-                                'disponivel_desde':
-                                agora.strftime(
-                                    '%H:%M'
-                                )  # Timestamp de quando ficou disponível
-                            })
-
-                        hora_atual += duracao
-
-                data_atual += timedelta(days=1)
-
-        return sorted(horarios_disponiveis,
-                      key=lambda x: (x['data'], x['hora']))
-
-    def _processar_especialidade(self, mensagem, conversa):
+    def _processar_especialidade(self, mensagem, conversa, campos=None):
         """Processa seleção de especialidade"""
         from models import Especialidade, Medico, HorarioDisponivel
 
@@ -821,49 +861,28 @@ class ChatbotService:
             esp['nome'] for esp in especialidades_disponiveis
         ]
 
+        # Campos da extração estruturada: a especialidade (também por sintomas) e as
+        # preferências de data/hora que vierem junto
+        if campos is not None:
+            if campos.get('especialidade_id'):
+                dados['extraido'] = combinar(dados.get('extraido'), campos)
+                return self._avancar_agendamento(conversa, dados)
+            return {
+                'success': False,
+                'message':
+                "Especialidade não encontrada. Escolha uma das opções disponíveis:",
+                'tipo': 'especialidades',
+                'especialidades': especialidades_disponiveis,
+                'proximo_estado': 'especialidade'
+            }
+
         # Usar IA AVANÇADA para identificar especialidade baseada em sintomas e condições
         try:
-            prompt = f"""
-            Você é um médico especialista em triagem. O usuário está descrevendo sua necessidade médica.
-
-            Mensagem do usuário: "{mensagem}"
-            
-            Especialidades disponíveis no local escolhido:
-            {chr(10).join([f"- {esp['nome']}: {esp['descricao']}" for esp in especialidades_disponiveis])}
-            
-            ANALISE CUIDADOSAMENTE a mensagem e identifique qual especialidade é mais adequada considerando:
-            
-            SINTOMAS E CONDIÇÕES:
-            - Dor de cabeça, enxaqueca, tontura → Clínica Geral ou Neurologia
-            - Dor no peito, palpitação, pressão alta → Cardiologia
-            - Problemas de pele, manchas, coceira → Dermatologia
-            - Problemas nos olhos, visão → Oftalmologia
-            - Problemas de criança, bebê → Pediatria
-            - Problemas femininos, gravidez → Ginecologia
-            - Dor nas costas, ossos, articulações → Ortopedia
-            - Ansiedade, depressão, problemas mentais → Psiquiatria
-            - Check-up, exames gerais → Clínica Geral
-            
-            ESPECIALIDADES MENCIONADAS DIRETAMENTE:
-            - "cardiologista" → Cardiologia
-            - "dermatologista" → Dermatologia
-            - "ginecologista" → Ginecologia
-            - etc.
-            
-            Se conseguir identificar uma especialidade adequada, responda apenas com o nome EXATO da especialidade da lista.
-            Se não conseguir identificar ou for ambíguo, responda "não encontrado".
-            
-            Exemplos:
-            "estou com dor de cabeça" → Clínica Geral
-            "preciso de cardiologista" → Cardiologia
-            "problema na pele" → Dermatologia
-            "meu filho está doente" → Pediatria
-            "quero fazer check-up" → Clínica Geral
-            
-            Resposta:
-            """
+            prompt = prompts.ESPECIALIDADE.montar(mensagem, [
+                f"- {esp['nome']}: {esp['descricao']}" for esp in especialidades_disponiveis
+            ])
 
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
 
             especialidade_nome = response.text.strip()
             especialidade_escolhida = None
@@ -959,45 +978,64 @@ class ChatbotService:
             'proximo_estado': 'horarios'
         }
 
-    def _processar_horarios(self, mensagem, conversa, dados):
+    def _processar_horarios(self, mensagem, conversa, dados, campos=None):
         """Processa seleção de horário"""
-        # Usar IA para identificar qual horário o usuário escolheu
         # CORREÇÃO: Usar a função que filtra por local E especialidade
         local_id = dados.get('local_id')
-        horarios_disponiveis = self._buscar_horarios_disponiveis_por_local_especialidade(
-            local_id, dados['especialidade_id'])
 
+        # A escolha se refere à lista exibida ao paciente (guardada em processar_mensagem);
+        # número, ordinal ou data/hora explícitos são resolvidos sem recalcular nem chamar a IA
+        horarios_exibidos = dados.get('horarios_exibidos')
+        indice = escolher_horario(mensagem, horarios_exibidos)
+        if indice is not None:
+            return self._selecionar_horario(conversa, dados, horarios_exibidos[indice])
+
+        # Preferências ("só de manhã", "sexta à tarde", "com a Dra. Maria") filtram a busca
+        medicos = motor_disponibilidade.nomes_medicos(dados['especialidade_id'])
+        preferencias, mudou = aplicar_preferencias(dados.get('preferencias'), mensagem, medicos)
+        if mudou:
+            return self._responder_preferencias(conversa, dados, preferencias, medicos)
+
+        horarios_disponiveis = horarios_exibidos or self._buscar_horarios_disponiveis_por_local_especialidade(
+            local_id, dados['especialidade_id'], preferencias)[:5]
+
+        # Extração estruturada do turno: opção escolhida ou novas preferências
+        if campos is not None:
+            if campos['opcao'] is not None:
+                return self._selecionar_horario(conversa, dados,
+                                                horarios_disponiveis[campos['opcao']])
+            if campos['preferencias']:
+                return self._responder_preferencias(
+                    conversa, dados, {**preferencias, **campos['preferencias']}, medicos)
+            return {
+                'success': False,
+                'message':
+                "Opção inválida. Escolha um dos horários disponíveis digitando o número (1-5):",
+                'tipo': 'horarios',
+                'horarios': horarios_disponiveis,
+                'proximo_estado': 'horarios'
+            }
+
+        # Usar IA para identificar qual horário o usuário escolheu
         prompt = f"""
         O usuário disse: "{mensagem}"
         
         Horários disponíveis:
-        {self._formatar_horarios_para_ia(horarios_disponiveis[:5])}
+        {self._formatar_horarios_para_ia(horarios_disponiveis)}
         
         Qual horário o usuário escolheu? Responda apenas com o número da opção (1-5) ou "não encontrado".
         """
 
         try:
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
 
             opcao = response.text.strip()
 
             try:
                 indice = int(opcao) - 1
                 if 0 <= indice < len(horarios_disponiveis):
-                    horario_escolhido = horarios_disponiveis[indice]
-
-                    # Salvar escolha
-                    dados['horario_escolhido'] = horario_escolhido
-                    conversa.set_dados(dados)
-                    conversa.estado = 'confirmacao'
-
-                    return {
-                        'success': True,
-                        'message':
-                        f"Perfeito! Você escolheu:\n\n📅 {horario_escolhido['data_formatada']}\n🕐 {horario_escolhido['hora_formatada']}\n👨‍⚕️ Dr(a). {horario_escolhido['medico']}\n🏥 {dados['especialidade_nome']}\n📍 {horario_escolhido['local']}\n\nConfirma o agendamento? (Digite 'sim' para confirmar ou 'não' para escolher outro horário)",
-                        'tipo': 'confirmacao',
-                        'proximo_estado': 'confirmacao'
-                    }
+                    return self._selecionar_horario(conversa, dados,
+                                                    horarios_disponiveis[indice])
                 else:
                     raise ValueError("Índice inválido")
 
@@ -1007,7 +1045,7 @@ class ChatbotService:
                     'message':
                     "Opção inválida. Escolha um dos horários disponíveis digitando o número (1-5):",
                     'tipo': 'horarios',
-                    'horarios': horarios_disponiveis[:5],
+                    'horarios': horarios_disponiveis,
                     'proximo_estado': 'horarios'
                 }
 
@@ -1017,10 +1055,68 @@ class ChatbotService:
                 'success': False,
                 'message': "Erro ao processar horário. Escolha uma opção:",
                 'tipo': 'horarios',
-                'horarios': horarios_disponiveis[:5],
+                'horarios': horarios_disponiveis,
                 'proximo_estado': 'horarios'
             }
 
+    def _selecionar_horario(self, conversa, dados, horario_escolhido):
+        """Reserva o horário escolhido e pede a confirmação"""
+        # Segurar o slot até a confirmação para que outra conversa não o escolha
+        if not motor_disponibilidade.reservar_horario(horario_escolhido, conversa.session_id):
+            return {
+                'success': False,
+                'message':
+                "❌ Este horário acabou de ser reservado por outro paciente. Escolha outro horário disponível:",
+                'tipo': 'horarios_atualizados',
+                'horarios': self._buscar_horarios_disponiveis_por_local_especialidade(
+                    dados.get('local_id'), dados['especialidade_id'],
+                    dados.get('preferencias'))[:5],
+                'proximo_estado': 'horarios'
+            }
+
+        # Salvar escolha
+        dados['horario_escolhido'] = horario_escolhido
+        conversa.set_dados(dados)
+        conversa.estado = 'confirmacao'
+
+        return {
+            'success': True,
+            'message':
+            f"Perfeito! Você escolheu:\n\n📅 {horario_escolhido['data_formatada']}\n🕐 {horario_escolhido['hora_formatada']}\n👨‍⚕️ Dr(a). {horario_escolhido['medico']}\n🏥 {dados['especialidade_nome']}\n📍 {horario_escolhido['local']}\n\nConfirma o agendamento? (Digite 'sim' para confirmar ou 'não' para escolher outro horário)",
+            'tipo': 'confirmacao',
+            'proximo_estado': 'confirmacao'
+        }
+
+    def _responder_preferencias(self, conversa, dados, preferencias, medicos):
+        """Lista os horários que atendem às novas preferências do paciente"""
+        horarios = self._buscar_horarios_disponiveis_por_local_especialidade(
+            dados.get('local_id'), dados['especialidade_id'], preferencias)
+        descricao = descrever_preferencias(preferencias, medicos)
+
+        if not horarios:
+            horarios = self._buscar_horarios_disponiveis_por_local_especialidade(
+                dados.get('local_id'), dados['especialidade_id'], dados.get('preferencias'))
+            return {
+                'success': False,
+                'message':
+                f"Não encontrei horários {descricao}. Estes são os próximos disponíveis (escolha de 1 a 5):",
+                'tipo': 'horarios',
+                'horarios': horarios[:5],
+                'proximo_estado': 'horarios'
+            }
+
+        dados['preferencias'] = preferencias
+        conversa.set_dados(dados)
+        return {
+            'success': True,
+            'message':
+            f"Aqui estão os próximos horários {descricao}:" if descricao else
+            "Aqui estão os próximos horários disponíveis:",
+            'tipo': 'horarios',
+            'horarios': horarios[:5],
+            'proximo_estado': 'horarios'
+        }
+
     def _processar_confirmacao(self, mensagem, conversa, dados):
         """Processa confirmação do agendamento"""
         resposta = mensagem.strip().lower()
@@ -1038,6 +1134,10 @@ class ChatbotService:
                                                  '%Y-%m-%d').date()
             hora_agendamento = datetime.strptime(horario['hora'],
                                                  '%H:%M').time()
+            # A consulta ocupa [hora, hora_fim) pela duração atual da grade do médico
+            hora_fim_agendamento = datetime.strptime(
+                motor_disponibilidade.hora_fim_slot(medico_id, data_agendamento,
+                                                    hora_agendamento), '%H:%M').time()
 
             # VALIDAÇÃO 1: Especialidades duplicadas
             bloquear_duplicadas = Configuracao.get_valor(
@@ -1050,6 +1150,7 @@ class ChatbotService:
                     >= date.today()).first()
 
                 if agendamento_existente:
+                    motor_disponibilidade.liberar_reserva(conversa.session_id)
                     from models import Paciente, Especialidade
                     paciente = Paciente.query.get(paciente_id)
                     especialidade = Especialidade.query.get(especialidade_id)
@@ -1061,17 +1162,30 @@ class ChatbotService:
                         'proximo_estado': 'inicio'
                     }
 
+            # Renovar a reserva: se expirou e outro paciente pegou o slot, escolher outro
+            if not motor_disponibilidade.reservar_horario(horario, conversa.session_id):
+                conversa.estado = 'horarios'
+                return {
+                    'success': False,
+                    'message':
+                    f"❌ O tempo de reserva expirou e este horário foi reservado por outro paciente.\n\n⏰ Horário: {horario['hora_formatada']} de {data_agendamento.strftime('%d/%m/%Y')}\n\n🔄 Por favor, escolha outro horário disponível:",
+                    'tipo': 'horarios_atualizados',
+                    'horarios': self._buscar_horarios_disponiveis_por_local_especialidade(
+                        horario['local_id'], especialidade_id)[:5],
+                    'proximo_estado': 'horarios'
+                }
+
             # Buscar informações do médico para validar agenda recorrente
             medico = Medico.query.get(medico_id)
 
             # VALIDAÇÃO CRÍTICA: Verificar se horário ainda está disponível (prevenção de race condition)
-            agendamento_conflito = Agendamento.query.filter_by(
-                medico_id=medico_id,
-                data=data_agendamento,
-                hora=hora_agendamento,
-                status='agendado').first()
+            # Qualquer consulta que sobreponha o intervalo conflita, mesmo com outra duração
+            agendamento_conflito = motor_disponibilidade.fonte.conflito_agendamento(
+                medico_id, data_agendamento, minutos(hora_agendamento),
+                minutos(hora_fim_agendamento))
 
             if agendamento_conflito:
+                motor_disponibilidade.liberar_reserva(conversa.session_id)
                 return {
                     'success':
                     False,
@@ -1092,13 +1206,15 @@ class ChatbotService:
             recorrente_conflito = AgendamentoRecorrente.query.filter(
                 AgendamentoRecorrente.medico_id == medico_id,
                 AgendamentoRecorrente.dia_semana == dia_semana_agendamento,
-                AgendamentoRecorrente.hora == hora_agendamento,
+                AgendamentoRecorrente.hora >= hora_agendamento,
+                AgendamentoRecorrente.hora < hora_fim_agendamento,
                 AgendamentoRecorrente.ativo == True,
                 AgendamentoRecorrente.data_inicio <= data_agendamento,
                 (AgendamentoRecorrente.data_fim.is_(None)) |
                 (AgendamentoRecorrente.data_fim >= data_agendamento)).first()
 
             if recorrente_conflito:
+                motor_disponibilidade.liberar_reserva(conversa.session_id)
                 return {
                     'success':
                     False,
@@ -1120,6 +1236,7 @@ class ChatbotService:
                                            local_id=horario['local_id'],
                                            data=data_agendamento,
                                            hora=hora_agendamento,
+                                           hora_fim=hora_fim_agendamento,
                                            status='agendado')
 
             db.session.add(novo_agendamento)
@@ -1152,6 +1269,16 @@ class ChatbotService:
 
             db.session.commit()
 
+            # Atualizar matriz de ocupação em memória
+            motor_disponibilidade.matriz.registrar_agendamento(
+                medico_id, data_agendamento, hora_agendamento, hora_fim_agendamento)
+            if medico and medico.agenda_recorrente:
+                motor_disponibilidade.matriz.registrar_recorrente(
+                    medico_id, dia_semana, hora_agendamento, data_agendamento,
+                    data_fim)
+            # O agendamento já ocupa o slot na matriz: a reserva não é mais necessária
+            motor_disponibilidade.liberar_reserva(conversa.session_id)
+
             # Finalizar conversa
             conversa.estado = 'finalizado'
 
@@ -1215,7 +1342,8 @@ class ChatbotService:
             }
 
         elif resposta in ['não', 'nao', 'n', 'cancelar', 'não confirmo']:
-            # Voltar para escolha de horários
+            # Voltar para escolha de horários, devolvendo o slot reservado
+            motor_disponibilidade.liberar_reserva(conversa.session_id)
             conversa.estado = 'horarios'
             local_id = dados.get('local_id')
             horarios_disponiveis = self._buscar_horarios_disponiveis_por_local_especialidade(
@@ -1312,7 +1440,7 @@ class ChatbotService:
             """
 
             try:
-                response = model.generate_content(prompt)
+                response = cliente_ia.gerar(prompt)
 
                 opcao = response.text.strip()
 
@@ -1327,6 +1455,9 @@ class ChatbotService:
                         agendamento.motivo_cancelamento = 'Cancelado pelo paciente via chatbot'
 
                         db.session.commit()
+                        motor_disponibilidade.matriz.liberar_agendamento(
+                            agendamento.medico_id, agendamento.data,
+                            agendamento.hora, agendamento.hora_fim)
 
                         conversa.estado = 'finalizado'
 
@@ -1363,108 +1494,7 @@ class ChatbotService:
 
     def _buscar_horarios_disponiveis(self, especialidade_id):
         """Busca próximos horários disponíveis para uma especialidade"""
-        from models import Medico, HorarioDisponivel, Agendamento
-        from datetime import timedelta
-
-        hoje = date.today()
-        data_limite = hoje + timedelta(days=30)  # Próximos 30 dias
-
-        # Buscar médicos da especialidade
-        medicos = Medico.query.filter_by(especialidade_id=especialidade_id,
-                                         ativo=True).all()
-
-        horarios_disponiveis = []
-
-        for medico in medicos:
-            # Buscar horários configurados
-            horarios_config = HorarioDisponivel.query.filter_by(
-                medico_id=medico.id, ativo=True).all()
-
-            # Gerar horários dos próximos dias
-            data_atual = hoje
-            while data_atual <= data_limite and len(horarios_disponiveis) < 10:
-                dia_semana = data_atual.weekday()  # 0=segunda
-
-                # Verificar se médico atende neste dia
-                horario_config = None
-                for hc in horarios_config:
-                    if hc.dia_semana == dia_semana:
-                        horario_config = hc
-                        break
-
-                if horario_config:
-                    # Gerar slots de horário
-                    hora_atual = datetime.combine(data_atual,
-                                                  horario_config.hora_inicio)
-                    hora_fim = datetime.combine(data_atual,
-                                                horario_config.hora_fim)
-                    duracao = timedelta(
-                        minutes=horario_config.duracao_consulta)
-
-                    while hora_atual + duracao <= hora_fim:
-                        # Verificar se horário já está ocupado por agendamento normal
-                        agendamento_existente = Agendamento.query.filter_by(
-                            medico_id=medico.id,
-                            data=data_atual,
-                            hora=hora_atual.time(),
-                            status='agendado').first()
-
-                        # Verificar se horário está bloqueado por agendamento recorrente
-                        from models import AgendamentoRecorrente
-                        dia_semana = data_atual.weekday()
-                        agendamento_recorrente = AgendamentoRecorrente.query.filter(
-                            AgendamentoRecorrente.medico_id == medico.id,
-                            AgendamentoRecorrente.dia_semana == dia_semana,
-                            AgendamentoRecorrente.hora == hora_atual.time(),
-                            AgendamentoRecorrente.ativo == True,
-                            AgendamentoRecorrente.data_inicio <= data_atual,
-                            (AgendamentoRecorrente.data_fim.is_(None)) |
-                            (AgendamentoRecorrente.data_fim
-                             >= data_atual)).first()
-
-                        # VERIFICAÇÃO ADICIONAL: Slots muito próximos no tempo (buffer de segurança)
-                        agora = datetime.now()
-                        horario_slot = datetime.combine(
-                            data_atual, hora_atual.time())
-
-                        # Não permitir agendamentos com menos de 2 horas de antecedência
-                        if horario_slot <= agora + timedelta(hours=2):
-                            # Pular este slot - muito próximo
-                            pass
-                        elif not agendamento_existente and not agendamento_recorrente:
-                            horarios_disponiveis.append({
-                                'medico_id':
-                                medico.id,
-                                'medico':
-                                medico.nome,
-                                'local_id':
-                                horario_config.local_id,
-                                'local':
-                                horario_config.local_rel.nome
-                                if horario_config.local_rel else 'N/A',
-                                'data':
-                                data_atual.strftime('%Y-%m-%d'),
-                                'data_formatada':
-                                data_atual.strftime('%d/%m/%Y') +
-                                f' ({self._get_dia_semana(data_atual.weekday())})',
-                                'hora':
-                                hora_atual.strftime('%H:%M'),
-                                'hora_formatada':
-                                hora_atual.strftime('%H:%M'),
-                                'dia_semana':
-                                self._get_dia_semana(data_atual.weekday()),
-                                'disponivel_desde':
-                                agora.strftime(
-                                    '%H:%M'
-                                )  # Timestamp de quando ficou disponível
-                            })
-
-                        hora_atual += duracao
-
-                data_atual += timedelta(days=1)
-
-        return sorted(horarios_disponiveis,
-                      key=lambda x: (x['data'], x['hora']))
+        return motor_disponibilidade.buscar_horarios(especialidade_id)
 
     def _extrair_cpf(self, texto):
         """Extrai CPF do texto"""
@@ -1508,7 +1538,7 @@ class ChatbotService:
             texto += f"{i}. {ag.data.strftime('%d/%m/%Y')} às {ag.hora.strftime('%H:%M')} - Dr(a). {ag.medico_rel.nome} ({ag.especialidade_rel.nome})\n"
         return texto
 
-    def _eh_saudacao(self, mensagem):
+    def _eh_saudacao(self, mensagem, campos=None):
         """Detecta se a mensagem é uma saudação para resetar conversa"""
         mensagem_lower = mensagem.lower().strip()
 
@@ -1526,21 +1556,15 @@ class ChatbotService:
                     saudacao + ' '):
                 return True
 
+        # A extração estruturada do turno já respondeu
+        if campos is not None:
+            return campos['saudacao']
+
         # Usar IA para detectar saudações mais complexas
         try:
-            prompt = f"""
-            Analise se esta mensagem é uma saudação ou cumprimento que indica que o usuário quer COMEÇAR uma nova conversa:
-            
-            Mensagem: "{mensagem}"
-            
-            Responda APENAS "sim" se for uma saudação/cumprimento que indica início de conversa.
-            Responda APENAS "não" se não for uma saudação ou se for parte de uma conversa já em andamento.
-            
-            Exemplos de SIM: "oi", "olá", "bom dia", "oi tudo bem", "olá, preciso agendar"
-            Exemplos de NÃO: "5", "sim", "cardiologia", "12345678901", "não"
-            """
+            prompt = prompts.SAUDACAO.montar(mensagem)
 
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
 
             resultado = response.text.strip().lower(
             ) if response.text else "não"
@@ -1725,5 +1749,14 @@ class ChatbotService:
         }
 
 
+# Instância global do motor de disponibilidade (matriz de ocupação em memória)
+motor_disponibilidade = MotorDisponibilidade(FonteSQLAlchemy())
+
+# Intenções já classificadas pelo Gemini (SQLite compartilhado entre workers)
+cache_intencoes = criar_cache_intencoes()
+
+# Classificador local que evita o Gemini nas mensagens de intenção clara
+classificador_intencoes = criar_classificador()
+
 # Instância global do serviço
 chatbot_service = ChatbotService()
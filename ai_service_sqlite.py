@@ -4,6 +4,14 @@ import logging
 from datetime import datetime, date, time, timedelta
 import google.generativeai as genai
 
+from cache_intencoes import criar_cache_intencoes
+from classificador_intencoes import criar_classificador
+from cliente_ia import criar_cliente_ia
+from disponibilidade import MotorDisponibilidade, FonteSQLite
+from preferencias import (aplicar_preferencias, descrever_preferencias, escolher_horario,
+                          menciona_horario)
+import prompts
+
 # Importar novos modelos SQLite
 from models_sqlite import (
     Paciente, Local, Especialidade, Medico, HorarioDisponivel, 
@@ -22,6 +30,9 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-1.5-flash')
 
+# Chamadas com prazo e hedge: estourado o prazo, cada handler usa sua heurística
+cliente_ia = criar_cliente_ia(model)
+
 class ChatbotService:
     """Serviço de chatbot para agendamento médico usando Gemini"""
 
@@ -39,6 +50,12 @@ class ChatbotService:
         Returns:
             dict: Resposta do chatbot com próxima ação
         """
+        # Todas as chamadas ao Gemini do turno dividem um único orçamento de tempo
+        with cliente_ia.orcamento_turno():
+            return self._processar_estado(mensagem, conversa)
+
+    def _processar_estado(self, mensagem, conversa):
+        """Encaminha a mensagem ao processador do estado atual da conversa"""
         try:
             estado = conversa.estado or 'inicio'
             dados = conversa.get_dados() or {}
@@ -171,62 +188,21 @@ class ChatbotService:
 
     def _detectar_tipo_mensagem(self, mensagem):
         """Detecta o tipo de mensagem com IA e fallback inteligente"""
-        # FALLBACK 1: Regras básicas para casos críticos
-        mensagem_lower = mensagem.lower().strip()
-
-        # Palavras-chave para detecção básica
-        if any(palavra in mensagem_lower for palavra in
-               ['cancelar', 'desmarcar', 'remover consulta', 'cancelo']):
-            return 'cancelamento'
-
-        if any(palavra in mensagem_lower for palavra in [
-                'meus agendamentos', 'minhas consultas',
-                'consultar agendamento', 'ver consultas'
-        ]):
-            return 'consulta'
+        # FALLBACK 1: Classificador local; só mensagens com baixa confiança vão ao Gemini
+        tipo_local = classificador_intencoes.decidir(mensagem)
+        if tipo_local:
+            return tipo_local
 
-        if any(palavra in mensagem_lower for palavra in [
-                'telefone', 'endereço', 'onde fica', 'horário funcionamento',
-                'localização'
-        ]):
-            return 'informacao'
-
-        if any(palavra in mensagem_lower for palavra in
-               ['clima', 'tempo', 'futebol', 'política', 'receita culinária']):
-            return 'fora_escopo'
+        # Mensagens já classificadas pela IA (mesmo texto normalizado) não voltam ao Gemini
+        tipo_em_cache = cache_intencoes.obter(mensagem)
+        if tipo_em_cache:
+            return tipo_em_cache
 
         # FALLBACK 2: Tentar usar IA com tratamento robusto
         try:
-            prompt = f"""
-            Você é um assistente médico virtual especializado em agendamentos. Analise cuidadosamente a mensagem do usuário e classifique com máxima precisão.
-
-            Mensagem do usuário: "{mensagem}"
-            
-            Classifique a mensagem em uma das categorias, considerando contexto, intenção e nuances:
-            
-            1. "agendamento" - Qualquer intenção de agendar consulta, marcar horário, saudações iniciais (oi, olá, boa tarde), pedidos de ajuda para marcar consulta, menções de sintomas ou necessidade médica
-            
-            2. "cancelamento" - Intenção clara de cancelar, desmarcar ou remover agendamento existente
-            
-            3. "consulta" - Quer verificar, ver, listar seus agendamentos ou consultas já marcadas
-            
-            4. "informacao" - Perguntas sobre a clínica (telefone, endereço, horários de funcionamento, médicos disponíveis, especialidades oferecidas, localização)
-            
-            5. "fora_escopo" - Conversas casuais não relacionadas à clínica, perguntas pessoais, assuntos não médicos ou de agendamento
-            
-            Exemplos:
-            - "oi" → agendamento
-            - "preciso de uma consulta" → agendamento  
-            - "estou com dor de cabeça" → agendamento
-            - "quero cancelar minha consulta" → cancelamento
-            - "quais são meus agendamentos?" → consulta
-            - "qual o telefone da clínica?" → informacao
-            - "como está o tempo?" → fora_escopo
-            
-            Responda APENAS com uma palavra: agendamento, cancelamento, consulta, informacao, fora_escopo
-            """
+            prompt = prompts.INTENCAO.montar(mensagem)
 
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
 
             resultado = response.text.strip().lower(
             ) if response.text else "agendamento"
@@ -239,6 +215,8 @@ class ChatbotService:
                 logging.info(
                     f"IA detectou tipo '{resultado}' para mensagem: '{mensagem}'"
                 )
+                cache_intencoes.guardar(mensagem, resultado)
+                classificador_intencoes.registrar_exemplo(mensagem, resultado)
                 return resultado
             else:
                 logging.warning(
@@ -251,18 +229,8 @@ class ChatbotService:
                 f"IA temporariamente indisponível: {e}. Usando fallback inteligente."
             )
 
-            # FALLBACK 3: Lógica heurística avançada
-            # Saudações e sintomas -> agendamento
-            if any(palavra in mensagem_lower for palavra in [
-                    'oi', 'olá', 'ola', 'bom dia', 'boa tarde', 'boa noite',
-                    'hello', 'hi', 'dor', 'problema', 'consulta', 'médico',
-                    'doutor', 'sintoma', 'doença', 'preciso', 'quero marcar',
-                    'agendar', 'emergência'
-            ]):
-                return 'agendamento'
-
-            # Se nada se encaixar, assumir agendamento (mais seguro)
-            return 'agendamento'
+            # FALLBACK 3: Melhor palpite do classificador local, mesmo com baixa confiança
+            return classificador_intencoes.classificar(mensagem)[0]
 
     def _processar_cpf(self, mensagem, conversa):
         """Processa CPF e verifica se existe no sistema"""
@@ -519,21 +487,10 @@ class ChatbotService:
         } for local in locais]
 
         try:
-            prompt = f"""
-            Você é um assistente médico especializado. O usuário está escolhendo um local para atendimento.
+            prompt = prompts.LOCAL_SIMPLES.montar(
+                mensagem, [f"- {local.nome} (cidade: {local.cidade})" for local in locais])
 
-            Mensagem do usuário: "{mensagem}"
-            
-            Locais de atendimento disponíveis:
-            {chr(10).join([f"- {local.nome} (cidade: {local.cidade})" for local in locais])}
-            
-            Analise a mensagem e identifique qual local o usuário quer escolher.
-            Se não conseguir identificar um local específico, responda "indefinido".
-            
-            Responda APENAS com o nome EXATO do local escolhido ou "indefinido".
-            """
-
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
             escolha_ia = response.text.strip() if response.text else ""
 
             # Tentar encontrar o local escolhido
@@ -625,27 +582,11 @@ class ChatbotService:
         especialidades_info = [f"{esp.nome} - {esp.descricao or 'Sem descrição'}" for esp in especialidades]
 
         try:
-            prompt = f"""
-            Você é um assistente médico especializado. O usuário está escolhendo uma especialidade médica.
-
-            Mensagem do usuário: "{mensagem}"
-            
-            Especialidades médicas disponíveis:
-            {chr(10).join([f"- {esp.nome}: {esp.descricao or 'Especialidade médica'}" for esp in especialidades])}
-            
-            Analise a mensagem do usuário e identifique qual especialidade médica ele precisa.
-            Considere:
-            - Sintomas mencionados
-            - Tipo de problema de saúde
-            - Menção direta da especialidade
-            - Contexto médico
-            
-            Se não conseguir identificar uma especialidade específica, responda "indefinido".
-            
-            Responda APENAS com o nome EXATO da especialidade escolhida ou "indefinido".
-            """
+            prompt = prompts.ESPECIALIDADE_SIMPLES.montar(mensagem, [
+                f"- {esp.nome}: {esp.descricao or 'Especialidade médica'}" for esp in especialidades
+            ])
 
-            response = model.generate_content(prompt)
+            response = cliente_ia.gerar(prompt)
             escolha_ia = response.text.strip() if response.text else ""
 
             # Tentar encontrar a especialidade escolhida
@@ -790,8 +731,26 @@ class ChatbotService:
                 'proximo_estado': 'especialidade'
             }
 
+        # Preferências ("só de manhã", "sexta à tarde", "a partir de 20/10") filtram a busca
+        medicos = motor_disponibilidade.nomes_medicos(especialidade_id)
+        preferencias, mudou = aplicar_preferencias(dados.get('preferencias'), mensagem, medicos)
+
         # Gerar horários disponíveis
-        horarios_disponiveis = self._gerar_horarios_disponiveis(rows)
+        horarios_disponiveis = self._gerar_horarios_disponiveis(rows, preferencias)
+        
+        if not horarios_disponiveis and preferencias:
+            descricao = descrever_preferencias(preferencias, medicos)
+            horarios_disponiveis = self._gerar_horarios_disponiveis(rows, dados.get('preferencias'))
+            if horarios_disponiveis:
+                horarios_texto = self._formatar_horarios_para_exibicao(horarios_disponiveis)
+                return {
+                    'success': False,
+                    'message': f"Não encontrei horários {descricao}.\n\n📅 **Horários Disponíveis:**\n\n{horarios_texto}\n\n" +
+                              f"Digite a **data e horário** desejados (ex: '10/01 às 14:00' ou 'amanhã 9h'):",
+                    'tipo': 'horarios',
+                    'horarios': horarios_disponiveis,
+                    'proximo_estado': 'horarios'
+                }
         
         if not horarios_disponiveis:
             return {
@@ -801,9 +760,30 @@ class ChatbotService:
                 'proximo_estado': 'inicio'
             }
 
-        # Tentar interpretar a escolha do usuário
-        escolha = self._interpretar_escolha_horario(mensagem, horarios_disponiveis)
+        if mudou:
+            dados['preferencias'] = preferencias
+            conversa.set_dados(dados)
+
+        # Tentar interpretar a escolha do usuário; mensagens só de preferência
+        # ("sexta à tarde") mostram a lista filtrada em vez de escolher o primeiro
+        escolha = None
+        if not mudou or menciona_horario(mensagem):
+            escolha = self._interpretar_escolha_horario(mensagem, horarios_disponiveis)
         
+        if escolha and not motor_disponibilidade.reservar_horario(escolha, conversa.session_id):
+            # Outra conversa segura este slot até confirmar ou expirar a reserva
+            horarios_disponiveis = self._gerar_horarios_disponiveis(rows, preferencias)
+            horarios_texto = self._formatar_horarios_para_exibicao(horarios_disponiveis)
+            return {
+                'success': False,
+                'message': "❌ Este horário acabou de ser reservado por outro paciente.\n\n" +
+                          f"📅 **Horários Disponíveis:**\n\n{horarios_texto}\n\n" +
+                          f"Digite a **data e horário** desejados (ex: '10/01 às 14:00' ou 'amanhã 9h'):",
+                'tipo': 'horarios',
+                'horarios': horarios_disponiveis,
+                'proximo_estado': 'horarios'
+            }
+
         if escolha:
             # Salvar escolha e ir para confirmação
             dados.update({
@@ -854,6 +834,35 @@ class ChatbotService:
         if any(palavra in mensagem_lower for palavra in ['sim', 's', 'confirmo', 'ok', 'confirmar']):
             # Confirmar agendamento
             try:
+                data_agendamento = datetime.strptime(dados['data_agendamento'], '%Y-%m-%d').date()
+                hora_agendamento = datetime.strptime(dados['hora_agendamento'], '%H:%M').time()
+                # A consulta ocupa [hora, hora_fim) pela duração atual da grade do médico
+                inicio, fim = motor_disponibilidade.intervalo_slot(
+                    dados['medico_id'], data_agendamento, hora_agendamento)
+                # Renovar a reserva: se expirou e outro paciente pegou o slot, ele não está mais livre
+                reservado = motor_disponibilidade.reservar_horario(
+                    {'medico_id': dados['medico_id'], 'data': dados['data_agendamento'],
+                     'hora': dados['hora_agendamento']}, conversa.session_id)
+                if not reservado or motor_disponibilidade.fonte.conflito_agendamento(
+                        dados['medico_id'], data_agendamento, inicio, fim):
+                    if reservado:
+                        motor_disponibilidade.liberar_reserva(conversa.session_id)
+                    conversa.estado = 'horarios'
+                    horarios = motor_disponibilidade.buscar_horarios(
+                        dados['especialidade_id'], local_id=dados['local_id'],
+                        preferencias=dados.get('preferencias'))
+                    return {
+                        'success': False,
+                        'message': "❌ Este horário acabou de ser ocupado por outro paciente!\n\n" +
+                                  f"📅 **Horários Disponíveis:**\n\n{self._formatar_horarios_para_exibicao(horarios)}\n\n" +
+                                  f"Digite a **data e horário** desejados (ex: '10/01 às 14:00' ou 'amanhã 9h'):",
+                        'tipo': 'horarios',
+                        'horarios': horarios,
+                        'proximo_estado': 'horarios'
+                    }
+                hora_fim = motor_disponibilidade.hora_fim_slot(
+                    dados['medico_id'], data_agendamento, hora_agendamento)
+
                 agendamento = Agendamento.create(
                     paciente_id=conversa.paciente_id,
                     medico_id=dados['medico_id'],
@@ -861,8 +870,13 @@ class ChatbotService:
                     local_id=dados['local_id'],
                     data=dados['data_agendamento'],
                     hora=dados['hora_agendamento'],
+                    hora_fim=hora_fim,
                     observacoes=""
                 )
+                motor_disponibilidade.matriz.registrar_agendamento(
+                    dados['medico_id'], data_agendamento, dados['hora_agendamento'], hora_fim)
+                # O agendamento já ocupa o slot na matriz: a reserva não é mais necessária
+                motor_disponibilidade.liberar_reserva(conversa.session_id)
 
                 conversa.estado = 'finalizado'
                 conversa.set_dados({})
@@ -897,7 +911,8 @@ class ChatbotService:
                 }
         
         elif any(palavra in mensagem_lower for palavra in ['não', 'nao', 'n', 'cancelar', 'voltar']):
-            # Cancelar e voltar
+            # Cancelar e voltar, devolvendo o slot reservado
+            motor_disponibilidade.liberar_reserva(conversa.session_id)
             conversa.estado = 'horarios'
             return {
                 'success': True,
@@ -979,137 +994,18 @@ class ChatbotService:
         except:
             return None
 
-    def _gerar_horarios_disponiveis(self, rows):
+    def _gerar_horarios_disponiveis(self, rows, preferencias=None):
         """Gera horários disponíveis a partir dos dados do banco"""
-        # Implementação simplificada - você pode expandir conforme necessário
-        from datetime import datetime, timedelta
-        
-        horarios = []
-        hoje = datetime.now().date()
-        
-        # Processar próximos 14 dias
-        for i in range(14):
-            data_atual = hoje + timedelta(days=i)
-            dia_semana = data_atual.weekday()
-            
-            for row in rows:
-                if row['dia_semana'] == dia_semana:
-                    # Gerar slots de horário baseado na duração
-                    hora_inicio = datetime.strptime(row['hora_inicio'], '%H:%M').time()
-                    hora_fim = datetime.strptime(row['hora_fim'], '%H:%M').time()
-                    duracao = row['duracao_consulta']
-                    
-                    # Criar slots
-                    slot_atual = datetime.combine(data_atual, hora_inicio)
-                    hora_fim_datetime = datetime.combine(data_atual, hora_fim)
-                    
-                    while slot_atual < hora_fim_datetime:
-                        # Verificar se slot não está ocupado
-                        if self._verificar_disponibilidade_slot(row['medico_id'], data_atual, slot_atual.time()):
-                            horarios.append({
-                                'medico_id': row['medico_id'],
-                                'medico_nome': row['nome'],
-                                'data': data_atual.strftime('%Y-%m-%d'),
-                                'hora': slot_atual.time().strftime('%H:%M'),
-                                'data_formatada': data_atual.strftime('%d/%m/%Y'),
-                                'hora_formatada': slot_atual.time().strftime('%H:%M')
-                            })
-                        
-                        slot_atual += timedelta(minutes=duracao)
-        
-        return horarios[:10]  # Limitar a 10 horários para não sobrecarregar
-
-    def _verificar_disponibilidade_slot(self, medico_id, data, hora):
-        """Verifica se um slot específico está disponível"""
-        from database import db
-        
-        # Verificar agendamentos regulares
-        query = """
-            SELECT COUNT(*) as count FROM agendamentos 
-            WHERE medico_id = ? AND data = ? AND hora = ? AND status = 'agendado'
-        """
-        result = db.execute_query(query, (medico_id, data.strftime('%Y-%m-%d'), hora.strftime('%H:%M')))
-        
-        if result and result[0]['count'] > 0:
-            return False
-        
-        # Verificar agendamentos recorrentes
-        dia_semana = data.weekday()
-        query_recorrente = """
-            SELECT COUNT(*) as count FROM agendamentos_recorrentes 
-            WHERE medico_id = ? AND dia_semana = ? AND hora = ? AND ativo = 1
-            AND data_inicio <= ? AND (data_fim IS NULL OR data_fim >= ?)
-        """
-        result_recorrente = db.execute_query(query_recorrente, 
-                                           (medico_id, dia_semana, hora.strftime('%H:%M'), 
-                                            data.strftime('%Y-%m-%d'), data.strftime('%Y-%m-%d')))
-        
-        if result_recorrente and result_recorrente[0]['count'] > 0:
-            return False
-            
-        return True
+        # rows vêm da consulta médico + horário para uma especialidade/local
+        return motor_disponibilidade.buscar_horarios(rows[0]['especialidade_id'],
+                                                     local_id=rows[0]['local_id'],
+                                                     preferencias=preferencias)
 
     def _interpretar_escolha_horario(self, mensagem, horarios_disponiveis):
-        """Interpreta a escolha de horário do usuário"""
-        # Implementação simplificada - pode ser expandida com IA
-        mensagem_lower = mensagem.lower().strip()
-        
-        # Tentar encontrar data e hora na mensagem
-        import re
-        
-        # Padrões para data
-        data_patterns = [
-            r'(\d{1,2})/(\d{1,2})',  # 10/01
-            r'(\d{1,2})-(\d{1,2})',  # 10-01
-            r'(\d{1,2})\.(\d{1,2})',  # 10.01
-        ]
-        
-        # Padrões para hora
-        hora_patterns = [
-            r'(\d{1,2}):(\d{2})',    # 14:00
-            r'(\d{1,2})h(\d{2})?',   # 14h00 ou 14h
-            r'(\d{1,2}) horas?',     # 14 horas
-        ]
-        
-        data_encontrada = None
-        hora_encontrada = None
-        
-        # Buscar data
-        for pattern in data_patterns:
-            match = re.search(pattern, mensagem)
-            if match:
-                dia, mes = match.groups()
-                try:
-                    # Assumir ano atual
-                    ano = datetime.now().year
-                    data_encontrada = f"{int(dia):02d}/{int(mes):02d}/{ano}"
-                    break
-                except:
-                    continue
-        
-        # Buscar hora
-        for pattern in hora_patterns:
-            match = re.search(pattern, mensagem)
-            if match:
-                if pattern.endswith('horas?'):
-                    hora = int(match.group(1))
-                    hora_encontrada = f"{hora:02d}:00"
-                else:
-                    hora = int(match.group(1))
-                    minutos = int(match.group(2)) if match.group(2) else 0
-                    hora_encontrada = f"{hora:02d}:{minutos:02d}"
-                break
-        
-        # Se encontrou data e/ou hora, tentar fazer match com horários disponíveis
-        for horario in horarios_disponiveis:
-            match_data = not data_encontrada or data_encontrada.startswith(horario['data_formatada'][:5])
-            match_hora = not hora_encontrada or hora_encontrada == horario['hora']
-            
-            if match_data and match_hora:
-                return horario
-        
-        # Se não encontrou match exato, retornar None para mostrar opções
-        return None
+        """Interpreta a escolha de horário do usuário ("20/10 às 14:00", "14h", "o primeiro")"""
+        # A lista é exibida agrupada por data, sem numeração: números soltos não são opções
+        indice = escolher_horario(mensagem, horarios_disponiveis, numerados=False)
+        return horarios_disponiveis[indice] if indice is not None else None
 
     def _formatar_horarios_para_exibicao(self, horarios):
         """Formata horários para exibição ao usuário"""
@@ -1257,6 +1153,10 @@ class ChatbotService:
                     if agendamento and agendamento.status == 'agendado':
                         # Cancelar agendamento
                         agendamento.cancelar('Cancelado pelo paciente via chatbot')
+                        motor_disponibilidade.matriz.liberar_agendamento(
+                            agendamento.medico_id,
+                            datetime.strptime(agendamento.data, '%Y-%m-%d').date(),
+                            agendamento.hora, agendamento.hora_fim)
                         
                         medico = agendamento.get_medico()
                         especialidade = agendamento.get_especialidade()
@@ -1310,5 +1210,14 @@ class ChatbotService:
             'proximo_estado': 'inicio'
         }
 
+# Instância global do motor de disponibilidade (matriz de ocupação em memória)
+motor_disponibilidade = MotorDisponibilidade(FonteSQLite())
+
+# Intenções já classificadas pelo Gemini (SQLite compartilhado entre workers)
+cache_intencoes = criar_cache_intencoes()
+
+# Classificador local que evita o Gemini nas mensagens de intenção clara
+classificador_intencoes = criar_classificador()
+
 # Instância global do serviço
-chatbot_service = ChatbotService()
\ No newline at end of file
+chatbot_service = ChatbotService()
@@ -51,8 +51,23 @@ with app.app_context():
     from models import Paciente, Especialidade, Medico, HorarioDisponivel, Agendamento, Conversa, Local, Configuracao, AgendamentoRecorrente
     db.create_all()
     
+    # Bancos criados antes de agendamentos.hora_fim: adicionar a coluna e o índice de intervalo
+    from sqlalchemy import inspect, text
+    if 'hora_fim' not in {coluna['name'] for coluna in inspect(db.engine).get_columns('agendamentos')}:
+        db.session.execute(text('ALTER TABLE agendamentos ADD COLUMN hora_fim TIME'))
+        db.session.commit()
+    # Idem para medicos.versao_agenda (ETags de /api/disponibilidade)
+    if 'versao_agenda' not in {coluna['name'] for coluna in inspect(db.engine).get_columns('medicos')}:
+        db.session.execute(text('ALTER TABLE medicos ADD COLUMN versao_agenda INTEGER NOT NULL DEFAULT 0'))
+        db.session.commit()
+    for indice in Agendamento.__table__.indexes:
+        indice.create(db.engine, checkfirst=True)
+    
     # Import services after models are loaded
-    from ai_service import chatbot_service
+    from ai_service import (chatbot_service, motor_disponibilidade, cache_intencoes,
+                            classificador_intencoes, cliente_ia)
+    import prompts
+    from disponibilidade import MOTIVOS_INDISPONIBILIDADE, LIMITE_VERIFICACAO_LOTE
     
     # Criar locais iniciais se não existirem
     if Local.query.count() == 0:
@@ -289,47 +304,99 @@ def verificar_disponibilidade():
         data_agendamento = datetime.strptime(data_str, '%Y-%m-%d').date()
         hora_agendamento = datetime.strptime(hora_str, '%H:%M').time()
         
-        # Verificar agendamento normal
-        agendamento_existente = Agendamento.query.filter_by(
-            medico_id=medico_id,
-            data=data_agendamento,
-            hora=hora_agendamento,
-            status='agendado'
-        ).first()
+        situacao = motor_disponibilidade.situacao_slot(
+            int(medico_id), data_agendamento, hora_agendamento,
+            sessao=session.get('chat_session_id'))
         
-        if agendamento_existente:
-            return jsonify({
-                'disponivel': False, 
-                'motivo': 'Horário já ocupado por outro paciente',
-                'timestamp': datetime.utcnow().isoformat()
-            })
+        resposta = {'disponivel': situacao == 'livre', 'timestamp': datetime.utcnow().isoformat()}
+        if situacao in MOTIVOS_INDISPONIBILIDADE:
+            resposta['motivo'] = MOTIVOS_INDISPONIBILIDADE[situacao]
+        return jsonify(resposta)
         
-        # Verificar agendamento recorrente
-        dia_semana = data_agendamento.weekday()
-        agendamento_recorrente = AgendamentoRecorrente.query.filter(
-            AgendamentoRecorrente.medico_id == medico_id,
-            AgendamentoRecorrente.dia_semana == dia_semana,
-            AgendamentoRecorrente.hora == hora_agendamento,
-            AgendamentoRecorrente.ativo == True,
-            AgendamentoRecorrente.data_inicio <= data_agendamento,
-            (AgendamentoRecorrente.data_fim.is_(None)) | (AgendamentoRecorrente.data_fim >= data_agendamento)
-        ).first()
-        
-        if agendamento_recorrente:
-            return jsonify({
-                'disponivel': False, 
-                'motivo': 'Horário bloqueado por agendamento recorrente',
-                'timestamp': datetime.utcnow().isoformat()
+    except Exception as e:
+        logger.error(f"Erro ao verificar disponibilidade: {e}")
+        return jsonify({'disponivel': False, 'motivo': 'Erro interno'})
+
+@app.route('/api/verificar-disponibilidade/lote', methods=['POST'])
+def verificar_disponibilidade_lote():
+    """API para revalidar vários horários de uma vez (ex.: todas as opções exibidas no widget)"""
+    try:
+        dados = request.get_json(silent=True) or {}
+        itens = dados.get('slots')
+        
+        if not isinstance(itens, list) or not itens:
+            return jsonify({'success': False, 'message': 'Informe a lista de slots'}), 400
+        if len(itens) > LIMITE_VERIFICACAO_LOTE:
+            return jsonify({'success': False, 'message': f'Máximo de {LIMITE_VERIFICACAO_LOTE} slots por requisição'}), 400
+        
+        slots = [(int(item['medico_id']),
+                  datetime.strptime(item['data'], '%Y-%m-%d').date(),
+                  datetime.strptime(item['hora'], '%H:%M').time()) for item in itens]
+        situacoes = motor_disponibilidade.verificar_slots(
+            slots, sessao=session.get('chat_session_id'))
+        
+        resultados = []
+        for item, situacao in zip(itens, situacoes):
+            resultado = {'medico_id': int(item['medico_id']), 'data': item['data'],
+                         'hora': item['hora'], 'disponivel': situacao == 'livre'}
+            if situacao in MOTIVOS_INDISPONIBILIDADE:
+                resultado['motivo'] = MOTIVOS_INDISPONIBILIDADE[situacao]
+            resultados.append(resultado)
+        
+        return jsonify({'success': True, 'resultados': resultados,
+                        'timestamp': datetime.utcnow().isoformat()})
+        
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Slot inválido: {e}'}), 400
+    except Exception as e:
+        logger.error(f"Erro ao verificar disponibilidade em lote: {e}")
+        return jsonify({'success': False, 'message': 'Erro interno'}), 500
+
+@app.route('/api/disponibilidade')
+def listar_disponibilidade():
+    """API para listar horários livres de um local/especialidade em um intervalo de datas"""
+    try:
+        local_id = request.args.get('local_id', type=int)
+        especialidade_id = request.args.get('especialidade_id', type=int)
+        medico_id = request.args.get('medico_id', type=int)
+        data_inicio_str = request.args.get('data_inicio')  # formato: YYYY-MM-DD
+        data_fim_str = request.args.get('data_fim')  # formato: YYYY-MM-DD
+        cursor = request.args.get('cursor')
+        limite = max(1, min(request.args.get('limite', 20, type=int), 100))
+        
+        if not local_id or not especialidade_id:
+            return jsonify({'success': False, 'message': 'Informe local_id e especialidade_id'}), 400
+        
+        data_inicio = datetime.strptime(data_inicio_str, '%Y-%m-%d').date() if data_inicio_str else None
+        data_fim = datetime.strptime(data_fim_str, '%Y-%m-%d').date() if data_fim_str else None
+        
+        # ETag pelo estado da agenda no banco: clientes com a versão atual recebem 304 sem recalcular
+        sessao = session.get('chat_session_id')
+        etag = motor_disponibilidade.etag(especialidade_id, medico_id=medico_id, sessao=sessao)
+        if request.if_none_match.contains(etag):
+            resposta = app.response_class(status=304)
+        else:
+            horarios, proximo_cursor = motor_disponibilidade.buscar_intervalo(
+                especialidade_id, local_id=local_id, medico_id=medico_id,
+                data_inicio=data_inicio, data_fim=data_fim, cursor=cursor, limite=limite,
+                sessao=sessao)
+            resposta = jsonify({
+                'success': True,
+                'horarios': horarios,
+                'proximo_cursor': proximo_cursor,
+                'horizonte_ate': motor_disponibilidade.matriz.ultimo_dia.isoformat(),
+                'versao': etag
             })
         
-        return jsonify({
-            'disponivel': True, 
-            'timestamp': datetime.utcnow().isoformat()
-        })
+        resposta.set_etag(etag)
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Parâmetros inválidos: {e}'}), 400
     except Exception as e:
-        logger.error(f"Erro ao verificar disponibilidade: {e}")
-        return jsonify({'disponivel': False, 'motivo': 'Erro interno'})
+        logger.error(f"Erro ao listar disponibilidade: {e}")
+        return jsonify({'success': False, 'message': 'Erro interno'}), 500
 
 @app.route('/cancelar/<int:agendamento_id>', methods=['POST'])
 def cancelar_agendamento(agendamento_id):
@@ -340,6 +407,8 @@ def cancelar_agendamento(agendamento_id):
         agendamento.cancelado_em = datetime.utcnow()
         agendamento.motivo_cancelamento = 'Cancelado pela administração'
         db.session.commit()
+        motor_disponibilidade.matriz.liberar_agendamento(agendamento.medico_id, agendamento.data,
+                                                         agendamento.hora, agendamento.hora_fim)
         
         flash('Agendamento cancelado com sucesso!', 'success')
         return redirect(url_for('listar_agendamentos'))
@@ -468,6 +537,18 @@ def admin():
                          agendamentos_por_especialidade=agendamentos_por_especialidade,
                          pacientes_especialidades=pacientes_especialidades)
 
+@app.route('/admin/ocupacao')
+@requer_login_admin
+def admin_ocupacao():
+    """Mapa de calor da ocupação por médico/local/dia nas próximas semanas (4 a 8)"""
+    try:
+        semanas = request.args.get('semanas', 4, type=int)
+        mapa = motor_disponibilidade.mapa_ocupacao.obter(semanas)
+        return jsonify({'success': True, **mapa})
+    except Exception as e:
+        logger.error(f"Erro ao gerar mapa de ocupação: {e}")
+        return jsonify({'success': False, 'message': 'Erro interno'}), 500
+
 @app.route('/admin/config')
 @requer_login_admin
 def admin_config():
@@ -622,6 +703,7 @@ def admin_medicos():
                 db.session.add(horario)
         
         db.session.commit()
+        motor_disponibilidade.matriz.recarregar_medico(novo_medico.id)
         
         flash(f'Médico "{nome}" cadastrado com sucesso!', 'success')
         return redirect(url_for('admin'))
@@ -690,6 +772,7 @@ def editar_medico(medico_id):
             medico.agenda_recorrente = agenda_recorrente
             
             db.session.commit()
+            motor_disponibilidade.matriz.recarregar_medico(medico_id)
             flash(f'Médico "{nome}" atualizado com sucesso!', 'success')
             return redirect(url_for('admin'))
         
@@ -736,6 +819,24 @@ def admin_horarios():
             flash('Dados inválidos fornecidos. Verifique os valores.', 'error')
             return redirect(url_for('admin'))
         
+        # O médico não pode ter turnos sobrepostos, nem em locais diferentes
+        try:
+            inicio = datetime.strptime(hora_inicio, '%H:%M').time()
+            fim = datetime.strptime(hora_fim, '%H:%M').time()
+        except ValueError:
+            flash('Formato de hora inválido. Use HH:MM', 'error')
+            return redirect(url_for('admin'))
+        if fim <= inicio:
+            flash('A hora de fim deve ser posterior à hora de início.', 'error')
+            return redirect(url_for('admin'))
+        conflito = motor_disponibilidade.conflito_turno(
+            medico_id, dia_semana, inicio, fim,
+            horario_id=int(horario_id) if horario_id and horario_id.isdigit() else None)
+        if conflito:
+            flash(f"Conflito de horário: o médico já atende em {conflito['local']} na "
+                  f"{conflito['dia_semana']} das {conflito['hora_inicio']} às {conflito['hora_fim']}.", 'error')
+            return redirect(url_for('admin'))
+        
         if horario_id:
             # Editar horário existente - validação segura
             try:
@@ -748,6 +849,7 @@ def admin_horarios():
                 return redirect(url_for('admin'))
             if horario:
                 try:
+                    medico_anterior_id = horario.medico_id
                     horario.medico_id = medico_id
                     horario.local_id = local_id
                     horario.dia_semana = dia_semana
@@ -755,6 +857,9 @@ def admin_horarios():
                     horario.hora_fim = datetime.strptime(hora_fim, '%H:%M').time() if hora_fim else None
                     horario.duracao_consulta = duracao_consulta
                     db.session.commit()
+                    motor_disponibilidade.matriz.recarregar_medico(medico_id)
+                    if medico_anterior_id != medico_id:
+                        motor_disponibilidade.matriz.recarregar_medico(medico_anterior_id)
                     flash('Horário atualizado com sucesso!', 'success')
                 except ValueError as e:
                     db.session.rollback()
@@ -788,6 +893,7 @@ def admin_horarios():
                 )
                 db.session.add(novo_horario)
                 db.session.commit()
+                motor_disponibilidade.matriz.recarregar_medico(medico_id)
                 flash('Horário criado com sucesso!', 'success')
             except ValueError as e:
                 db.session.rollback()
@@ -834,6 +940,7 @@ def admin_locais():
                     local.cidade = cidade
                     local.telefone = telefone if telefone else None
                     db.session.commit()
+                    motor_disponibilidade.matriz.invalidar()
                     flash(f'Local "{nome}" atualizado com sucesso!', 'success')
                 else:
                     flash('Local não encontrado.', 'error')
@@ -922,6 +1029,7 @@ def deletar_medico(medico_id):
         # Deletar o médico
         db.session.delete(medico)
         db.session.commit()
+        motor_disponibilidade.matriz.recarregar_medico(medico_id)
         
         flash(f'Médico "{nome_medico}" deletado com sucesso!', 'success')
         return redirect(url_for('admin'))
@@ -1149,9 +1257,11 @@ def deletar_horario(horario_id):
         
         medico_nome = horario.medico_rel.nome if horario.medico_rel else 'N/A'
         dia_nome = horario.get_dia_semana_nome()
+        medico_id = horario.medico_id
         
         db.session.delete(horario)
         db.session.commit()
+        motor_disponibilidade.matriz.recarregar_medico(medico_id)
         
         flash(f'Horário de {medico_nome} ({dia_nome}) deletado com sucesso!', 'success')
         return redirect(url_for('admin'))
@@ -1212,6 +1322,7 @@ def zerar_banco_dados():
         
         # Commit das alterações
         db.session.commit()
+        motor_disponibilidade.matriz.invalidar()
         
         logging.warning(f"BANCO DE DADOS ZERADO! Dados removidos: {total_agendamentos} agendamentos, {total_pacientes} pacientes, {total_medicos} médicos, {total_conversas} conversas, {total_horarios} horários, {total_agend_recorrentes} agend. recorrentes")
         
@@ -1243,7 +1354,12 @@ def api_status():
         'agendamentos_hoje': agendamentos_hoje,
         'total_pacientes': total_pacientes,
         'especialidades': Especialidade.query.filter_by(ativo=True).count(),
-        'preco_mensal': 'R$ 19,90'
+        'preco_mensal': 'R$ 19,90',
+        'cache_disponibilidade': motor_disponibilidade.cache.estatisticas(),
+        'cache_intencoes': cache_intencoes.estatisticas(),
+        'classificador_intencoes': classificador_intencoes.estatisticas(),
+        'gemini': cliente_ia.estatisticas(),
+        'prompts': prompts.estatisticas()
     })
 
 
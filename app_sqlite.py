@@ -33,7 +33,8 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Importar serviço de AI
-from ai_service_sqlite import chatbot_service
+from ai_service_sqlite import chatbot_service, motor_disponibilidade
+from disponibilidade import MOTIVOS_INDISPONIBILIDADE, LIMITE_VERIFICACAO_LOTE
 
 @app.route('/')
 def index():
@@ -150,46 +151,99 @@ def verificar_disponibilidade():
         data_agendamento = datetime.strptime(data_str, '%Y-%m-%d').date()
         hora_agendamento = datetime.strptime(hora_str, '%H:%M').time()
         
-        # Verificar agendamento normal
-        from database import db
-        query = """
-            SELECT * FROM agendamentos 
-            WHERE medico_id = ? AND data = ? AND hora = ? AND status = 'agendado'
-        """
-        rows = db.execute_query(query, (medico_id, data_str, hora_str))
+        situacao = motor_disponibilidade.situacao_slot(
+            int(medico_id), data_agendamento, hora_agendamento,
+            sessao=session.get('chat_session_id'))
         
-        if rows:
-            return jsonify({
-                'disponivel': False, 
-                'motivo': 'Horário já ocupado por outro paciente',
-                'timestamp': datetime.utcnow().isoformat()
-            })
+        resposta = {'disponivel': situacao == 'livre', 'timestamp': datetime.utcnow().isoformat()}
+        if situacao in MOTIVOS_INDISPONIBILIDADE:
+            resposta['motivo'] = MOTIVOS_INDISPONIBILIDADE[situacao]
+        return jsonify(resposta)
         
-        # Verificar agendamento recorrente
-        dia_semana = data_agendamento.weekday()
-        query_recorrente = """
-            SELECT * FROM agendamentos_recorrentes 
-            WHERE medico_id = ? AND dia_semana = ? AND hora = ? AND ativo = 1
-            AND data_inicio <= ? AND (data_fim IS NULL OR data_fim >= ?)
-        """
-        rows_recorrentes = db.execute_query(query_recorrente, 
-                                          (medico_id, dia_semana, hora_str, data_str, data_str))
-        
-        if rows_recorrentes:
-            return jsonify({
-                'disponivel': False, 
-                'motivo': 'Horário bloqueado por agendamento recorrente',
-                'timestamp': datetime.utcnow().isoformat()
+    except Exception as e:
+        logger.error(f"Erro ao verificar disponibilidade: {e}")
+        return jsonify({'disponivel': False, 'motivo': 'Erro interno'})
+
+@app.route('/api/verificar-disponibilidade/lote', methods=['POST'])
+def verificar_disponibilidade_lote():
+    """API para revalidar vários horários de uma vez (ex.: todas as opções exibidas no widget)"""
+    try:
+        dados = request.get_json(silent=True) or {}
+        itens = dados.get('slots')
+        
+        if not isinstance(itens, list) or not itens:
+            return jsonify({'success': False, 'message': 'Informe a lista de slots'}), 400
+        if len(itens) > LIMITE_VERIFICACAO_LOTE:
+            return jsonify({'success': False, 'message': f'Máximo de {LIMITE_VERIFICACAO_LOTE} slots por requisição'}), 400
+        
+        slots = [(int(item['medico_id']),
+                  datetime.strptime(item['data'], '%Y-%m-%d').date(),
+                  datetime.strptime(item['hora'], '%H:%M').time()) for item in itens]
+        situacoes = motor_disponibilidade.verificar_slots(
+            slots, sessao=session.get('chat_session_id'))
+        
+        resultados = []
+        for item, situacao in zip(itens, situacoes):
+            resultado = {'medico_id': int(item['medico_id']), 'data': item['data'],
+                         'hora': item['hora'], 'disponivel': situacao == 'livre'}
+            if situacao in MOTIVOS_INDISPONIBILIDADE:
+                resultado['motivo'] = MOTIVOS_INDISPONIBILIDADE[situacao]
+            resultados.append(resultado)
+        
+        return jsonify({'success': True, 'resultados': resultados,
+                        'timestamp': datetime.utcnow().isoformat()})
+        
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Slot inválido: {e}'}), 400
+    except Exception as e:
+        logger.error(f"Erro ao verificar disponibilidade em lote: {e}")
+        return jsonify({'success': False, 'message': 'Erro interno'}), 500
+
+@app.route('/api/disponibilidade')
+def listar_disponibilidade():
+    """API para listar horários livres de um local/especialidade em um intervalo de datas"""
+    try:
+        local_id = request.args.get('local_id', type=int)
+        especialidade_id = request.args.get('especialidade_id', type=int)
+        medico_id = request.args.get('medico_id', type=int)
+        data_inicio_str = request.args.get('data_inicio')  # formato: YYYY-MM-DD
+        data_fim_str = request.args.get('data_fim')  # formato: YYYY-MM-DD
+        cursor = request.args.get('cursor')
+        limite = max(1, min(request.args.get('limite', 20, type=int), 100))
+        
+        if not local_id or not especialidade_id:
+            return jsonify({'success': False, 'message': 'Informe local_id e especialidade_id'}), 400
+        
+        data_inicio = datetime.strptime(data_inicio_str, '%Y-%m-%d').date() if data_inicio_str else None
+        data_fim = datetime.strptime(data_fim_str, '%Y-%m-%d').date() if data_fim_str else None
+        
+        # ETag pelo estado da agenda no banco: clientes com a versão atual recebem 304 sem recalcular
+        sessao = session.get('chat_session_id')
+        etag = motor_disponibilidade.etag(especialidade_id, medico_id=medico_id, sessao=sessao)
+        if request.if_none_match.contains(etag):
+            resposta = app.response_class(status=304)
+        else:
+            horarios, proximo_cursor = motor_disponibilidade.buscar_intervalo(
+                especialidade_id, local_id=local_id, medico_id=medico_id,
+                data_inicio=data_inicio, data_fim=data_fim, cursor=cursor, limite=limite,
+                sessao=sessao)
+            resposta = jsonify({
+                'success': True,
+                'horarios': horarios,
+                'proximo_cursor': proximo_cursor,
+                'horizonte_ate': motor_disponibilidade.matriz.ultimo_dia.isoformat(),
+                'versao': etag
             })
         
-        return jsonify({
-            'disponivel': True, 
-            'timestamp': datetime.utcnow().isoformat()
-        })
+        resposta.set_etag(etag)
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta
         
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Parâmetros inválidos: {e}'}), 400
     except Exception as e:
-        logger.error(f"Erro ao verificar disponibilidade: {e}")
-        return jsonify({'disponivel': False, 'motivo': 'Erro interno'})
+        logger.error(f"Erro ao listar disponibilidade: {e}")
+        return jsonify({'success': False, 'message': 'Erro interno'}), 500
 
 @app.route('/cancelar/<int:agendamento_id>', methods=['POST'])
 def cancelar_agendamento(agendamento_id):
@@ -201,6 +255,10 @@ def cancelar_agendamento(agendamento_id):
             return redirect(url_for('listar_agendamentos'))
         
         agendamento.cancelar('Cancelado pela administração')
+        motor_disponibilidade.matriz.liberar_agendamento(
+            agendamento.medico_id,
+            datetime.strptime(agendamento.data, '%Y-%m-%d').date(),
+            agendamento.hora, agendamento.hora_fim)
         
         flash('Agendamento cancelado com sucesso!', 'success')
         return redirect(url_for('listar_agendamentos'))
@@ -333,6 +391,18 @@ def admin():
                          agendamentos_por_especialidade=agendamentos_por_especialidade,
                          pacientes_especialidades=pacientes_especialidades)
 
+@app.route('/admin/ocupacao')
+@requer_login_admin
+def admin_ocupacao():
+    """Mapa de calor da ocupação por médico/local/dia nas próximas semanas (4 a 8)"""
+    try:
+        semanas = request.args.get('semanas', 4, type=int)
+        mapa = motor_disponibilidade.mapa_ocupacao.obter(semanas)
+        return jsonify({'success': True, **mapa})
+    except Exception as e:
+        logger.error(f"Erro ao gerar mapa de ocupação: {e}")
+        return jsonify({'success': False, 'message': 'Erro interno'}), 500
+
 @app.route('/admin/config')
 @requer_login_admin
 def admin_config():
@@ -439,7 +509,8 @@ def admin_medicos():
             flash('Especialidade não encontrada.', 'error')
             return redirect(url_for('admin'))
         
-        Medico.create(nome=nome, crm=crm, especialidade_id=int(especialidade_id))
+        novo_medico = Medico.create(nome=nome, crm=crm, especialidade_id=int(especialidade_id))
+        motor_disponibilidade.matriz.recarregar_medico(novo_medico.id)
         
         flash(f'Médico "{nome}" cadastrado com sucesso!', 'success')
         return redirect(url_for('admin'))
@@ -475,6 +546,7 @@ def admin_locais():
             cidade=cidade if cidade else None,
             telefone=telefone if telefone else None
         )
+        motor_disponibilidade.matriz.invalidar()
         
         flash(f'Local "{nome}" cadastrado com sucesso!', 'success')
         return redirect(url_for('admin'))
@@ -500,6 +572,18 @@ def admin_horarios():
             flash('Todos os campos são obrigatórios.', 'error')
             return redirect(url_for('admin'))
         
+        # O médico não pode ter turnos sobrepostos, nem em locais diferentes
+        inicio = datetime.strptime(hora_inicio, '%H:%M').time()
+        fim = datetime.strptime(hora_fim, '%H:%M').time()
+        if fim <= inicio:
+            flash('A hora de fim deve ser posterior à hora de início.', 'error')
+            return redirect(url_for('admin'))
+        conflito = motor_disponibilidade.conflito_turno(int(medico_id), int(dia_semana), inicio, fim)
+        if conflito:
+            flash(f"Conflito de horário: o médico já atende em {conflito['local']} na "
+                  f"{conflito['dia_semana']} das {conflito['hora_inicio']} às {conflito['hora_fim']}.", 'error')
+            return redirect(url_for('admin'))
+        
         HorarioDisponivel.create(
             medico_id=int(medico_id),
             local_id=int(local_id),
@@ -508,6 +592,7 @@ def admin_horarios():
             hora_fim=hora_fim,
             duracao_consulta=int(duracao_consulta)
         )
+        motor_disponibilidade.matriz.recarregar_medico(int(medico_id))
         
         flash('Horário cadastrado com sucesso!', 'success')
         return redirect(url_for('admin'))
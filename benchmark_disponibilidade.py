@@ -0,0 +1,311 @@
+"""
+Benchmark de escala da busca de horários
+
+Monta clínicas sintéticas com o schema de `database.Database` e mede, de ponta a
+ponta, as buscas de disponibilidade dos dois backends:
+
+    - ai_service._buscar_horarios_disponiveis_por_local_especialidade (SQLAlchemy)
+    - ai_service_sqlite._gerar_horarios_disponiveis (SQLite)
+    - POST /api/verificar-disponibilidade (app.py e app_sqlite.py)
+
+Cada cenário roda em um subprocesso próprio, em diretório temporário, e o
+resultado (p50/p95 em ms e consultas por chamada) sai em JSON para comparação
+entre commits.
+
+Uso:
+    python benchmark_disponibilidade.py
+    python benchmark_disponibilidade.py --cenarios 10:10000,100:100000 --saida bench.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+CENARIOS_PADRAO = '10:10000,100:100000,1000:1000000'
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentil(valores, p):
+    """Percentil por posição mais próxima (valores já ordenados)"""
+    if not valores:
+        return None
+    indice = max(0, min(len(valores) - 1, int(round(p / 100 * len(valores) + 0.5)) - 1))
+    return valores[indice]
+
+
+def _resumo(tempos, consultas):
+    tempos = sorted(tempos)
+    return {
+        'chamadas': len(tempos),
+        'p50_ms': round(_percentil(tempos, 50), 3),
+        'p95_ms': round(_percentil(tempos, 95), 3),
+        'max_ms': round(tempos[-1], 3),
+        'consultas_por_chamada': round(sum(consultas) / len(consultas), 2)
+    }
+
+
+def montar_clinica(caminho, medicos, agendamentos, formato_hora, semente=42):
+    """
+    Cria um banco com o schema de database.Database e uma clínica sintética
+
+    Args:
+        caminho (str): Arquivo SQLite a criar
+        medicos (int): Quantidade de médicos
+        agendamentos (int): Quantidade de agendamentos (passados e futuros)
+        formato_hora (str): strftime das colunas TIME ('%H:%M' no SQLite puro,
+            '%H:%M:%S.%f' para o SQLAlchemy)
+        semente (int): Semente do gerador aleatório
+
+    Returns:
+        dict: Contagens geradas
+    """
+    from database import Database
+
+    random.seed(semente)
+    banco = Database(caminho)
+    hora = lambda minuto: datetime(2000, 1, 1, minuto // 60, minuto % 60).strftime(formato_hora)
+
+    with banco.get_connection() as conn:
+        conn.execute("PRAGMA synchronous = OFF")
+        # Remover os exemplos do banco inicial para controlar as contagens
+        for tabela in ('agendamentos', 'agendamentos_recorrentes', 'horarios_disponiveis', 'medicos'):
+            conn.execute(f"DELETE FROM {tabela}")
+
+        conn.executemany(
+            "INSERT OR IGNORE INTO locais (nome, endereco, cidade) VALUES (?, ?, ?)",
+            [(f"Unidade {i}", f"Rua {i}", "Belo Horizonte") for i in range(1, 4)])
+        locais = [row['id'] for row in conn.execute("SELECT id FROM locais")]
+        especialidades = [row['id'] for row in conn.execute("SELECT id FROM especialidades")]
+
+        conn.executemany(
+            "INSERT INTO medicos (nome, crm, especialidade_id) VALUES (?, ?, ?)",
+            [(f"Dr(a). Sintético {i}", f"BENCH-{i}", especialidades[i % len(especialidades)])
+             for i in range(medicos)])
+        medicos_rows = conn.execute("SELECT id, especialidade_id FROM medicos").fetchall()
+
+        # Turno da manhã e da tarde, segunda a sexta, em um local por médico
+        horarios = []
+        local_do_medico = {}
+        for row in medicos_rows:
+            local_id = random.choice(locais)
+            local_do_medico[row['id']] = local_id
+            for dia_semana in range(5):
+                horarios.append((row['id'], local_id, dia_semana, hora(8 * 60), hora(12 * 60), 30))
+                horarios.append((row['id'], local_id, dia_semana, hora(13 * 60), hora(18 * 60), 30))
+        conn.executemany('''
+            INSERT INTO horarios_disponiveis (medico_id, local_id, dia_semana, hora_inicio, hora_fim, duracao_consulta)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', horarios)
+
+        conn.executemany(
+            "INSERT INTO pacientes (cpf, nome) VALUES (?, ?)",
+            [(f"{i:011d}", f"Paciente {i}") for i in range(1, 1001)])
+        pacientes = [row['id'] for row in conn.execute("SELECT id FROM pacientes")]
+
+        minutos_grade = list(range(8 * 60, 12 * 60, 30)) + list(range(13 * 60, 18 * 60, 30))
+        hoje = date.today()
+
+        def gerar_agendamentos():
+            for _ in range(agendamentos):
+                medico = random.choice(medicos_rows)
+                data_ag = hoje + timedelta(days=random.randint(-365, 180))
+                minuto = random.choice(minutos_grade)
+                yield (random.choice(pacientes), medico['id'], medico['especialidade_id'],
+                       local_do_medico[medico['id']], data_ag.isoformat(),
+                       hora(minuto), hora(minuto + 30),
+                       'agendado' if random.random() < 0.9 else 'cancelado')
+
+        conn.executemany('''
+            INSERT INTO agendamentos (paciente_id, medico_id, especialidade_id, local_id, data, hora, hora_fim, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', gerar_agendamentos())
+
+        recorrentes = []
+        for row in random.sample(medicos_rows, max(1, len(medicos_rows) // 2)):
+            for _ in range(2):
+                inicio = hoje + timedelta(days=random.randint(-60, 30))
+                recorrentes.append((random.choice(pacientes), row['id'], row['especialidade_id'],
+                                    local_do_medico[row['id']], random.randint(0, 4),
+                                    hora(random.choice(minutos_grade)), inicio.isoformat(),
+                                    (inicio + timedelta(weeks=12)).isoformat()))
+        conn.executemany('''
+            INSERT INTO agendamentos_recorrentes (paciente_id, medico_id, especialidade_id, local_id, dia_semana, hora, data_inicio, data_fim)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', recorrentes)
+        conn.commit()
+
+    return {'medicos': medicos, 'agendamentos': agendamentos,
+            'recorrentes': len(recorrentes), 'locais': len(locais)}
+
+
+def _medir(nome, funcao, argumentos, contador, resultados, limpar=None):
+    """Executa `funcao` para cada argumento, medindo tempo e consultas"""
+    tempos, consultas = [], []
+    for args in argumentos:
+        if limpar:
+            limpar()
+        contador['n'] = 0
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        consultas.append(contador['n'])
+    resultados[nome] = _resumo(tempos, consultas)
+
+
+def executar_cenario(medicos, agendamentos, repeticoes):
+    """Roda um cenário no diretório atual (chamado dentro do subprocesso)"""
+    inicio_montagem = time.perf_counter()
+    caminho_sqlite = os.path.abspath('sistema_agendamento.db')
+    caminho_sqlalchemy = os.path.abspath('sqlalchemy.db')
+    contagens = montar_clinica(caminho_sqlite, medicos, agendamentos, '%H:%M')
+    montar_clinica(caminho_sqlalchemy, medicos, agendamentos, '%H:%M:%S.%f')
+    montagem_s = time.perf_counter() - inicio_montagem
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{caminho_sqlalchemy}"
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+
+    # Contar consultas do backend SQLite em todas as conexões abertas pelo Database
+    import database
+    contador = {'n': 0}
+    get_connection_original = database.Database.get_connection
+
+    def get_connection_contada(self):
+        conn = get_connection_original(self)
+        conn.set_trace_callback(lambda _sql: contador.__setitem__('n', contador['n'] + 1))
+        return conn
+
+    database.Database.get_connection = get_connection_contada
+
+    import logging
+    import app as app_sqlalchemy
+    import app_sqlite
+    import ai_service
+    import ai_service_sqlite
+    from sqlalchemy import event
+    logging.getLogger('SistemaAgendamento').setLevel(logging.WARNING)
+
+    random.seed(7)
+    combinacoes = [
+        (row['local_id'], row['especialidade_id'])
+        for row in database.db.execute_query('''
+            SELECT DISTINCT h.local_id, m.especialidade_id
+            FROM horarios_disponiveis h JOIN medicos m ON m.id = h.medico_id
+        ''')
+    ]
+    amostra = [random.choice(combinacoes) for _ in range(repeticoes)]
+    medico_ids = [row['id'] for row in database.db.execute_query("SELECT id FROM medicos")]
+    slots = [
+        {'medico_id': random.choice(medico_ids),
+         'data': (date.today() + timedelta(days=random.randint(0, 60))).isoformat(),
+         'hora': f"{random.choice(range(8, 18)):02d}:{random.choice((0, 30)):02d}"}
+        for _ in range(repeticoes)
+    ]
+    resultados = {}
+
+    # Backend SQLAlchemy
+    with app_sqlalchemy.app.app_context():
+        event.listen(app_sqlalchemy.db.engine, 'before_cursor_execute',
+                     lambda *args, **kwargs: contador.__setitem__('n', contador['n'] + 1))
+        motor = ai_service.motor_disponibilidade
+        servico = ai_service.chatbot_service
+        buscar = servico._buscar_horarios_disponiveis_por_local_especialidade
+
+        _medir('sqlalchemy.buscar_por_local_especialidade.frio', buscar, amostra[:1],
+               contador, resultados, limpar=motor.matriz.invalidar)
+        _medir('sqlalchemy.buscar_por_local_especialidade', buscar, amostra,
+               contador, resultados, limpar=motor.cache.invalidar_medico)
+        _medir('sqlalchemy.buscar_por_local_especialidade.cache', buscar, amostra,
+               contador, resultados)
+
+        cliente = app_sqlalchemy.app.test_client()
+        _medir('sqlalchemy.verificar_disponibilidade',
+               lambda slot: cliente.post('/api/verificar-disponibilidade', json=slot),
+               [(slot,) for slot in slots], contador, resultados)
+
+    # Backend SQLite
+    motor = ai_service_sqlite.motor_disponibilidade
+    servico = ai_service_sqlite.chatbot_service
+
+    def gerar(local_id, especialidade_id):
+        # Mesma consulta de _processar_horarios antes de gerar os horários
+        rows = database.db.execute_query('''
+            SELECT m.*, h.* FROM medicos m
+            JOIN horarios_disponiveis h ON m.id = h.medico_id
+            WHERE m.especialidade_id = ? AND h.local_id = ? AND m.ativo = 1 AND h.ativo = 1
+        ''', (especialidade_id, local_id))
+        return servico._gerar_horarios_disponiveis(rows)
+
+    _medir('sqlite.gerar_horarios_disponiveis.frio', gerar, amostra[:1],
+           contador, resultados, limpar=motor.matriz.invalidar)
+    _medir('sqlite.gerar_horarios_disponiveis', gerar, amostra,
+           contador, resultados, limpar=motor.cache.invalidar_medico)
+    _medir('sqlite.gerar_horarios_disponiveis.cache', gerar, amostra, contador, resultados)
+
+    cliente = app_sqlite.app.test_client()
+    _medir('sqlite.verificar_disponibilidade',
+           lambda slot: cliente.post('/api/verificar-disponibilidade', json=slot),
+           [(slot,) for slot in slots], contador, resultados)
+
+    return {**contagens, 'montagem_s': round(montagem_s, 2), 'operacoes': resultados}
+
+
+def _commit_atual():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=DIRETORIO, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de escala da busca de horários')
+    parser.add_argument('--cenarios', default=CENARIOS_PADRAO,
+                        help='Lista medicos:agendamentos separada por vírgula')
+    parser.add_argument('--repeticoes', type=int, default=50,
+                        help='Chamadas medidas por operação')
+    parser.add_argument('--saida', help='Arquivo JSON de saída (padrão: stdout)')
+    parser.add_argument('--cenario', help=argparse.SUPPRESS)  # uso interno do subprocesso
+    args = parser.parse_args()
+
+    if args.cenario:
+        medicos, agendamentos = (int(valor) for valor in args.cenario.split(':'))
+        resultado = executar_cenario(medicos, agendamentos, args.repeticoes)
+        sys.stdout.write('\n' + json.dumps(resultado) + '\n')
+        return
+
+    relatorio = {
+        'commit': _commit_atual(),
+        'python': sys.version.split()[0],
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'repeticoes': args.repeticoes,
+        'cenarios': []
+    }
+    for cenario in args.cenarios.split(','):
+        with tempfile.TemporaryDirectory(prefix='bench_agenda_') as diretorio:
+            env = dict(os.environ, PYTHONPATH=DIRETORIO + os.pathsep + os.environ.get('PYTHONPATH', ''))
+            processo = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--cenario', cenario.strip(),
+                 '--repeticoes', str(args.repeticoes)],
+                cwd=diretorio, env=env, capture_output=True, text=True)
+            if processo.returncode != 0:
+                sys.stderr.write(processo.stderr)
+                relatorio['cenarios'].append({'cenario': cenario, 'erro': processo.stderr.strip().splitlines()[-1:]})
+                continue
+            relatorio['cenarios'].append(json.loads(processo.stdout.strip().splitlines()[-1]))
+
+    saida = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(saida + '\n')
+    else:
+        print(saida)
+
+
+if __name__ == '__main__':
+    main()
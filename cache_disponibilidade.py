@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('SistemaAgendamento')
+
+
+class CacheDisponibilidade:
+    """
+    Cache LRU com TTL para resultados de busca de disponibilidade
+
+    Cada entrada registra os médicos dos quais depende; alterações na agenda de um
+    médico invalidam só as entradas que o envolvem. A época é incrementada a cada
+    invalidação para descartar resultados calculados antes dela (ver `guardar`).
+    """
+
+    def __init__(self, capacidade=512, ttl=60):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # chave -> (expira_em, medico_ids, valor)
+        self._por_medico = {}  # medico_id -> set(chaves)
+        self.epoca = 0
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave):
+        """Retorna o valor em cache ou None (falha/expirado)"""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    self._remover(chave)
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return entrada[2]
+
+    def guardar(self, chave, valor, medico_ids, epoca=None):
+        """
+        Guarda um resultado dependente de `medico_ids`
+
+        Se `epoca` for informada e houve invalidação desde então, o resultado já
+        pode estar desatualizado e não é guardado.
+        """
+        with self._lock:
+            if epoca is not None and epoca != self.epoca:
+                return
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = (time.monotonic() + self.ttl, tuple(medico_ids), valor)
+            for medico_id in medico_ids:
+                self._por_medico.setdefault(medico_id, set()).add(chave)
+            while len(self._entradas) > self.capacidade:
+                self._remover(next(iter(self._entradas)))
+
+    def invalidar_medico(self, medico_id=None):
+        """Remove as entradas que dependem do médico (None = todas)"""
+        with self._lock:
+            self.epoca += 1
+            if medico_id is None:
+                self._entradas.clear()
+                self._por_medico.clear()
+                return
+            for chave in list(self._por_medico.pop(medico_id, ())):
+                self._remover(chave)
+
+    def _remover(self, chave):
+        entrada = self._entradas.pop(chave, None)
+        if entrada is None:
+            return
+        for medico_id in entrada[1]:
+            chaves = self._por_medico.get(medico_id)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._por_medico[medico_id]
+
+    def estatisticas(self):
+        """Tamanho e taxa de acerto do cache"""
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                'entradas': len(self._entradas),
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / total, 3) if total else 0.0
+            }
@@ -0,0 +1,124 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from preferencias import normalizar
+
+logger = logging.getLogger('SistemaAgendamento')
+
+# Cache das intenções classificadas pelo Gemini em _detectar_tipo_mensagem.
+# A chave é o texto normalizado (minúsculas, sem acentos, espaços colapsados):
+# "Boa  tarde!" e "boa tarde!" compartilham a mesma entrada. Fica em um arquivo
+# SQLite para sobreviver a reinícios e ser compartilhado pelos workers.
+
+TTL_PADRAO = 7 * 24 * 3600
+CAPACIDADE_PADRAO = 5000
+
+
+class CacheIntencoes:
+    """
+    LRU com TTL de intenções por mensagem normalizada, persistido em SQLite
+
+    `usado_em` é atualizado a cada acerto; ao passar da capacidade, as entradas
+    usadas há mais tempo são removidas. Os contadores de acerto/falha são do
+    processo; `acertos` por entrada fica no banco.
+    """
+
+    def __init__(self, caminho, capacidade=CAPACIDADE_PADRAO, ttl=TTL_PADRAO):
+        self.caminho = caminho
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        with closing(self._conectar()) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS intencoes (
+                    chave TEXT PRIMARY KEY,
+                    tipo TEXT NOT NULL,
+                    criado_em REAL NOT NULL,
+                    usado_em REAL NOT NULL,
+                    acertos INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_intencoes_usado_em ON intencoes (usado_em)")
+
+    def _conectar(self):
+        # Autocommit: cada comando é uma transação própria
+        return sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+
+    def obter(self, mensagem):
+        """Intenção em cache para a mensagem, ou None (falha/expirada)"""
+        chave = normalizar(mensagem)
+        agora = time.time()
+        try:
+            with closing(self._conectar()) as conn:
+                row = conn.execute(
+                    "SELECT tipo FROM intencoes WHERE chave = ? AND criado_em > ?",
+                    (chave, agora - self.ttl)).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE intencoes SET usado_em = ?, acertos = acertos + 1 WHERE chave = ?",
+                        (agora, chave))
+        except sqlite3.Error as e:
+            logger.warning(f"Cache de intenções indisponível: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.falhas += 1
+                return None
+            self.acertos += 1
+            return row[0]
+
+    def guardar(self, mensagem, tipo):
+        """Guarda a intenção classificada e remove as entradas expiradas ou excedentes"""
+        chave = normalizar(mensagem)
+        agora = time.time()
+        try:
+            with closing(self._conectar()) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO intencoes (chave, tipo, criado_em, usado_em) VALUES (?, ?, ?, ?)",
+                    (chave, tipo, agora, agora))
+                conn.execute("DELETE FROM intencoes WHERE criado_em <= ?", (agora - self.ttl,))
+                # Pelo índice de usado_em: mantém as `capacidade` entradas usadas mais recentemente
+                conn.execute('''
+                    DELETE FROM intencoes WHERE usado_em < (
+                        SELECT usado_em FROM intencoes ORDER BY usado_em DESC LIMIT 1 OFFSET ?
+                    )
+                ''', (self.capacidade - 1,))
+        except sqlite3.Error as e:
+            logger.warning(f"Cache de intenções indisponível: {e}")
+
+    def estatisticas(self):
+        """Tamanho e taxa de acerto do cache"""
+        with self._lock:
+            acertos, falhas = self.acertos, self.falhas
+        try:
+            with closing(self._conectar()) as conn:
+                entradas = conn.execute("SELECT COUNT(*) FROM intencoes").fetchone()[0]
+        except sqlite3.Error:
+            entradas = None
+        total = acertos + falhas
+        return {
+            'entradas': entradas,
+            'acertos': acertos,
+            'falhas': falhas,
+            'taxa_acerto': round(acertos / total, 3) if total else 0.0
+        }
+
+
+def criar_cache_intencoes():
+    """
+    Cria o cache de intenções conforme o ambiente
+
+    INTENCOES_CACHE_DB define o arquivo (padrão: cache_intencoes.db),
+    INTENCOES_CACHE_CAPACIDADE o número máximo de entradas e INTENCOES_CACHE_TTL
+    a validade em segundos.
+    """
+    caminho = os.environ.get('INTENCOES_CACHE_DB', 'cache_intencoes.db')
+    capacidade = int(os.environ.get('INTENCOES_CACHE_CAPACIDADE', CAPACIDADE_PADRAO))
+    ttl = int(os.environ.get('INTENCOES_CACHE_TTL', TTL_PADRAO))
+    return CacheIntencoes(caminho, capacidade, ttl)
@@ -0,0 +1,195 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+from preferencias import normalizar
+
+logger = logging.getLogger('SistemaAgendamento')
+
+# Classificador local das intenções de _detectar_tipo_mensagem.
+# Modelo linear sobre unigramas e bigramas do texto normalizado: cada n-grama tem
+# um vetor de pesos (um por categoria, na ordem de CATEGORIAS), a pontuação é a
+# soma dos vetores mais o viés e a confiança é o softmax da maior pontuação.
+# Mensagens abaixo da confiança mínima seguem para o Gemini, e o par
+# (mensagem, intenção do Gemini) é gravado em INTENCOES_EXEMPLOS para retreino.
+
+CATEGORIAS = ('agendamento', 'cancelamento', 'consulta', 'informacao', 'fora_escopo')
+
+CONFIANCA_MINIMA = 0.7
+
+# Na dúvida o fluxo padrão é agendar
+VIESES = (0.5, 0.0, 0.0, 0.0, 0.0)
+
+PESOS_INICIAIS = {
+    # agendamento
+    'oi': (2.5, 0, 0, 0, 0), 'ola': (2.5, 0, 0, 0, 0), 'bom dia': (2.5, 0, 0, 0, 0),
+    'boa tarde': (2.5, 0, 0, 0, 0), 'boa noite': (2.5, 0, 0, 0, 0),
+    'agendar': (3, 0, 0, 0, 0), 'marcar': (3, 0, 0, 0, 0), 'quero marcar': (1, 0, 0, 0, 0),
+    'marcar consulta': (1, 0, 0, 0, 0), 'nova consulta': (2, 0, 0, 0, 0),
+    'uma consulta': (2, 0, 0, 0, 0), 'consulta': (1, 0, 0.5, 0, 0),
+    'preciso': (1.5, 0, 0, 0, 0), 'estou com': (2, 0, 0, 0, 0), 'dor': (2.5, 0, 0, 0, 0),
+    'febre': (2.5, 0, 0, 0, 0), 'sintoma': (2, 0, 0, 0, 0), 'sintomas': (2, 0, 0, 0, 0),
+    'medico': (1, 0, 0, 0.5, 0), 'doutor': (1, 0, 0, 0, 0), 'doutora': (1, 0, 0, 0, 0),
+    'exame': (1, 0, 0, 0, 0), 'emergencia': (2, 0, 0, 0, 0), 'atendimento': (1, 0, 0, 0.5, 0),
+    'remarcar': (1.5, 1.5, 0, 0, 0),
+    # cancelamento
+    'cancelar': (0, 4, 0, 0, 0), 'cancelo': (0, 4, 0, 0, 0), 'cancelamento': (0, 4, 0, 0, 0),
+    'desmarcar': (-1, 4, 0, 0, 0), 'desmarca': (-1, 4, 0, 0, 0), 'desistir': (0, 3, 0, 0, 0),
+    'nao vou': (0, 2.5, 0, 0, 0), 'vou poder': (0, 1, 0, 0, 0), 'nao posso': (0, 2.5, 0, 0, 0),
+    'nao poderei': (0, 3, 0, 0, 0), 'remover': (0, 2.5, 0, 0, 0),
+    # consulta (ver agendamentos existentes)
+    'meus agendamentos': (0, 0, 4, 0, 0), 'minhas consultas': (0, 0, 4, 0, 0),
+    'minha consulta': (0, 0.5, 2.5, 0, 0), 'meu agendamento': (0, 0.5, 2.5, 0, 0),
+    'ver consultas': (0, 0, 3, 0, 0), 'consultar': (0, 0, 2.5, 0, 0), 'agendado': (0, 0, 2, 0, 0),
+    'agendada': (0, 0, 2, 0, 0), 'marcada': (0, 0, 2, 0, 0), 'marcado': (0, 0, 2, 0, 0),
+    'tenho consulta': (0, 0, 3, 0, 0), 'ja marquei': (0, 0, 3, 0, 0), 'verificar': (0, 0, 2, 0, 0),
+    'listar': (0, 0, 2.5, 0, 0), 'quando e': (0, 0, 1.5, 0, 0),
+    # informacao
+    'telefone': (0, 0, 0, 4, 0), 'endereco': (0, 0, 0, 4, 0), 'onde fica': (0, 0, 0, 4, 0),
+    'localizacao': (0, 0, 0, 4, 0), 'funcionamento': (0, 0, 0, 3.5, 0), 'abre': (0, 0, 0, 2, 0),
+    'fecha': (0, 0, 0, 2, 0), 'convenio': (0, 0, 0, 3, 0), 'aceita': (0, 0, 0, 2, 0),
+    'plano de': (0, 0, 0, 2, 0), 'especialidades': (0, 0, 0, 2.5, 0), 'quais medicos': (0, 0, 0, 2.5, 0),
+    'quanto custa': (0, 0, 0, 3.5, 0), 'valor': (0, 0, 0, 2.5, 0), 'preco': (0, 0, 0, 3, 0),
+    'whatsapp': (0, 0, 0, 3, 0), 'email': (0, 0, 0, 2.5, 0), 'estacionamento': (0, 0, 0, 3, 0),
+    # fora_escopo
+    'clima': (0, 0, 0, 0, 4), 'futebol': (0, 0, 0, 0, 4), 'politica': (0, 0, 0, 0, 4),
+    'previsao do': (0, 0, 0, 0, 3), 'o tempo': (0, 0, 0, 0, 2.5), 'piada': (0, 0, 0, 0, 4),
+    'receita culinaria': (0, 0, 0, 0, 4), 'filme': (0, 0, 0, 0, 3.5), 'musica': (0, 0, 0, 0, 3.5),
+    'jogo': (0, 0, 0, 0, 3), 'eleicao': (0, 0, 0, 0, 4), 'bitcoin': (0, 0, 0, 0, 4),
+    'namorada': (0, 0, 0, 0, 3.5), 'namorado': (0, 0, 0, 0, 3.5)
+}
+
+_PALAVRA = re.compile(r'[a-z0-9]+')
+
+
+def caracteristicas(mensagem):
+    """Unigramas e bigramas do texto normalizado"""
+    palavras = _PALAVRA.findall(normalizar(mensagem))
+    return palavras + [f"{a} {b}" for a, b in zip(palavras, palavras[1:])]
+
+
+class ClassificadorIntencoes:
+    """
+    Classificador linear de intenções com pontuação de confiança
+
+    Os pesos partem de PESOS_INICIAIS e são ajustados (perceptron) com os
+    exemplos rotulados pelo Gemini gravados em `arquivo_exemplos`.
+    """
+
+    def __init__(self, confianca_minima=CONFIANCA_MINIMA, arquivo_exemplos=None):
+        self.confianca_minima = confianca_minima
+        self.arquivo_exemplos = arquivo_exemplos
+        self._lock = threading.Lock()
+        self.pesos = {ngrama: list(vetor) for ngrama, vetor in PESOS_INICIAIS.items()}
+        self.vieses = list(VIESES)
+        self.locais = 0
+        self.encaminhadas = 0
+
+    def pontuar(self, mensagem):
+        """Pontuação de cada categoria (na ordem de CATEGORIAS)"""
+        pontuacoes = list(self.vieses)
+        for ngrama in caracteristicas(mensagem):
+            vetor = self.pesos.get(ngrama)
+            if vetor is not None:
+                pontuacoes = [p + w for p, w in zip(pontuacoes, vetor)]
+        return pontuacoes
+
+    def classificar(self, mensagem):
+        """
+        Classifica a mensagem localmente
+
+        Returns:
+            tuple: (categoria, confiança entre 0 e 1)
+        """
+        pontuacoes = self.pontuar(mensagem)
+        maior = max(pontuacoes)
+        exponenciais = [math.exp(p - maior) for p in pontuacoes]
+        indice = pontuacoes.index(maior)
+        return CATEGORIAS[indice], exponenciais[indice] / sum(exponenciais)
+
+    def decidir(self, mensagem):
+        """Categoria se a confiança atinge o mínimo; None para consultar o Gemini"""
+        categoria, confianca = self.classificar(mensagem)
+        with self._lock:
+            if confianca >= self.confianca_minima:
+                self.locais += 1
+                return categoria
+            self.encaminhadas += 1
+        logger.debug(f"Classificador local inseguro ({categoria}, {confianca:.2f}): '{mensagem}'")
+        return None
+
+    def treinar(self, exemplos, epocas=3, taxa=0.5):
+        """Ajusta os pesos com pares (mensagem, categoria) pela regra do perceptron"""
+        for _ in range(epocas):
+            erros = 0
+            for mensagem, categoria in exemplos:
+                if categoria not in CATEGORIAS:
+                    continue
+                previsto, _ = self.classificar(mensagem)
+                if previsto == categoria:
+                    continue
+                erros += 1
+                certo, errado = CATEGORIAS.index(categoria), CATEGORIAS.index(previsto)
+                for ngrama in caracteristicas(mensagem):
+                    vetor = self.pesos.setdefault(ngrama, [0.0] * len(CATEGORIAS))
+                    vetor[certo] += taxa
+                    vetor[errado] -= taxa
+            if not erros:
+                break
+
+    def registrar_exemplo(self, mensagem, categoria):
+        """Grava a intenção dada pelo Gemini para uma mensagem incerta (para retreino)"""
+        if not self.arquivo_exemplos:
+            return
+        linha = json.dumps({'mensagem': normalizar(mensagem), 'intencao': categoria},
+                           ensure_ascii=False)
+        try:
+            with self._lock, open(self.arquivo_exemplos, 'a', encoding='utf-8') as arquivo:
+                arquivo.write(linha + '\n')
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar exemplo de intenção: {e}")
+
+    def carregar_exemplos(self):
+        """Pares (mensagem, intenção) gravados por registrar_exemplo"""
+        if not self.arquivo_exemplos or not os.path.exists(self.arquivo_exemplos):
+            return []
+        exemplos = []
+        with open(self.arquivo_exemplos, encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                try:
+                    exemplo = json.loads(linha)
+                    exemplos.append((exemplo['mensagem'], exemplo['intencao']))
+                except (ValueError, KeyError):
+                    continue
+        return exemplos
+
+    def estatisticas(self):
+        """Mensagens resolvidas localmente e encaminhadas ao Gemini"""
+        with self._lock:
+            total = self.locais + self.encaminhadas
+            return {
+                'locais': self.locais,
+                'encaminhadas': self.encaminhadas,
+                'taxa_local': round(self.locais / total, 3) if total else 0.0
+            }
+
+
+def criar_classificador():
+    """
+    Cria o classificador conforme o ambiente e o retreina com os exemplos gravados
+
+    INTENCOES_CONFIANCA_MINIMA define o limiar (padrão 0.7; acima de 1 desliga o
+    classificador) e INTENCOES_EXEMPLOS o arquivo de exemplos (padrão
+    intencoes_exemplos.jsonl; vazio para não gravar).
+    """
+    confianca_minima = float(os.environ.get('INTENCOES_CONFIANCA_MINIMA', CONFIANCA_MINIMA))
+    arquivo = os.environ.get('INTENCOES_EXEMPLOS', 'intencoes_exemplos.jsonl') or None
+    classificador = ClassificadorIntencoes(confianca_minima, arquivo)
+    exemplos = classificador.carregar_exemplos()
+    if exemplos:
+        classificador.treinar(exemplos)
+        logger.info(f"Classificador de intenções retreinado com {len(exemplos)} exemplos")
+    return classificador
@@ -0,0 +1,225 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from preferencias import normalizar
+
+logger = logging.getLogger('SistemaAgendamento')
+
+# Chamadas ao Gemini com prazo. generate_content é síncrono e sem timeout: uma
+# resposta lenta prendia o worker do gunicorn pelo tempo todo. Aqui a chamada roda
+# em um pool e a thread da requisição espera no máximo o prazo; passado o p95 das
+# latências recentes sem resposta, uma segunda chamada idêntica é disparada (hedge)
+# e vale a primeira que responder. Estourado o prazo, gerar() levanta TimeoutError
+# e o except de cada chamador segue para a heurística local que já existia.
+# Prompts iguais (após normalizar) em voo ao mesmo tempo viram uma única chamada:
+# no pico da abertura, dezenas de "bom dia" simultâneos custam um só request.
+
+PRAZO_PADRAO = 5.0
+ORCAMENTO_TURNO_PADRAO = 8.0
+MAX_CHAMADAS_PADRAO = 16
+
+# Atraso do hedge enquanto não há amostras suficientes para o p95
+ATRASO_HEDGE_INICIAL = 1.5
+ATRASO_HEDGE_MINIMO = 0.3
+AMOSTRAS_MINIMAS = 20
+JANELA_LATENCIAS = 200
+
+
+class ClienteIA:
+    """
+    Executa generate_content com prazo por chamada e hedge opcional
+
+    O perdedor do hedge é cancelado se ainda estiver na fila do pool; se já estiver
+    em andamento, termina sozinho no mesmo prazo (repassado como timeout da
+    requisição) e seu resultado é descartado.
+    """
+
+    def __init__(self, modelo, prazo=PRAZO_PADRAO, hedge=True, max_chamadas=MAX_CHAMADAS_PADRAO,
+                 orcamento_turno=ORCAMENTO_TURNO_PADRAO):
+        self.modelo = modelo
+        self.prazo = prazo
+        self.hedge = hedge
+        self.orcamento_turno_padrao = orcamento_turno
+        self._pool = ThreadPoolExecutor(max_workers=max_chamadas, thread_name_prefix='gemini')
+        self._lock = threading.Lock()
+        self._turno = threading.local()
+        self._latencias = deque(maxlen=JANELA_LATENCIAS)
+        self._em_voo = {}  # (prompt normalizado, opções) -> Future da chamada em andamento
+        self.chamadas = 0
+        self.coalescidas = 0
+        self.hedges = 0
+        self.hedges_vencedores = 0
+        self.estouros = 0
+        self.erros = 0
+
+    @contextmanager
+    def orcamento_turno(self, segundos=None):
+        """Limita o tempo total de IA das chamadas feitas no bloco (um turno do /chat)"""
+        anterior = getattr(self._turno, 'limite', None)
+        segundos = self.orcamento_turno_padrao if segundos is None else segundos
+        self._turno.limite = time.monotonic() + segundos
+        try:
+            yield
+        finally:
+            self._turno.limite = anterior
+
+    def atraso_hedge(self):
+        """p95 das latências recentes (ou ATRASO_HEDGE_INICIAL sem amostras suficientes)"""
+        with self._lock:
+            latencias = sorted(self._latencias)
+        if len(latencias) < AMOSTRAS_MINIMAS:
+            return ATRASO_HEDGE_INICIAL
+        return max(ATRASO_HEDGE_MINIMO, latencias[int(len(latencias) * 0.95)])
+
+    def gerar(self, prompt, prazo=None, **opcoes):
+        """
+        Equivalente a model.generate_content(prompt) limitado pelo prazo
+
+        Se o mesmo prompt já está em voo, espera por ele em vez de chamar de novo.
+
+        Args:
+            prompt (str): Prompt enviado ao Gemini
+            prazo (float): Segundos máximos desta chamada (padrão: self.prazo),
+                limitado também pelo orçamento do turno
+            **opcoes: Repassadas a generate_content (ex.: generation_config)
+
+        Returns:
+            GenerateContentResponse: Resposta da primeira chamada concluída
+
+        Raises:
+            TimeoutError: Prazo ou orçamento do turno esgotado
+        """
+        inicio = time.monotonic()
+        limite = inicio + (self.prazo if prazo is None else prazo)
+        limite_turno = getattr(self._turno, 'limite', None)
+        if limite_turno is not None:
+            limite = min(limite, limite_turno)
+        if limite <= inicio:
+            self._contar_estouro(0.0)
+            raise TimeoutError("Orçamento de IA do turno esgotado")
+
+        chave = (normalizar(prompt), repr(sorted(opcoes.items())))
+        with self._lock:
+            voo = self._em_voo.get(chave)
+            if voo is None:
+                voo = self._em_voo[chave] = Future()
+                lider = True
+                self.chamadas += 1
+            else:
+                lider = False
+                self.coalescidas += 1
+
+        if not lider:
+            try:
+                return voo.result(timeout=limite - inicio)
+            except TimeoutError as e:
+                if voo.done():
+                    raise  # o líder estourou o prazo dele
+                decorrido = time.monotonic() - inicio
+                self._contar_estouro(decorrido)
+                raise TimeoutError(f"Gemini sem resposta em {decorrido:.1f}s") from e
+
+        try:
+            resposta = self._gerar(prompt, opcoes, inicio, limite)
+        except BaseException as e:
+            voo.set_exception(e)
+            raise
+        else:
+            voo.set_result(resposta)
+            return resposta
+        finally:
+            with self._lock:
+                del self._em_voo[chave]
+
+    def _gerar(self, prompt, opcoes, inicio, limite):
+        atraso = inicio + self.atraso_hedge()
+        pendentes = {self._pool.submit(self._chamar, prompt, opcoes, limite)}
+        hedge = None
+        erro = None
+        while pendentes:
+            agora = time.monotonic()
+            if agora >= limite:
+                break
+            espera = limite - agora
+            if self.hedge and hedge is None:
+                espera = min(espera, max(0.0, atraso - agora))
+            prontos, pendentes = wait(pendentes, timeout=espera, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                try:
+                    resposta = futuro.result()
+                except Exception as e:
+                    erro = e
+                    continue
+                for perdedor in pendentes:
+                    perdedor.cancel()
+                if futuro is hedge:
+                    with self._lock:
+                        self.hedges_vencedores += 1
+                return resposta
+            if self.hedge and hedge is None and pendentes and time.monotonic() >= atraso:
+                hedge = self._pool.submit(self._chamar, prompt, opcoes, limite)
+                pendentes.add(hedge)
+                with self._lock:
+                    self.hedges += 1
+
+        if pendentes:
+            for perdedor in pendentes:
+                perdedor.cancel()
+            decorrido = time.monotonic() - inicio
+            self._contar_estouro(decorrido)
+            raise TimeoutError(f"Gemini sem resposta em {decorrido:.1f}s")
+        with self._lock:
+            self.erros += 1
+        raise erro
+
+    def _chamar(self, prompt, opcoes, limite):
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            raise TimeoutError("Prazo esgotado na fila")
+        inicio = time.monotonic()
+        resposta = self.modelo.generate_content(prompt, request_options={'timeout': restante}, **opcoes)
+        with self._lock:
+            self._latencias.append(time.monotonic() - inicio)
+        return resposta
+
+    def _contar_estouro(self, decorrido):
+        with self._lock:
+            self.estouros += 1
+        logger.warning(f"Chamada ao Gemini sem resposta no prazo ({decorrido:.1f}s); usando heurística")
+
+    def estatisticas(self):
+        """Contadores de chamadas, coalescências, hedges e estouros de prazo"""
+        atraso = self.atraso_hedge()
+        with self._lock:
+            return {
+                'chamadas': self.chamadas,
+                'coalescidas': self.coalescidas,
+                'hedges': self.hedges,
+                'hedges_vencedores': self.hedges_vencedores,
+                'estouros': self.estouros,
+                'erros': self.erros,
+                'amostras': len(self._latencias),
+                'atraso_hedge_ms': round(atraso * 1000)
+            }
+
+
+def criar_cliente_ia(modelo):
+    """
+    Cria o cliente do Gemini conforme o ambiente
+
+    GEMINI_PRAZO define o prazo por chamada em segundos, GEMINI_ORCAMENTO_TURNO o
+    tempo total de IA por mensagem, GEMINI_HEDGE=0 desliga o hedge e
+    GEMINI_MAX_CHAMADAS o número de chamadas simultâneas por processo.
+    """
+    return ClienteIA(
+        modelo,
+        prazo=float(os.environ.get('GEMINI_PRAZO', PRAZO_PADRAO)),
+        hedge=os.environ.get('GEMINI_HEDGE', '1') != '0',
+        max_chamadas=int(os.environ.get('GEMINI_MAX_CHAMADAS', MAX_CHAMADAS_PADRAO)),
+        orcamento_turno=float(os.environ.get('GEMINI_ORCAMENTO_TURNO', ORCAMENTO_TURNO_PADRAO))
+    )
@@ -1,12 +1,38 @@
 import sqlite3
 import os
 import logging
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
 import json
 from typing import Optional, List, Dict, Any
 
+from intervalos import agrupar_turnos, expandir_turnos
+
 logger = logging.getLogger('SistemaAgendamento')
 
+# Agendamento que ocupa parte de [inicio, fim) no mesmo médico/data. Consultas são
+# intervalos semiabertos; agendamentos antigos sem hora_fim ocupam só o início.
+SOBREPOE_SQL = """
+    {a}.hora < {fim} AND ({a}.hora_fim > {inicio}
+    OR ({a}.hora_fim IS NULL AND {a}.hora >= {inicio}))
+"""
+
+# Estado de um slot pelos contadores de agendamentos e séries que o ocupam
+ESTADO_SLOT_SQL = """
+    CASE WHEN {agendados} > 0 THEN 'agendado'
+         WHEN {recorrentes} > 0 THEN 'recorrente'
+         ELSE 'livre' END
+"""
+
+
+def _minutos(hora) -> int:
+    """Converte 'HH:MM[:SS]' em minutos desde a meia-noite"""
+    partes = str(hora).split(':')
+    return int(partes[0]) * 60 + int(partes[1])
+
+
+def _hora_texto(minuto: int) -> str:
+    return f"{minuto // 60:02d}:{minuto % 60:02d}"
+
 class Database:
     """Classe principal para gerenciar conexão SQLite3"""
     
@@ -62,6 +88,7 @@ class Database:
                 especialidade_id INTEGER NOT NULL,
                 ativo BOOLEAN DEFAULT 1,
                 agenda_recorrente BOOLEAN DEFAULT 0,
+                versao_agenda INTEGER NOT NULL DEFAULT 0,
                 criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (especialidade_id) REFERENCES especialidades (id)
             )
@@ -109,6 +136,7 @@ class Database:
                 local_id INTEGER NOT NULL,
                 data DATE NOT NULL,
                 hora TIME NOT NULL,
+                hora_fim TIME,
                 observacoes TEXT,
                 status TEXT DEFAULT 'agendado',
                 criado_em DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -168,8 +196,152 @@ class Database:
             )
         ''')
         
+        self._migrar_colunas(conn)
+        self._create_indexes(conn)
+        self._create_version_triggers(conn)
+        self._create_slots_table(conn)
+        
         conn.commit()
     
+    def _migrar_colunas(self, conn):
+        """Adiciona colunas novas a bancos criados por versões anteriores"""
+        for tabela, coluna, tipo in [('agendamentos', 'hora_fim', 'TIME'),
+                                     ('medicos', 'versao_agenda', 'INTEGER NOT NULL DEFAULT 0')]:
+            colunas = {row[1] for row in conn.execute(f"PRAGMA table_info({tabela})")}
+            if coluna not in colunas:
+                conn.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+                logger.info(f"Coluna {tabela}.{coluna} adicionada")
+    
+    def _create_indexes(self, conn):
+        """Cria os índices usados pelas consultas de disponibilidade"""
+        # Conflitos por sobreposição: busca por (médico, data) + faixa de hora,
+        # com hora_fim no próprio índice
+        conn.execute("DROP INDEX IF EXISTS idx_agendamentos_medico_data")
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_agendamentos_intervalo
+            ON agendamentos (medico_id, data, hora, hora_fim)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_recorrentes_medico_hora
+            ON agendamentos_recorrentes (medico_id, hora)
+        ''')
+    
+    def _create_version_triggers(self, conn):
+        """
+        Mantém medicos.versao_agenda: incrementada a cada gravação que muda a
+        agenda do médico (agendamentos, séries recorrentes, horários e o próprio
+        cadastro), é a versão barata que as ETags de disponibilidade consultam
+        """
+        incrementar = "UPDATE medicos SET versao_agenda = versao_agenda + 1 WHERE id IN ({ids});"
+        for tabela in ('agendamentos', 'agendamentos_recorrentes', 'horarios_disponiveis'):
+            for operacao, ids in (('INSERT', 'NEW.medico_id'), ('DELETE', 'OLD.medico_id'),
+                                  ('UPDATE', 'OLD.medico_id, NEW.medico_id')):
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{operacao.lower()}
+                    AFTER {operacao} ON {tabela}
+                    BEGIN {incrementar.format(ids=ids)} END
+                ''')
+        # Só colunas do cadastro: o próprio incremento não dispara o trigger de novo
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_versao_medicos_update
+            AFTER UPDATE OF nome, especialidade_id, ativo ON medicos
+            BEGIN {incrementar.format(ids='NEW.id')} END
+        ''')
+
+    def _create_slots_table(self, conn):
+        """
+        Tabela materializada de slots, gerada de horarios_disponiveis por
+        garantir_slots e mantida pelos triggers abaixo
+
+        Cada slot guarda quantos agendamentos ativos e séries recorrentes o
+        ocupam; os triggers só somam ou subtraem 1 nos slots sobrepostos pela
+        linha gravada (faixa na chave primária), e `estado` é derivado dos
+        contadores. Alterar a grade de um médico apaga seus slots, que são
+        gerados de novo na próxima leitura.
+        """
+        # Versões anteriores tinham uma tabela de slots com outro formato
+        colunas = {row[1] for row in conn.execute("PRAGMA table_info(slots)")}
+        if colunas and 'agendados' not in colunas:
+            for trigger in ('agendamento_insert', 'agendamento_update', 'agendamento_delete',
+                            'recorrente_insert', 'recorrente_update', 'recorrente_delete'):
+                conn.execute(f"DROP TRIGGER IF EXISTS trg_slots_{trigger}")
+            conn.execute("DROP TABLE slots")
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS slots (
+                medico_id INTEGER NOT NULL,
+                local_id INTEGER NOT NULL,
+                data DATE NOT NULL,
+                hora TIME NOT NULL,
+                hora_fim TIME NOT NULL,
+                agendados INTEGER NOT NULL DEFAULT 0,
+                recorrentes INTEGER NOT NULL DEFAULT 0,
+                estado TEXT NOT NULL DEFAULT 'livre',
+                PRIMARY KEY (medico_id, data, hora)
+            ) WITHOUT ROWID
+        ''')
+        # Período gerado de cada médico
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS slots_gerados (
+                medico_id INTEGER PRIMARY KEY,
+                data_inicio DATE NOT NULL,
+                data_fim DATE NOT NULL
+            )
+        ''')
+        # Próximos slots livres: WHERE estado = 'livre' ORDER BY data, hora LIMIT n
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_slots_estado_data
+            ON slots (estado, data, hora)
+        ''')
+
+        agendamento = '''
+            UPDATE slots SET agendados = agendados {sinal} 1,
+                estado = {estado}
+            WHERE {r}.status = 'agendado' AND medico_id = {r}.medico_id AND data = {r}.data
+            AND hora_fim > substr({r}.hora, 1, 5)
+            AND (hora < substr({r}.hora_fim, 1, 5)
+                 OR ({r}.hora_fim IS NULL AND hora <= substr({r}.hora, 1, 5)));
+        '''
+        # Séries recorrentes ocupam o slot que contém seu início
+        recorrente = '''
+            UPDATE slots SET recorrentes = recorrentes {sinal} 1,
+                estado = {estado}
+            WHERE {r}.ativo = 1 AND medico_id = {r}.medico_id
+            AND data >= {r}.data_inicio AND ({r}.data_fim IS NULL OR data <= {r}.data_fim)
+            AND (CAST(strftime('%w', data) AS INTEGER) + 6) % 7 = {r}.dia_semana
+            AND hora <= substr({r}.hora, 1, 5) AND hora_fim > substr({r}.hora, 1, 5);
+        '''
+        for tabela, modelo, contador, outro, colunas in (
+                ('agendamentos', agendamento, 'agendados', 'recorrentes',
+                 'medico_id, data, hora, hora_fim, status'),
+                ('agendamentos_recorrentes', recorrente, 'recorrentes', 'agendados',
+                 'medico_id, dia_semana, hora, data_inicio, data_fim, ativo')):
+            comandos = {}
+            for sinal, r in (('+', 'NEW'), ('-', 'OLD')):
+                contadores = {contador: f"{contador} {sinal} 1", outro: outro}
+                comandos[r] = modelo.format(sinal=sinal, r=r,
+                                            estado=ESTADO_SLOT_SQL.format(**contadores))
+            for operacao, corpo in (('INSERT', comandos['NEW']), ('DELETE', comandos['OLD']),
+                                    (f'UPDATE OF {colunas}', comandos['OLD'] + comandos['NEW'])):
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_slots_{tabela}_{operacao.split()[0].lower()}
+                    AFTER {operacao} ON {tabela}
+                    BEGIN {corpo} END
+                ''')
+
+        descartar = '''
+            DELETE FROM slots WHERE medico_id = {r}.medico_id;
+            DELETE FROM slots_gerados WHERE medico_id = {r}.medico_id;
+        '''
+        for operacao, corpo in (('INSERT', descartar.format(r='NEW')),
+                                ('DELETE', descartar.format(r='OLD')),
+                                ('UPDATE', descartar.format(r='OLD') + descartar.format(r='NEW'))):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_slots_horarios_{operacao.lower()}
+                AFTER {operacao} ON horarios_disponiveis
+                BEGIN {corpo} END
+            ''')
+    
     def _populate_initial_data(self, conn):
         """Popula dados iniciais se não existirem"""
         
@@ -300,6 +472,132 @@ class Database:
             cursor = conn.execute(query, params)
             conn.commit()
             return cursor.rowcount
+    
+    def garantir_slots(self, medico_ids: List[int], data_fim: date) -> int:
+        """
+        Garante a tabela de slots gerada de hoje até `data_fim` para os médicos
+        
+        Só gera o que falta: dias após o último gerado, ou o período inteiro
+        de médicos ainda sem slots (ou cuja grade mudou). A geração roda em uma
+        transação BEGIN IMMEDIATE, então é feita uma única vez mesmo com vários
+        workers, e nenhuma gravação na agenda fica entre a leitura dos
+        agendamentos e a inserção dos slots.
+        
+        Args:
+            medico_ids: Médicos consultados
+            data_fim: Última data necessária
+            
+        Returns:
+            int: Quantidade de slots gerados (0 se já estava tudo gerado)
+        """
+        hoje = date.today()
+        with self.get_connection() as conn:
+            if not self._slots_pendentes(conn, medico_ids, hoje, data_fim):
+                return 0
+            conn.execute("BEGIN IMMEDIATE")
+            # Outro worker pode ter gerado enquanto esta conexão esperava o lock
+            pendentes = self._slots_pendentes(conn, medico_ids, hoje, data_fim)
+            total = self._gerar_slots(conn, pendentes, hoje, data_fim) if pendentes else 0
+            conn.commit()
+        if total:
+            logger.info(f"Tabela de slots: {total} slots gerados para "
+                        f"{len(pendentes)} médicos até {data_fim.isoformat()}")
+        return total
+    
+    def _slots_pendentes(self, conn, medico_ids, hoje, data_fim):
+        """
+        medico_id -> (primeira data a gerar, último dia gerado ao final) dos
+        médicos cujo período gerado não cobre hoje..data_fim
+        """
+        placeholders = ', '.join('?' for _ in medico_ids) or 'NULL'
+        gerados = {
+            row['medico_id']: (date.fromisoformat(row['data_inicio']),
+                               date.fromisoformat(row['data_fim']))
+            for row in conn.execute(
+                f"SELECT medico_id, data_inicio, data_fim FROM slots_gerados "
+                f"WHERE medico_id IN ({placeholders})", tuple(medico_ids))
+        }
+        pendentes = {}
+        for medico_id in medico_ids:
+            inicio, fim = gerados.get(medico_id, (None, None))
+            if fim is None:
+                pendentes[medico_id] = (hoje, data_fim)
+            elif fim < data_fim or inicio < hoje:
+                pendentes[medico_id] = (max(fim + timedelta(days=1), hoje), max(fim, data_fim))
+        return pendentes
+    
+    def _gerar_slots(self, conn, pendentes, hoje, data_fim):
+        """Insere os slots de cada médico pendente a partir da data indicada, com os contadores"""
+        medico_ids = list(pendentes)
+        placeholders = ', '.join('?' for _ in medico_ids)
+        inicio_geral = min(desde for desde, _ in pendentes.values())
+        
+        configuracoes = [
+            (row['medico_id'], row['local_id'], row['dia_semana'], _minutos(row['hora_inicio']),
+             _minutos(row['hora_fim']), row['duracao_consulta'] or 30)
+            for row in conn.execute(f'''
+                SELECT medico_id, local_id, dia_semana, hora_inicio, hora_fim, duracao_consulta
+                FROM horarios_disponiveis
+                WHERE ativo = 1 AND medico_id IN ({placeholders})
+                ORDER BY id
+            ''', medico_ids)
+        ]
+        agendamentos = {}  # (medico_id, data) -> [(inicio, fim | None)]
+        for row in conn.execute(f'''
+            SELECT medico_id, data, hora, hora_fim FROM agendamentos
+            WHERE status = 'agendado' AND data >= ? AND data <= ? AND medico_id IN ({placeholders})
+        ''', (inicio_geral.isoformat(), data_fim.isoformat(), *medico_ids)):
+            agendamentos.setdefault((row['medico_id'], row['data']), []).append(
+                (_minutos(row['hora']), _minutos(row['hora_fim']) if row['hora_fim'] else None))
+        recorrentes = {}  # medico_id -> [(dia_semana, minuto, data_inicio, data_fim | None)]
+        for row in conn.execute(f'''
+            SELECT medico_id, dia_semana, hora, data_inicio, data_fim FROM agendamentos_recorrentes
+            WHERE ativo = 1 AND data_inicio <= ? AND (data_fim IS NULL OR data_fim >= ?)
+            AND medico_id IN ({placeholders})
+        ''', (data_fim.isoformat(), inicio_geral.isoformat(), *medico_ids)):
+            recorrentes.setdefault(row['medico_id'], []).append(
+                (row['dia_semana'], _minutos(row['hora']), row['data_inicio'], row['data_fim']))
+        
+        novos = []
+        semanas = agrupar_turnos(configuracoes)
+        for medico_id, (desde, _) in pendentes.items():
+            grade = [expandir_turnos(turnos) for turnos in semanas.get(medico_id, [[]] * 7)]
+            data_slot = desde
+            while data_slot <= data_fim:
+                data_txt = data_slot.isoformat()
+                ocupados = agendamentos.get((medico_id, data_txt), ())
+                series = [minuto for dia, minuto, r_inicio, r_fim in recorrentes.get(medico_id, ())
+                          if dia == data_slot.weekday() and r_inicio <= data_txt
+                          and (r_fim is None or r_fim >= data_txt)]
+                vistos = set()
+                for minuto, local_id, duracao in sorted(grade[data_slot.weekday()]):
+                    if minuto in vistos:
+                        continue
+                    vistos.add(minuto)
+                    fim = minuto + duracao
+                    agendados = sum(1 for a_inicio, a_fim in ocupados
+                                    if a_inicio < fim and (a_fim > minuto if a_fim is not None
+                                                           else a_inicio >= minuto))
+                    bloqueios = sum(1 for r_minuto in series if minuto <= r_minuto < fim)
+                    estado = ('agendado' if agendados else
+                              'recorrente' if bloqueios else 'livre')
+                    novos.append((medico_id, local_id, data_txt, _hora_texto(minuto),
+                                  _hora_texto(fim), agendados, bloqueios, estado))
+                data_slot += timedelta(days=1)
+        
+        conn.executemany('''
+            INSERT OR REPLACE INTO slots
+            (medico_id, local_id, data, hora, hora_fim, agendados, recorrentes, estado)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', novos)
+        for medico_id, (_, gerado_ate) in pendentes.items():
+            conn.execute("DELETE FROM slots WHERE medico_id = ? AND data < ?",
+                         (medico_id, hoje.isoformat()))
+            conn.execute('''
+                INSERT OR REPLACE INTO slots_gerados (medico_id, data_inicio, data_fim)
+                VALUES (?, ?, ?)
+            ''', (medico_id, hoje.isoformat(), gerado_ate.isoformat()))
+        return len(novos)
 
 # Instância global do banco
 db = Database()
\ No newline at end of file
@@ -0,0 +1,838 @@
+import base64
+import logging
+import os
+import zlib
+from datetime import datetime, date, time, timedelta
+
+from cache_disponibilidade import CacheDisponibilidade
+from intervalos import sobreposicoes
+from mapa_ocupacao import MapaOcupacao
+from ocupacao import MatrizOcupacao, minutos
+from reservas import criar_reservas
+
+logger = logging.getLogger('SistemaAgendamento')
+
+DIAS_SEMANA = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
+
+
+# Motivo exibido para cada situação de slot indisponível
+MOTIVOS_INDISPONIBILIDADE = {
+    'agendado': 'Horário já ocupado por outro paciente',
+    'recorrente': 'Horário bloqueado por agendamento recorrente',
+    'reservado': 'Horário reservado temporariamente por outro paciente'
+}
+
+# Duração assumida (minutos) para horários fora da grade de um médico
+DURACAO_PADRAO = 30
+
+# Máximo de slots por chamada de /api/verificar-disponibilidade/lote
+LIMITE_VERIFICACAO_LOTE = 500
+
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.environ.get(nome, padrao))
+    except ValueError:
+        logger.warning(f"Valor inválido em {nome}; usando {padrao}")
+        return padrao
+
+
+class PoliticaHorizonte:
+    """
+    Política de busca de horários comum aos backends SQLAlchemy e SQLite
+
+    Ajustável pelas variáveis de ambiente DISPONIBILIDADE_DIAS_BUSCA,
+    DISPONIBILIDADE_LIMITE, DISPONIBILIDADE_ANTECEDENCIA_HORAS,
+    DISPONIBILIDADE_DIAS_MATRIZ, DISPONIBILIDADE_JANELAS (ex.: "7,30,90,180") e
+    DISPONIBILIDADE_DIAS_MAXIMO.
+    """
+
+    def __init__(self, dias_busca=None, limite=None, antecedencia_horas=None,
+                 dias_matriz=None, janelas=None, dias_maximo=None):
+        self.dias_busca = dias_busca if dias_busca is not None else _env_int(
+            'DISPONIBILIDADE_DIAS_BUSCA', 30)
+        self.limite = limite if limite is not None else _env_int(
+            'DISPONIBILIDADE_LIMITE', 10)
+        self.antecedencia = timedelta(hours=antecedencia_horas if antecedencia_horas is not None
+                                      else _env_int('DISPONIBILIDADE_ANTECEDENCIA_HORAS', 2))
+        # A matriz precisa cobrir pelo menos o horizonte de busca
+        self.dias_matriz = max(dias_matriz if dias_matriz is not None else _env_int(
+            'DISPONIBILIDADE_DIAS_MATRIZ', 30), self.dias_busca)
+        # Janelas crescentes para "próximo horário" quando o horizonte inicial não basta
+        if janelas is None:
+            try:
+                janelas = [int(dias) for dias in os.environ.get(
+                    'DISPONIBILIDADE_JANELAS', '7,30,90,180').split(',') if dias.strip()]
+            except ValueError:
+                logger.warning("Valor inválido em DISPONIBILIDADE_JANELAS; usando 7,30,90,180")
+                janelas = [7, 30, 90, 180]
+        self.dias_maximo = max(dias_maximo if dias_maximo is not None else _env_int(
+            'DISPONIBILIDADE_DIAS_MAXIMO', 180), self.dias_busca)
+        self.janelas = sorted({min(dias, self.dias_maximo) for dias in janelas} | {self.dias_maximo})
+
+    def janelas_alem(self, dias_cobertos):
+        """Fins (em dias a partir de hoje) das janelas que começam após `dias_cobertos`"""
+        return [dias for dias in self.janelas if dias > dias_cobertos]
+
+
+def codificar_cursor(slot):
+    """Cursor opaco de paginação a partir do último slot (data, minuto, medico_id, ...)"""
+    data_slot, minuto, medico_id = slot[:3]
+    texto = f"{data_slot.isoformat()}|{minuto}|{medico_id}"
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Inverso de codificar_cursor; levanta ValueError para cursores inválidos"""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        data_txt, minuto, medico_id = texto.split('|')
+        return date.fromisoformat(data_txt), int(minuto), int(medico_id)
+    except Exception:
+        raise ValueError(f"Cursor inválido: {cursor}")
+
+
+def _hora(minuto):
+    """Minutos desde 00:00 como time (fins à meia-noite viram 23:59)"""
+    minuto = min(minuto, 24 * 60 - 1)
+    return time(minuto // 60, minuto % 60)
+
+
+def _hora_texto(minuto):
+    return _hora(minuto).strftime('%H:%M')
+
+
+def _sobrepoe(Agendamento, inicio, fim):
+    """
+    Filtros de agendamento que ocupa parte de [inicio, fim): faixa sobre `hora`
+    no índice (medico_id, data, hora, hora_fim). Agendamentos antigos sem
+    hora_fim ocupam só o minuto de início.
+    """
+    from sqlalchemy import and_, or_
+
+    return (Agendamento.hora < _hora(fim),
+            or_(Agendamento.hora_fim > _hora(inicio),
+                and_(Agendamento.hora_fim.is_(None), Agendamento.hora >= _hora(inicio))))
+
+
+def _data(valor):
+    """Normaliza datas vindas do SQLite (texto ISO) ou do SQLAlchemy (date)"""
+    if valor is None or isinstance(valor, date):
+        return valor
+    return date.fromisoformat(str(valor)[:10])
+
+
+class FonteSQLAlchemy:
+    """Carrega dados de agenda em lote pelos modelos SQLAlchemy (models.py)"""
+
+    # Sem tabela de slots: datas além do horizonte são geradas pela matriz
+    slots_materializados = False
+
+    def carregar_medicos(self):
+        from models import Medico
+        from app import db
+
+        linhas = db.session.query(Medico.id, Medico.nome,
+                                  Medico.especialidade_id).filter(
+                                      Medico.ativo == True).order_by(
+                                          Medico.id).all()
+        return {medico_id: (nome, esp_id) for medico_id, nome, esp_id in linhas}
+
+    def versoes_agenda(self, especialidade_id=None):
+        """medico_id -> versao_agenda dos médicos ativos (da especialidade, se informada)"""
+        from models import Medico
+        from app import db
+
+        consulta = db.session.query(Medico.id, Medico.versao_agenda).filter(Medico.ativo == True)
+        if especialidade_id is not None:
+            consulta = consulta.filter(Medico.especialidade_id == especialidade_id)
+        return dict(consulta.all())
+
+    def versao_agenda(self, medico_id):
+        """versao_agenda de um médico ativo (None se inativo ou inexistente)"""
+        from models import Medico
+        from app import db
+
+        return db.session.query(Medico.versao_agenda).filter(
+            Medico.id == medico_id, Medico.ativo == True).scalar()
+
+    def carregar_locais(self):
+        from models import Local
+        from app import db
+
+        return dict(db.session.query(Local.id, Local.nome).all())
+
+    def carregar_configuracoes(self, medico_ids=None):
+        from models import HorarioDisponivel
+        from app import db
+
+        consulta = db.session.query(
+            HorarioDisponivel.medico_id, HorarioDisponivel.local_id,
+            HorarioDisponivel.dia_semana, HorarioDisponivel.hora_inicio,
+            HorarioDisponivel.hora_fim,
+            HorarioDisponivel.duracao_consulta).filter(
+                HorarioDisponivel.ativo == True)
+        if medico_ids is not None:
+            consulta = consulta.filter(HorarioDisponivel.medico_id.in_(medico_ids))
+
+        return [(medico_id, local_id, dia_semana, minutos(inicio), minutos(fim),
+                 duracao)
+                for medico_id, local_id, dia_semana, inicio, fim, duracao in
+                consulta.order_by(HorarioDisponivel.id).all()]
+
+    def carregar_turnos(self, medico_id):
+        """Turnos ativos de um médico em todos os locais: (horario_id, local_id, dia_semana, inicio, fim)"""
+        from models import HorarioDisponivel
+
+        horarios = HorarioDisponivel.query.filter_by(medico_id=medico_id, ativo=True).all()
+        return [(horario.id, horario.local_id, horario.dia_semana,
+                 minutos(horario.hora_inicio), minutos(horario.hora_fim))
+                for horario in horarios]
+
+    def carregar_agendamentos(self, medico_ids, data_inicio, data_fim):
+        from models import Agendamento
+        from app import db
+
+        consulta = db.session.query(
+            Agendamento.medico_id, Agendamento.data, Agendamento.hora,
+            Agendamento.hora_fim).filter(
+                Agendamento.data >= data_inicio,
+                Agendamento.data <= data_fim,
+                Agendamento.status == 'agendado')
+        if medico_ids is not None:
+            consulta = consulta.filter(Agendamento.medico_id.in_(medico_ids))
+
+        return [(medico_id, data_ag, minutos(hora), minutos(hora_fim) if hora_fim else None)
+                for medico_id, data_ag, hora, hora_fim in consulta.all()]
+
+    def carregar_recorrentes(self, medico_ids, data_inicio, data_fim):
+        from models import AgendamentoRecorrente
+        from app import db
+
+        consulta = db.session.query(
+            AgendamentoRecorrente.medico_id, AgendamentoRecorrente.dia_semana,
+            AgendamentoRecorrente.hora, AgendamentoRecorrente.data_inicio,
+            AgendamentoRecorrente.data_fim).filter(
+                AgendamentoRecorrente.ativo == True,
+                AgendamentoRecorrente.data_inicio <= data_fim,
+                (AgendamentoRecorrente.data_fim.is_(None)) |
+                (AgendamentoRecorrente.data_fim >= data_inicio))
+        if medico_ids is not None:
+            consulta = consulta.filter(
+                AgendamentoRecorrente.medico_id.in_(medico_ids))
+
+        return [(medico_id, dia_semana, minutos(hora), inicio, fim)
+                for medico_id, dia_semana, hora, inicio, fim in consulta.all()]
+
+    def conflito_agendamento(self, medico_id, data_slot, inicio, fim):
+        """True se há agendamento ativo do médico sobrepondo [inicio, fim) (minutos)"""
+        from models import Agendamento
+
+        return Agendamento.query.filter(
+            Agendamento.medico_id == medico_id,
+            Agendamento.data == data_slot,
+            Agendamento.status == 'agendado',
+            *_sobrepoe(Agendamento, inicio, fim)).first() is not None
+
+    def agendamentos_existentes(self, slots):
+        """Dos slots (medico_id, data, inicio, fim), os sobrepostos por agendamento ativo"""
+        from models import Agendamento
+        from app import db
+
+        if not slots:
+            return set()
+        # Uma consulta pelos médicos/datas envolvidos; a sobreposição é conferida aqui
+        linhas = db.session.query(
+            Agendamento.medico_id, Agendamento.data, Agendamento.hora,
+            Agendamento.hora_fim).filter(
+                Agendamento.medico_id.in_({slot[0] for slot in slots}),
+                Agendamento.data.in_({slot[1] for slot in slots}),
+                Agendamento.status == 'agendado').all()
+        agendados = {}
+        for medico_id, data_ag, hora, hora_fim in linhas:
+            inicio = minutos(hora)
+            agendados.setdefault((medico_id, data_ag), []).append(
+                (inicio, minutos(hora_fim) if hora_fim else inicio + 1))
+        return {
+            (medico_id, data_slot, inicio)
+            for medico_id, data_slot, inicio, fim in slots
+            if any(a_inicio < fim and a_fim > inicio
+                   for a_inicio, a_fim in agendados.get((medico_id, data_slot), ()))
+        }
+
+
+class FonteSQLite:
+    """Carrega dados de agenda em lote direto do SQLite (database.py)"""
+
+    # Datas além do horizonte da matriz vêm da tabela de slots (horarios_livres)
+    slots_materializados = True
+
+    def _filtro_medicos(self, medico_ids, coluna='medico_id'):
+        if medico_ids is None:
+            return '', ()
+        placeholders = ', '.join('?' for _ in medico_ids) or 'NULL'
+        return f" AND {coluna} IN ({placeholders})", tuple(medico_ids)
+
+    def carregar_medicos(self):
+        from database import db
+
+        rows = db.execute_query(
+            "SELECT id, nome, especialidade_id FROM medicos WHERE ativo = 1 ORDER BY id")
+        return {row['id']: (row['nome'], row['especialidade_id']) for row in rows}
+
+    def versoes_agenda(self, especialidade_id=None):
+        """medico_id -> versao_agenda dos médicos ativos (da especialidade, se informada)"""
+        from database import db
+
+        filtro, params = ('', ()) if especialidade_id is None else \
+            (' AND especialidade_id = ?', (especialidade_id,))
+        rows = db.execute_query(
+            f"SELECT id, versao_agenda FROM medicos WHERE ativo = 1{filtro}", params)
+        return {row['id']: row['versao_agenda'] for row in rows}
+
+    def versao_agenda(self, medico_id):
+        """versao_agenda de um médico ativo (None se inativo ou inexistente)"""
+        from database import db
+
+        rows = db.execute_query(
+            "SELECT versao_agenda FROM medicos WHERE id = ? AND ativo = 1", (medico_id,))
+        return rows[0]['versao_agenda'] if rows else None
+
+    def carregar_locais(self):
+        from database import db
+
+        rows = db.execute_query("SELECT id, nome FROM locais")
+        return {row['id']: row['nome'] for row in rows}
+
+    def carregar_configuracoes(self, medico_ids=None):
+        from database import db
+
+        filtro, params = self._filtro_medicos(medico_ids)
+        rows = db.execute_query(
+            f"""
+            SELECT medico_id, local_id, dia_semana, hora_inicio, hora_fim, duracao_consulta
+            FROM horarios_disponiveis
+            WHERE ativo = 1{filtro}
+            ORDER BY id
+            """, params)
+        return [(row['medico_id'], row['local_id'], row['dia_semana'],
+                 minutos(row['hora_inicio']), minutos(row['hora_fim']),
+                 row['duracao_consulta']) for row in rows]
+
+    def carregar_turnos(self, medico_id):
+        """Turnos ativos de um médico em todos os locais: (horario_id, local_id, dia_semana, inicio, fim)"""
+        from database import db
+
+        rows = db.execute_query(
+            """
+            SELECT id, local_id, dia_semana, hora_inicio, hora_fim
+            FROM horarios_disponiveis WHERE medico_id = ? AND ativo = 1
+            """, (medico_id,))
+        return [(row['id'], row['local_id'], row['dia_semana'],
+                 minutos(row['hora_inicio']), minutos(row['hora_fim'])) for row in rows]
+
+    def carregar_agendamentos(self, medico_ids, data_inicio, data_fim):
+        from database import db
+
+        filtro, params = self._filtro_medicos(medico_ids)
+        rows = db.execute_query(
+            f"""
+            SELECT medico_id, data, hora, hora_fim FROM agendamentos
+            WHERE status = 'agendado' AND data >= ? AND data <= ?{filtro}
+            """, (data_inicio.isoformat(), data_fim.isoformat()) + params)
+        return [(row['medico_id'], _data(row['data']), minutos(row['hora']),
+                 minutos(row['hora_fim']) if row['hora_fim'] else None)
+                for row in rows]
+
+    def carregar_recorrentes(self, medico_ids, data_inicio, data_fim):
+        from database import db
+
+        filtro, params = self._filtro_medicos(medico_ids)
+        rows = db.execute_query(
+            f"""
+            SELECT medico_id, dia_semana, hora, data_inicio, data_fim
+            FROM agendamentos_recorrentes
+            WHERE ativo = 1 AND data_inicio <= ?
+            AND (data_fim IS NULL OR data_fim >= ?){filtro}
+            """, (data_fim.isoformat(), data_inicio.isoformat()) + params)
+        return [(row['medico_id'], row['dia_semana'], minutos(row['hora']),
+                 _data(row['data_inicio']), _data(row['data_fim']))
+                for row in rows]
+
+    def conflito_agendamento(self, medico_id, data_slot, inicio, fim):
+        """True se há agendamento ativo do médico sobrepondo [inicio, fim) (minutos)"""
+        from database import db, SOBREPOE_SQL
+
+        rows = db.execute_query(
+            f"""
+            SELECT 1 FROM agendamentos a
+            WHERE a.medico_id = ?1 AND a.data = ?2 AND a.status = 'agendado'
+            AND {SOBREPOE_SQL.format(a='a', inicio='?3', fim='?4')}
+            LIMIT 1
+            """,
+            (medico_id, data_slot.isoformat(), _hora_texto(inicio), _hora_texto(fim)))
+        return bool(rows)
+
+    def agendamentos_existentes(self, slots):
+        """Dos slots (medico_id, data, inicio, fim), os sobrepostos por agendamento ativo"""
+        from database import db, SOBREPOE_SQL
+
+        candidatos = sorted({(medico_id, data_slot.isoformat(), _hora_texto(inicio), _hora_texto(fim))
+                             for medico_id, data_slot, inicio, fim in slots})
+        ocupados = set()
+        # Lotes de até 200 slots (800 parâmetros, abaixo do limite do SQLite)
+        for i in range(0, len(candidatos), 200):
+            lote = candidatos[i:i + 200]
+            valores = ', '.join('(?, ?, ?, ?)' for _ in lote)
+            rows = db.execute_query(
+                f"""
+                WITH candidatos(medico_id, data, hora, hora_fim) AS (VALUES {valores})
+                SELECT DISTINCT c.medico_id, c.data, c.hora FROM candidatos c
+                JOIN agendamentos a ON a.medico_id = c.medico_id
+                AND a.data = c.data AND a.status = 'agendado'
+                AND {SOBREPOE_SQL.format(a='a', inicio='c.hora', fim='c.hora_fim')}
+                """, tuple(valor for slot in lote for valor in slot))
+            ocupados.update((row['medico_id'], _data(row['data']), minutos(row['hora']))
+                            for row in rows)
+        return ocupados
+
+    def horarios_livres(self, medico_ids, data_inicio, data_fim, local_id=None,
+                        dias_semana=None, hora_min=None, hora_max=None,
+                        a_partir=None, limite=None):
+        """
+        Slots livres da tabela materializada de slots, em ordem cronológica
+
+        Gera antes o que faltar do período (Database.garantir_slots); a busca em
+        si é uma leitura do índice (estado, data, hora) que para em `limite`.
+        Os filtros são os de MatrizOcupacao.horarios_livres.
+
+        Returns:
+            list: Tuplas (data, minuto, medico_id, local_id)
+        """
+        from database import db
+
+        if a_partir is not None:
+            data_inicio = max(data_inicio, a_partir.date())
+        if not medico_ids or data_fim < data_inicio:
+            return []
+        db.garantir_slots(medico_ids, data_fim)
+
+        filtro, params = self._filtro_medicos(medico_ids)
+        if local_id is not None:
+            filtro += " AND local_id = ?"
+            params += (local_id,)
+        if dias_semana is not None:
+            filtro += (" AND (CAST(strftime('%w', data) AS INTEGER) + 6) % 7 IN "
+                       f"({', '.join('?' for _ in dias_semana) or 'NULL'})")
+            params += tuple(dias_semana)
+        for condicao, minuto in ((" AND hora >= ?", hora_min), (" AND hora < ?", hora_max)):
+            if minuto is not None:
+                filtro += condicao
+                params += (f"{minuto // 60:02d}:{minuto % 60:02d}",)
+        if a_partir is not None:
+            filtro += " AND (data > ? OR hora > ?)"
+            params += (a_partir.date().isoformat(), a_partir.strftime('%H:%M'))
+
+        rows = db.execute_query(
+            f"""
+            SELECT data, hora, medico_id, local_id FROM slots
+            WHERE estado = 'livre' AND data >= ? AND data <= ?{filtro}
+            ORDER BY data, hora, medico_id
+            LIMIT ?
+            """, (data_inicio.isoformat(), data_fim.isoformat()) + params
+            + (-1 if limite is None else limite,))
+        return [(_data(row['data']), minutos(row['hora']), row['medico_id'], row['local_id'])
+                for row in rows]
+
+
+class MotorDisponibilidade:
+    """
+    Serviço de disponibilidade compartilhado pelos dois backends
+
+    O acesso ao banco fica no adaptador `fonte` (FonteSQLAlchemy ou FonteSQLite);
+    buscas, verificação de slots, cache e política de horizonte são os mesmos.
+    """
+
+    def __init__(self, fonte, politica=None, reservas=None):
+        self.fonte = fonte
+        self.politica = politica or PoliticaHorizonte()
+        self.matriz = MatrizOcupacao(fonte, dias=self.politica.dias_matriz)
+        # Resultados por (especialidade, local, ...); invalidados por médico alterado
+        self.cache = CacheDisponibilidade()
+        self.matriz.ao_alterar(self.cache.invalidar_medico)
+        # Mapa de calor do painel administrativo, atualizado por médico alterado
+        self.mapa_ocupacao = MapaOcupacao(self.matriz)
+        # Slots segurados entre a escolha e a confirmação (ver reservas.py)
+        self.reservas = reservas or criar_reservas()
+
+    def buscar_slots(self, especialidade_id, local_id=None, dias=None, limite=None,
+                     preferencias=None):
+        """
+        Busca os próximos slots livres de uma especialidade
+
+        Com `dias` (ou preferencias['data_fim']) informado a busca fica restrita a
+        esse horizonte, limitado a politica.dias_maximo. Sem ele, começa no
+        horizonte da política e, se não encontrar `limite` slots, expande em
+        janelas crescentes (politica.janelas) até politica.dias_maximo. Em ambos
+        os casos o que passa do horizonte da matriz é avaliado em lote, janela a
+        janela.
+
+        As preferências (preferencias.py) são aplicadas durante a geração: dias da
+        semana e janela de horário viram máscaras de bits, o médico preferido
+        restringe os fluxos e data_inicio/data_fim limitam o intervalo.
+
+        Returns:
+            list: Tuplas (data, minuto, medico_id, local_id) em ordem cronológica
+        """
+        preferencias = preferencias or {}
+        medico_ids = self.matriz.medicos_da_especialidade(especialidade_id)
+        if preferencias.get('medico_id'):
+            medico_ids = [m for m in medico_ids if m == preferencias['medico_id']]
+        if not medico_ids:
+            return []
+        limite = self.politica.limite if limite is None else limite
+        filtros = {
+            'dias_semana': set(preferencias['dias_semana']) if preferencias.get('dias_semana') else None,
+            'hora_min': preferencias.get('hora_min'),
+            'hora_max': preferencias.get('hora_max')
+        }
+
+        hoje = date.today()
+        a_partir = datetime.now() + self.politica.antecedencia
+        data_inicio = _data(preferencias.get('data_inicio'))
+        if data_inicio is not None:
+            # a_partir exclui o próprio minuto: recuar um minuto inclui 00:00 de data_inicio
+            a_partir = max(a_partir, datetime.combine(data_inicio, time.min) - timedelta(minutes=1))
+        data_fim = _data(preferencias.get('data_fim'))
+        if data_fim is not None:
+            dias = min(dias, (data_fim - hoje).days) if dias is not None else (data_fim - hoje).days
+            if dias < 0:
+                return []
+        expandir = dias is None
+        dias = self.politica.dias_busca if dias is None else min(dias, self.politica.dias_maximo)
+
+        slots = self.matriz.horarios_livres(
+            medico_ids, local_id=local_id, a_partir=a_partir, dias=dias,
+            limite=limite, **filtros)
+        if len(slots) >= limite:
+            return slots
+
+        # A matriz já cobriu min(dias, horizonte); o restante vem janela a janela.
+        # Com horizonte fixo as janelas param em `dias`
+        cobertos = min(dias, self.matriz.dias)
+        fins = self.politica.janelas_alem(cobertos)
+        if not expandir:
+            fins = [fim for fim in fins if fim < dias] + ([dias] if dias > cobertos else [])
+        for fim_janela in fins:
+            inicio_janela = hoje + timedelta(days=cobertos + 1)
+            if data_inicio is not None:
+                inicio_janela = max(inicio_janela, data_inicio)
+            slots += self._horarios_livres_alem(
+                medico_ids, inicio_janela, hoje + timedelta(days=fim_janela),
+                local_id=local_id, limite=limite - len(slots), **filtros)
+            if len(slots) >= limite:
+                break
+            cobertos = fim_janela
+        return slots
+
+    def _horarios_livres_alem(self, medico_ids, data_inicio, data_fim, **filtros):
+        """
+        Slots livres em datas além do horizonte da matriz: lidos da tabela de
+        slots quando a fonte a mantém (FonteSQLite), senão gerados pela matriz
+        """
+        if self.fonte.slots_materializados:
+            return self.fonte.horarios_livres(medico_ids, data_inicio, data_fim, **filtros)
+        return self.matriz.horarios_livres_alem(medico_ids, data_inicio, data_fim, **filtros)
+
+    def buscar_horarios(self, especialidade_id, local_id=None, dias=None, limite=None,
+                        preferencias=None, sessao=None):
+        """
+        Busca próximos horários livres de uma especialidade (opcionalmente filtrada por local)
+
+        Args:
+            especialidade_id (int): Especialidade desejada
+            local_id (int): Local de atendimento (None = todos os locais)
+            dias (int): Horizonte fixo em dias (padrão: horizonte adaptativo da política)
+            limite (int): Quantidade máxima de horários retornados (padrão: política)
+            preferencias (dict): Filtros do paciente (ver preferencias.py)
+            sessao (str): Sessão cuja própria reserva continua visível
+
+        Returns:
+            list: Horários livres ordenados por data e hora
+        """
+        limite = self.politica.limite if limite is None else limite
+        # Slots reservados por outras sessões saem da lista; busca-se a folga no cache
+        retidos = self.reservas.retidos(excluir_sessao=sessao)
+        busca = limite + len(retidos)
+        chave = ('horarios', self.matriz.geracao, especialidade_id, local_id, dias, busca,
+                 tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                              for k, v in (preferencias or {}).items())))
+        horarios = self.cache.obter(chave)
+        if horarios is None:
+            epoca = self.cache.epoca
+            agora = datetime.now()
+            horarios = [
+                self._formatar_slot(data_slot, minuto, medico_id, slot_local_id, agora)
+                for data_slot, minuto, medico_id, slot_local_id in self.buscar_slots(
+                    especialidade_id, local_id=local_id, dias=dias, limite=busca,
+                    preferencias=preferencias)
+            ]
+            self.cache.guardar(chave, horarios,
+                               self.matriz.medicos_da_especialidade(especialidade_id),
+                               epoca=epoca)
+        if retidos:
+            horarios = [horario for horario in horarios
+                        if (horario['medico_id'], horario['data'], minutos(horario['hora']))
+                        not in retidos]
+        return [dict(horario) for horario in horarios[:limite]]
+
+    def nomes_medicos(self, especialidade_id):
+        """medico_id -> nome dos médicos ativos de uma especialidade"""
+        return {medico_id: self.matriz.nome_medico(medico_id)
+                for medico_id in self.matriz.medicos_da_especialidade(especialidade_id)}
+
+    def etag(self, especialidade_id, medico_id=None, sessao=None):
+        """
+        ETag dos horários de uma especialidade
+
+        Vem de medicos.versao_agenda, incrementada pelo banco a cada gravação na
+        agenda do médico: uma consulta só, igual em todos os workers. Médicos cuja
+        versão difere da carregada neste processo são recarregados na matriz antes
+        da resposta. Entram também o dia (a janela de busca anda à meia-noite) e as
+        reservas de outras sessões; o corte de antecedência não entra, e uma
+        resposta 304 pode listar um horário que acabou de ficar a menos de
+        politica.antecedencia de agora.
+        """
+        versoes = self.fonte.versoes_agenda(especialidade_id)
+        self.matriz.sincronizar(versoes, especialidade_id)
+        if medico_id is not None:
+            versoes = {m: v for m, v in versoes.items() if m == medico_id}
+        etag = f"{zlib.crc32(repr(sorted(versoes.items())).encode()):08x}.{date.today():%Y%m%d}"
+        retidos = self.reservas.retidos(excluir_sessao=sessao)
+        if retidos:
+            etag += f".{zlib.crc32(repr(sorted(retidos)).encode()):08x}"
+        return etag
+
+    def buscar_intervalo(self, especialidade_id, local_id=None, medico_id=None,
+                         data_inicio=None, data_fim=None, cursor=None, limite=20,
+                         sessao=None):
+        """
+        Lista horários livres em um intervalo de datas, com paginação por cursor
+
+        Args:
+            especialidade_id (int): Especialidade desejada
+            local_id (int): Local de atendimento (None = todos os locais)
+            medico_id (int): Restringe a um médico da especialidade
+            data_inicio (date): Primeira data (padrão: hoje)
+            data_fim (date): Última data (padrão: horizonte da matriz; limitada a
+                politica.dias_maximo)
+            cursor (str): Cursor retornado pela página anterior
+            limite (int): Tamanho da página
+            sessao (str): Sessão cuja própria reserva continua visível
+
+        Returns:
+            tuple: (horários formatados, cursor da próxima página ou None)
+        """
+        medico_ids = self.matriz.medicos_da_especialidade(especialidade_id)
+        if medico_id is not None:
+            medico_ids = [m for m in medico_ids if m == medico_id]
+        if not medico_ids:
+            return [], None
+
+        agora = datetime.now()
+        a_partir = agora + self.politica.antecedencia
+        if data_inicio is not None:
+            # a_partir exclui o próprio minuto: recuar um minuto inclui 00:00 de data_inicio
+            a_partir = max(a_partir, datetime.combine(data_inicio, time.min) - timedelta(minutes=1))
+        ultimo = None
+        if cursor:
+            ultimo = decodificar_cursor(cursor)
+            inicio_cursor = datetime.combine(ultimo[0], time(ultimo[1] // 60, ultimo[1] % 60))
+            a_partir = max(a_partir, inicio_cursor - timedelta(minutes=1))
+
+        dias = None
+        if data_fim is not None:
+            dias = min((data_fim - agora.date()).days, self.politica.dias_maximo)
+            if dias < 0:
+                return [], None
+
+        # Slots no mesmo minuto do cursor podem repetir: buscar folga de um por médico,
+        # além de um por slot reservado por outra sessão
+        retidos = self.reservas.retidos(excluir_sessao=sessao)
+        busca = limite + len(medico_ids) + len(retidos) + 1
+        slots = self.matriz.horarios_livres(
+            medico_ids, local_id=local_id, a_partir=a_partir, dias=dias, limite=busca)
+        if len(slots) < busca and dias is not None and dias > self.matriz.dias:
+            # data_fim além do horizonte da matriz: o restante em uma consulta em lote
+            inicio_alem = max(agora.date() + timedelta(days=self.matriz.dias + 1),
+                              a_partir.date())
+            slots += self._horarios_livres_alem(
+                medico_ids, inicio_alem, agora.date() + timedelta(days=dias),
+                local_id=local_id, a_partir=a_partir, limite=busca - len(slots))
+        if ultimo is not None:
+            slots = [slot for slot in slots if slot[:3] > ultimo]
+        if retidos:
+            slots = [slot for slot in slots
+                     if (slot[2], slot[0].isoformat(), slot[1]) not in retidos]
+
+        pagina = slots[:limite]
+        proximo_cursor = codificar_cursor(pagina[-1]) if len(slots) > limite else None
+        return [self._formatar_slot(*slot, agora) for slot in pagina], proximo_cursor
+
+    def situacao_slot(self, medico_id, data_slot, hora, sessao=None):
+        """
+        Situação de um slot: 'livre', 'agendado', 'recorrente' ou 'reservado'
+
+        Dentro do horizonte a matriz é a resposta: antes de consultá-la, a
+        versão de agenda do médico é lida no banco (uma leitura pela chave
+        primária) e, se outro worker alterou a agenda desde a última carga,
+        o médico é recarregado. Fora do horizonte consulta o adaptador para
+        agendamentos e o índice de séries para recorrências. Um slot livre
+        mas reservado por outra sessão que não `sessao` fica 'reservado'.
+        """
+        self.matriz.sincronizar_medico(medico_id, self.fonte.versao_agenda(medico_id))
+        situacao = self.matriz.situacao_slot(medico_id, data_slot, hora)
+        if situacao is None:
+            inicio, fim = self.intervalo_slot(medico_id, data_slot, hora)
+            if self.fonte.conflito_agendamento(medico_id, data_slot, inicio, fim):
+                situacao = 'agendado'
+            elif self.matriz.bloqueado_por_recorrente(medico_id, data_slot, inicio, fim):
+                situacao = 'recorrente'
+            else:
+                situacao = 'livre'
+        if situacao == 'livre' and (medico_id, data_slot.isoformat(), minutos(hora)) in \
+                self.reservas.retidos(excluir_sessao=sessao):
+            return 'reservado'
+        return situacao
+
+    def reservar_horario(self, horario, sessao):
+        """
+        Reserva (ou renova) para a sessão o horário escolhido no chat
+
+        Args:
+            horario (dict): Horário no formato de `_formatar_slot`
+            sessao (str): session_id da conversa
+
+        Returns:
+            bool: False se o horário está reservado por outra sessão
+        """
+        return self.reservas.reservar(horario['medico_id'], _data(horario['data']),
+                                      minutos(horario['hora']), sessao)
+
+    def liberar_reserva(self, sessao):
+        """Libera o horário reservado pela sessão, se houver"""
+        self.reservas.liberar(sessao)
+
+    def intervalo_slot(self, medico_id, data_slot, hora):
+        """
+        Intervalo [inicio, fim) em minutos do slot que começa em `hora`
+
+        A duração vem da grade atual do médico; horários fora da grade valem
+        DURACAO_PADRAO minutos.
+        """
+        inicio = minutos(hora)
+        fim = self.matriz.fim_slot(medico_id, data_slot, inicio)
+        return inicio, fim if fim is not None else inicio + DURACAO_PADRAO
+
+    def hora_fim_slot(self, medico_id, data_slot, hora):
+        """Término ('HH:MM') de uma consulta marcada no slot que começa em `hora`"""
+        return _hora_texto(self.intervalo_slot(medico_id, data_slot, hora)[1])
+
+    def conflito_turno(self, medico_id, dia_semana, hora_inicio, hora_fim, horario_id=None):
+        """
+        Procura turnos do médico, em qualquer local, que se sobreponham ao informado
+
+        Todos os turnos da semana são postos em uma linha do tempo única
+        (dia_semana * 1440 + minuto) e varridos em ordem, de modo que a validação
+        custa O(n log n) no número de turnos do médico.
+
+        Args:
+            horario_id (int): Turno sendo editado (ignorado na comparação)
+
+        Returns:
+            dict: Turno conflitante (local, dia_semana, hora_inicio, hora_fim) ou None
+        """
+        turnos = {
+            turno[0]: turno for turno in self.fonte.carregar_turnos(medico_id)
+            if turno[0] != horario_id
+        }
+        base = dia_semana * 1440
+        linha_tempo = [(dia * 1440 + inicio, dia * 1440 + fim, id_turno)
+                       for id_turno, _, dia, inicio, fim in turnos.values()]
+        linha_tempo.append((base + minutos(hora_inicio), base + minutos(hora_fim), None))
+
+        for anterior, seguinte in sobreposicoes(linha_tempo):
+            if anterior is None or seguinte is None:
+                _, local_id, dia, inicio, fim = turnos[seguinte if anterior is None else anterior]
+                return {
+                    'local_id': local_id,
+                    'local': self.fonte.carregar_locais().get(local_id, 'N/A'),
+                    'dia_semana': DIAS_SEMANA[dia],
+                    'hora_inicio': f"{inicio // 60:02d}:{inicio % 60:02d}",
+                    'hora_fim': f"{fim // 60:02d}:{fim % 60:02d}"
+                }
+        return None
+
+    def verificar_slots(self, slots, sessao=None):
+        """
+        Verifica vários slots de uma vez
+
+        Slots dentro do horizonte são respondidos pela matriz; os demais são
+        conferidos com uma única consulta em lote ao banco e pelo índice de séries
+        recorrentes. Como a matriz pode estar até `ttl` segundos atrás de outros
+        workers, o lote serve para revalidar opções exibidas; para um slot
+        específico use situacao_slot, que sincroniza o médico com o banco.
+
+        Args:
+            slots (list): Tuplas (medico_id, data, hora) com hora como time
+
+        Returns:
+            list: Situação de cada slot ('livre', 'agendado', 'recorrente' ou
+            'reservado'), na ordem recebida
+        """
+        situacoes = [self.matriz.situacao_slot(medico_id, data_slot, hora)
+                     for medico_id, data_slot, hora in slots]
+        intervalos = {
+            i: self.intervalo_slot(*slot) for i, slot in enumerate(slots)
+            if situacoes[i] is None
+        }
+        pendentes = [(slots[i][0], slots[i][1]) + intervalo
+                     for i, intervalo in intervalos.items()]
+        if pendentes:
+            ocupados = self.fonte.agendamentos_existentes(pendentes)
+            for i, (inicio, fim) in intervalos.items():
+                medico_id, data_slot = slots[i][:2]
+                if (medico_id, data_slot, inicio) in ocupados:
+                    situacoes[i] = 'agendado'
+                elif self.matriz.bloqueado_por_recorrente(medico_id, data_slot, inicio, fim):
+                    situacoes[i] = 'recorrente'
+                else:
+                    situacoes[i] = 'livre'
+
+        retidos = self.reservas.retidos(excluir_sessao=sessao)
+        if retidos:
+            for i, (medico_id, data_slot, hora) in enumerate(slots):
+                if situacoes[i] == 'livre' and \
+                        (medico_id, data_slot.isoformat(), minutos(hora)) in retidos:
+                    situacoes[i] = 'reservado'
+        return situacoes
+
+    def _formatar_slot(self, data_slot, minuto, medico_id, local_id, agora):
+        """Monta o dicionário de horário no formato usado pelo chatbot"""
+        inicio = datetime.combine(data_slot, time(minuto // 60, minuto % 60))
+        dia_semana = DIAS_SEMANA[inicio.weekday()]
+        return {
+            'medico_id': medico_id,
+            'medico': self.matriz.nome_medico(medico_id),
+            'medico_nome': self.matriz.nome_medico(medico_id),
+            'local_id': local_id,
+            'local': self.matriz.nome_local(local_id),
+            'data': inicio.strftime('%Y-%m-%d'),
+            'data_formatada': inicio.strftime('%d/%m/%Y') + f' ({dia_semana})',
+            'hora': inicio.strftime('%H:%M'),
+            'hora_formatada': inicio.strftime('%H:%M'),
+            'hora_fim': _hora_texto(self.matriz.fim_slot(medico_id, data_slot, minuto)
+                                    or minuto + DURACAO_PADRAO),
+            'dia_semana': dia_semana,
+            'disponivel_desde': agora.strftime('%H:%M')  # Timestamp de quando ficou disponível
+        }
@@ -0,0 +1,162 @@
+import json
+import re
+from datetime import date
+
+from classificador_intencoes import CATEGORIAS
+from preferencias import (DIAS_SEMANA, PERIODOS, descrever_preferencias, extrair_preferencias,
+                          normalizar)
+
+# Extração estruturada: uma única chamada ao Gemini devolve, em JSON, todos os
+# campos que a mensagem do paciente traz (intenção, local, especialidade, opção
+# de horário, preferências de data/hora e CPF). Aqui o JSON é validado contra as
+# opções reais; o que não bate com elas vira None e o fluxo pergunta normalmente.
+
+# Palavras que não acrescentam campos além da intenção de agendar: mensagens só
+# com elas ("oi, quero marcar uma consulta") não justificam a extração
+_PALAVRAS_VAZIAS = {
+    'oi', 'ola', 'tudo', 'bem', 'como', 'vai',
+    'eu', 'me', 'quero', 'queria', 'gostaria', 'preciso', 'de', 'do', 'da', 'uma', 'um',
+    'marcar', 'agendar', 'consulta', 'consultas', 'horario', 'atendimento', 'por', 'favor',
+    'para', 'pra', 'com', 'e', 'o', 'a', 'obrigado', 'obrigada', 'opa', 'hello', 'hi'
+}
+
+CAMPOS_CONVERSA = ('local_id', 'local_nome', 'especialidade_id', 'especialidade_nome')
+
+_CUMPRIMENTO = re.compile(r'\b(?:bom dia|boa tarde|boa noite)\b')
+_JSON = re.compile(r'\{.*\}', re.S)
+_HORA = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+
+def tem_conteudo(mensagem):
+    """True se a mensagem traz algo além de saudação e intenção de agendar"""
+    texto = _CUMPRIMENTO.sub(' ', normalizar(mensagem))
+    return any(palavra not in _PALAVRAS_VAZIAS for palavra in re.findall(r'[a-z0-9]+', texto))
+
+
+def preferencias_locais(mensagem, hoje=None):
+    """
+    Preferências que o analisador local entende na mensagem, sem os cumprimentos
+
+    "boa tarde" e "boa noite" não são pedidos de período: sem removê-los, o
+    cumprimento viraria uma janela de 12h-18h ou 18h-24h.
+    """
+    return extrair_preferencias(_CUMPRIMENTO.sub(' ', normalizar(mensagem)), hoje=hoje)
+
+
+def _minutos(valor):
+    encontrado = _HORA.match(str(valor or '').strip())
+    if not encontrado:
+        return None
+    hora, minuto = int(encontrado.group(1)), int(encontrado.group(2))
+    return hora * 60 + minuto if hora < 24 and minuto < 60 else None
+
+
+def _preferencias(bruto, hoje):
+    preferencias = {}
+    dias = bruto.get('dias_semana') or []
+    if isinstance(dias, str):
+        dias = [dias]
+    dias = sorted({DIAS_SEMANA[chave] for chave in
+                   (normalizar(str(dia)).split('-')[0].strip() for dia in dias)
+                   if chave in DIAS_SEMANA})
+    if dias:
+        preferencias['dias_semana'] = dias
+
+    periodo = PERIODOS.get(normalizar(str(bruto.get('periodo') or '')))
+    if periodo:
+        preferencias['hora_min'], preferencias['hora_max'] = periodo
+    for campo in ('hora_min', 'hora_max'):
+        minutos = _minutos(bruto.get(campo))
+        if minutos is not None:
+            preferencias[campo] = minutos
+
+    try:
+        data_pedida = date.fromisoformat(str(bruto.get('data') or ''))
+    except ValueError:
+        data_pedida = None
+    if data_pedida and data_pedida >= hoje:
+        preferencias['data_inicio'] = preferencias['data_fim'] = data_pedida.isoformat()
+    return preferencias
+
+
+def interpretar(texto, locais, especialidades, opcoes=0, hoje=None):
+    """
+    Valida a resposta JSON da extração contra as opções reais
+
+    Args:
+        texto (str): response.text do Gemini
+        locais (list): Tuplas (id, nome, cidade) dos locais ativos
+        especialidades (list): Tuplas (id, nome) das especialidades ativas
+        opcoes (int): Quantidade de horários exibidos ao paciente
+        hoje (date): Data de referência (padrão: hoje)
+
+    Returns:
+        dict: saudacao, intencao, local_id/local_nome, especialidade_id/especialidade_nome,
+        opcao (índice na lista exibida), cpf e preferencias; None onde a mensagem
+        não informa ou o valor não é válido
+
+    Raises:
+        ValueError: Resposta sem um objeto JSON
+    """
+    encontrado = _JSON.search(texto or '')
+    if not encontrado:
+        raise ValueError(f"Resposta sem JSON: {texto!r}")
+    bruto = json.loads(encontrado.group(0))
+    if not isinstance(bruto, dict):
+        raise ValueError(f"Resposta sem JSON: {texto!r}")
+
+    campos = {'saudacao': bruto.get('saudacao') is True, 'intencao': None,
+              'local_id': None, 'local_nome': None, 'especialidade_id': None,
+              'especialidade_nome': None, 'opcao': None, 'cpf': None}
+    intencao = normalizar(str(bruto.get('intencao') or ''))
+    if intencao in CATEGORIAS:
+        campos['intencao'] = intencao
+
+    local = normalizar(str(bruto.get('local') or ''))
+    for local_id, nome, cidade in locais:
+        if local and local in (normalizar(nome), normalizar(cidade or '')):
+            campos['local_id'], campos['local_nome'] = local_id, nome
+            break
+
+    especialidade = normalizar(str(bruto.get('especialidade') or ''))
+    for especialidade_id, nome in especialidades:
+        if especialidade and especialidade == normalizar(nome):
+            campos['especialidade_id'], campos['especialidade_nome'] = especialidade_id, nome
+            break
+
+    opcao = bruto.get('opcao')
+    if isinstance(opcao, (int, str)) and str(opcao).strip().isdigit():
+        if 1 <= int(opcao) <= opcoes:
+            campos['opcao'] = int(opcao) - 1
+
+    cpf = re.sub(r'\D', '', str(bruto.get('cpf') or ''))
+    if len(cpf) == 11:
+        campos['cpf'] = cpf
+
+    campos['preferencias'] = _preferencias(bruto, hoje or date.today())
+    return campos
+
+
+def combinar(anteriores, novos):
+    """
+    Campos já extraídos na conversa atualizados com os da nova mensagem
+
+    Só local, especialidade e preferências passam de um turno para o outro;
+    intenção, opção e CPF valem apenas para a mensagem em que apareceram.
+    """
+    resultado = dict(anteriores or {})
+    for campo in CAMPOS_CONVERSA:
+        if novos.get(campo) is not None:
+            resultado[campo] = novos[campo]
+    preferencias = {**resultado.get('preferencias', {}), **novos.get('preferencias', {})}
+    if preferencias:
+        resultado['preferencias'] = preferencias
+    return resultado
+
+
+def resumir(campos):
+    """Texto curto do que já foi entendido: 'Cardiologia, em Belo Horizonte, sexta, pela manhã'"""
+    partes = [campos.get('especialidade_nome'),
+              f"em {campos['local_nome']}" if campos.get('local_nome') else None,
+              descrever_preferencias(campos.get('preferencias') or {})]
+    return ', '.join(parte for parte in partes if parte)
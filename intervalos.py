@@ -0,0 +1,134 @@
+import heapq
+
+# Álgebra de intervalos de horário em minutos inteiros.
+# Intervalos são pares semiabertos [inicio, fim) em minutos desde 00:00; as listas
+# retornadas são ordenadas e sem sobreposição.
+
+
+def unir(intervalos):
+    """Une intervalos sobrepostos ou adjacentes"""
+    resultado = []
+    for inicio, fim in sorted(intervalos):
+        if fim <= inicio:
+            continue
+        if resultado and inicio <= resultado[-1][1]:
+            if fim > resultado[-1][1]:
+                resultado[-1] = (resultado[-1][0], fim)
+        else:
+            resultado.append((inicio, fim))
+    return resultado
+
+
+def subtrair(intervalos, remover):
+    """Remove de `intervalos` tudo o que estiver coberto por `remover`"""
+    remover = unir(remover)
+    resultado = []
+    for inicio, fim in unir(intervalos):
+        for r_inicio, r_fim in remover:
+            if r_fim <= inicio:
+                continue
+            if r_inicio >= fim:
+                break
+            if r_inicio > inicio:
+                resultado.append((inicio, r_inicio))
+            inicio = max(inicio, r_fim)
+            if inicio >= fim:
+                break
+        if inicio < fim:
+            resultado.append((inicio, fim))
+    return resultado
+
+
+def intersectar(a, b):
+    """Interseção de duas listas de intervalos"""
+    a, b = unir(a), unir(b)
+    resultado = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        inicio = max(a[i][0], b[j][0])
+        fim = min(a[i][1], b[j][1])
+        if inicio < fim:
+            resultado.append((inicio, fim))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return resultado
+
+
+def sobreposicoes(intervalos):
+    """
+    Pares de intervalos rotulados que se sobrepõem, por varredura ordenada
+
+    Ordena pelos inícios e mantém um heap dos intervalos ainda abertos (pelo fim):
+    O(n log n + k) para k sobreposições. Intervalos apenas adjacentes não conflitam.
+
+    Args:
+        intervalos (list): Tuplas (inicio, fim, rotulo)
+
+    Returns:
+        list: Pares (rotulo_anterior, rotulo_seguinte)
+    """
+    pares = []
+    abertos = []
+    for ordem, (inicio, fim, rotulo) in enumerate(sorted(intervalos, key=lambda i: (i[0], i[1]))):
+        while abertos and abertos[0][0] <= inicio:
+            heapq.heappop(abertos)
+        pares.extend((aberto, rotulo) for _, _, aberto in abertos)
+        heapq.heappush(abertos, (fim, ordem, rotulo))
+    return pares
+
+
+def dividir(inicio, fim, duracao):
+    """Inícios dos slots de `duracao` minutos que cabem inteiros em [inicio, fim)"""
+    if not duracao or duracao <= 0:
+        return range(0)
+    return range(inicio, fim - duracao + 1, duracao)
+
+
+def expandir_turnos(turnos):
+    """
+    Expande os turnos de um médico em um dia da semana em slots sem sobreposição
+
+    Cada turno contribui apenas com o trecho ainda não coberto pelos turnos
+    anteriores (ordem de cadastro), dividido pela sua própria duração de consulta.
+    Assim turnos separados (manhã e tarde) somam slots e turnos sobrepostos com
+    durações diferentes nunca geram consultas simultâneas.
+
+    Args:
+        turnos (list): Tuplas (inicio, fim, duracao, local_id) em ordem de cadastro
+
+    Returns:
+        list: Tuplas (minuto_inicio, local_id, duracao) ordenadas pelo horário
+    """
+    slots = []
+    cobertos = []
+    for inicio, fim, duracao, local_id in turnos:
+        if not duracao or duracao <= 0 or fim <= inicio:
+            continue
+        livres = subtrair([(inicio, fim)], cobertos) if cobertos else [(inicio, fim)]
+        for trecho_inicio, trecho_fim in livres:
+            slots.extend((minuto, local_id, duracao)
+                         for minuto in dividir(trecho_inicio, trecho_fim, duracao))
+        cobertos = unir(cobertos + [(inicio, fim)])
+    slots.sort()
+    return slots
+
+
+def agrupar_turnos(configuracoes):
+    """
+    Agrupa configurações de horário por médico e dia da semana
+
+    Args:
+        configuracoes (list): Tuplas (medico_id, local_id, dia_semana, inicio, fim, duracao)
+
+    Returns:
+        dict: medico_id -> lista de 7 listas de turnos (inicio, fim, duracao, local_id)
+    """
+    turnos = {}
+    for medico_id, local_id, dia_semana, inicio, fim, duracao in configuracoes:
+        semana = turnos.get(medico_id)
+        if semana is None:
+            semana = turnos[medico_id] = [[] for _ in range(7)]
+        semana[dia_semana].append((inicio, fim, duracao, local_id))
+    return turnos
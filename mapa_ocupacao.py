@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from datetime import date, timedelta
+
+logger = logging.getLogger('SistemaAgendamento')
+
+SEMANAS_MINIMO = 4
+SEMANAS_MAXIMO = 8
+
+
+class MapaOcupacao:
+    """
+    Mapa de calor da ocupação por médico, local e dia para o painel administrativo
+
+    As contagens cobrem sempre SEMANAS_MAXIMO semanas a partir de hoje e ficam
+    guardadas por médico. Cada alteração incremental da matriz de ocupação
+    (agendamento, cancelamento, série recorrente, edição de horários) marca só o
+    médico afetado, recalculado no próximo acesso. As recargas periódicas da matriz
+    só avisam os médicos que mudaram; a virada do dia refaz o mapa inteiro.
+    """
+
+    def __init__(self, matriz):
+        self.matriz = matriz
+        # _lock protege só _pendentes/_invalido e nunca é mantido enquanto a matriz é
+        # consultada: o callback roda com o lock da matriz, e a ordem inversa travaria
+        self._lock = threading.Lock()
+        self._lock_calculo = threading.Lock()
+        self._inicio = None
+        self._contagens = {}  # medico_id -> {(local_id, data): (ocupados, capacidade)}
+        self._pendentes = set()
+        self._invalido = True
+        self.recalculos = 0
+        matriz.ao_alterar(self._marcar_alterado)
+
+    def _marcar_alterado(self, medico_id):
+        with self._lock:
+            if medico_id is None:
+                self._invalido = True
+            else:
+                self._pendentes.add(medico_id)
+
+    def _calcular(self, medico_ids, hoje):
+        inicio_calculo = time.perf_counter()
+        contagens = {}
+        for (medico_id, local_id, data_dia), contagem in self.matriz.ocupacao_diaria(
+                medico_ids, hoje + timedelta(days=SEMANAS_MAXIMO * 7 - 1)).items():
+            contagens.setdefault(medico_id, {})[(local_id, data_dia)] = contagem
+        self.recalculos += 1
+        logger.info(
+            f"Mapa de ocupação recalculado: {len(contagens)} médicos "
+            f"em {(time.perf_counter() - inicio_calculo) * 1000:.1f}ms"
+        )
+        return contagens
+
+    def obter(self, semanas=SEMANAS_MINIMO):
+        """
+        Ocupação percentual por médico/local/dia nas próximas `semanas` (4 a 8)
+
+        Returns:
+            dict: 'datas' (ISO), 'linhas' com médico, local, 'percentuais' por data
+            (None onde não há atendimento) e totais do período
+        """
+        semanas = max(SEMANAS_MINIMO, min(SEMANAS_MAXIMO, semanas))
+        # Acessar a versão recarrega a matriz vencida (que então invalida o mapa)
+        versao = self.matriz.versao
+        with self._lock_calculo:
+            hoje = date.today()
+            with self._lock:
+                completo = self._invalido or self._inicio != hoje
+                pendentes, self._pendentes = self._pendentes, set()
+                self._invalido = False
+            if completo:
+                self._contagens = self._calcular(None, hoje)
+                self._inicio = hoje
+            elif pendentes:
+                contagens = {medico_id: por_local for medico_id, por_local in self._contagens.items()
+                             if medico_id not in pendentes}
+                contagens.update(self._calcular(list(pendentes), hoje))
+                self._contagens = contagens
+            contagens = self._contagens
+
+        datas = [hoje + timedelta(days=i) for i in range(semanas * 7)]
+        linhas = []
+        for medico_id, por_local in contagens.items():
+            for local_id in sorted({local_id for local_id, _ in por_local}):
+                percentuais = []
+                ocupados = capacidade = 0
+                for data_dia in datas:
+                    ocupados_dia, capacidade_dia = por_local.get((local_id, data_dia), (0, 0))
+                    ocupados += ocupados_dia
+                    capacidade += capacidade_dia
+                    percentuais.append(round(100 * ocupados_dia / capacidade_dia)
+                                       if capacidade_dia else None)
+                if not capacidade:
+                    continue
+                linhas.append({
+                    'medico_id': medico_id,
+                    'medico': self.matriz.nome_medico(medico_id),
+                    'local_id': local_id,
+                    'local': self.matriz.nome_local(local_id),
+                    'percentuais': percentuais,
+                    'ocupados': ocupados,
+                    'capacidade': capacidade,
+                    'percentual': round(100 * ocupados / capacidade)
+                })
+        linhas.sort(key=lambda linha: (linha['medico'], linha['local']))
+        return {
+            'datas': [data_dia.isoformat() for data_dia in datas],
+            'linhas': linhas,
+            'versao': versao
+        }
@@ -1,7 +1,10 @@
 from app import db
 from datetime import datetime, date, time
+import itertools
 import json
 
+from sqlalchemy import event, inspect
+
 class Paciente(db.Model):
     """Modelo para pacientes da clínica"""
     __tablename__ = 'pacientes'
@@ -95,6 +98,8 @@ class Medico(db.Model):
     especialidade_id = db.Column(db.Integer, db.ForeignKey('especialidades.id'), nullable=False)
     ativo = db.Column(db.Boolean, default=True)
     agenda_recorrente = db.Column(db.Boolean, default=False)  # Checkbox para agenda fixa semanal
+    # Incrementada a cada gravação na agenda do médico (ver _incrementar_versao_agenda)
+    versao_agenda = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relacionamentos
     agendamentos = db.relationship('Agendamento', backref='medico_rel', lazy=True)
@@ -150,6 +155,8 @@ class HorarioDisponivel(db.Model):
 class Agendamento(db.Model):
     """Modelo para agendamentos médicos"""
     __tablename__ = 'agendamentos'
+    # Conflitos por sobreposição: (médico, data) + faixa de hora, com hora_fim no índice
+    __table_args__ = (db.Index('idx_agendamentos_intervalo', 'medico_id', 'data', 'hora', 'hora_fim'),)
     
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=False)
@@ -158,6 +165,7 @@ class Agendamento(db.Model):
     local_id = db.Column(db.Integer, db.ForeignKey('locais.id'), nullable=False)
     data = db.Column(db.Date, nullable=False)
     hora = db.Column(db.Time, nullable=False)
+    hora_fim = db.Column(db.Time)  # Fim da consulta; None em agendamentos antigos
     observacoes = db.Column(db.Text)
     status = db.Column(db.String(20), default='agendado')  # agendado, cancelado, concluido
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
@@ -296,4 +304,30 @@ class AgendamentoRecorrente(db.Model):
             'data_fim': self.data_fim.strftime('%d/%m/%Y') if self.data_fim else 'Indefinido',
             'observacoes': self.observacoes,
             'ativo': self.ativo
-        }
\ No newline at end of file
+        }
+
+
+@event.listens_for(db.session, 'before_flush')
+def _incrementar_versao_agenda(session, flush_context, instances):
+    """
+    Incrementa medicos.versao_agenda dos médicos cuja agenda a gravação altera
+
+    Cobre agendamentos, séries recorrentes, horários e o cadastro do médico; as
+    ETags de disponibilidade comparam só essa versão. O UPDATE vai na mesma
+    transação da gravação e é atômico entre workers.
+    """
+    medico_ids = set()
+    for objeto in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(objeto, (Agendamento, AgendamentoRecorrente, HorarioDisponivel)):
+            medico_ids.add(objeto.medico_id)
+            # Agendamento movido para outro médico: a agenda antiga também muda
+            medico_ids.update(inspect(objeto).attrs.medico_id.history.deleted)
+        elif isinstance(objeto, Medico) and objeto in session.dirty \
+                and session.is_modified(objeto, include_collections=False):
+            medico_ids.add(objeto.id)
+    medico_ids.discard(None)
+    if medico_ids:
+        medicos = Medico.__table__
+        session.connection().execute(
+            medicos.update().where(medicos.c.id.in_(medico_ids))
+            .values(versao_agenda=medicos.c.versao_agenda + 1))
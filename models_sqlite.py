@@ -284,6 +284,7 @@ class Agendamento(BaseModel):
         self.local_id = kwargs.get('local_id')
         self.data = kwargs.get('data')
         self.hora = kwargs.get('hora')
+        self.hora_fim = kwargs.get('hora_fim')  # Fim da consulta; None em agendamentos antigos
         self.observacoes = kwargs.get('observacoes', '')
         self.status = kwargs.get('status', 'agendado')
         self.criado_em = kwargs.get('criado_em')
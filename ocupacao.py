@@ -0,0 +1,732 @@
+import bisect
+import heapq
+import itertools
+import logging
+import threading
+import time as _time
+import uuid
+from datetime import date, timedelta
+
+from intervalos import agrupar_turnos, expandir_turnos
+from recorrencias import IndiceRecorrencias
+
+logger = logging.getLogger('SistemaAgendamento')
+
+
+def minutos(hora):
+    """Converte um time ou string 'HH:MM[:SS]' em minutos desde 00:00"""
+    if isinstance(hora, str):
+        partes = hora.split(':')
+        return int(partes[0]) * 60 + int(partes[1])
+    return hora.hour * 60 + hora.minute
+
+
+class ModeloSemanal:
+    """
+    Grade de slots de um médico em um dia da semana: o bit i corresponde ao
+    slot [inicios[i], fins[i])
+    """
+    __slots__ = ('inicios', 'fins', 'locais', 'indice', 'capacidade', 'mascaras_local')
+
+    def __init__(self, slots):
+        # slots: (minuto_inicio, local_id, duracao) já sem sobreposição (intervalos.expandir_turnos)
+        self.inicios = []
+        self.fins = []
+        self.locais = []
+        vistos = set()
+        for minuto, local_id, duracao in sorted(slots, key=lambda s: s[0]):
+            if minuto in vistos:
+                continue
+            vistos.add(minuto)
+            self.inicios.append(minuto)
+            self.fins.append(minuto + duracao)
+            self.locais.append(local_id)
+
+        self.indice = {minuto: i for i, minuto in enumerate(self.inicios)}
+        self.capacidade = (1 << len(self.inicios)) - 1
+        self.mascaras_local = {}
+        for i, local_id in enumerate(self.locais):
+            self.mascaras_local[local_id] = self.mascaras_local.get(local_id, 0) | (1 << i)
+
+    def mascara_janela(self, hora_min=None, hora_max=None):
+        """Máscara dos slots que começam em [hora_min, hora_max) (minutos)"""
+        lo = bisect.bisect_left(self.inicios, hora_min) if hora_min is not None else 0
+        hi = bisect.bisect_left(self.inicios, hora_max) if hora_max is not None else len(self.inicios)
+        if hi <= lo:
+            return 0
+        return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+    def faixa_sobreposta(self, inicio, fim):
+        """Índices [lo, hi) dos slots que sobrepõem [inicio, fim) (slots são disjuntos e ordenados)"""
+        return bisect.bisect_right(self.fins, inicio), bisect.bisect_left(self.inicios, fim)
+
+    def mascara_sobreposta(self, inicio, fim):
+        """Máscara dos slots que sobrepõem [inicio, fim)"""
+        lo, hi = self.faixa_sobreposta(inicio, fim)
+        if hi <= lo:
+            return 0
+        return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+    def contar_por_local(self, ocupado):
+        """
+        Slots ocupados e totais de cada local em uma linha de bits
+
+        Returns:
+            dict: local_id -> (ocupados, capacidade), por contagem de bits das máscaras
+        """
+        return {local_id: ((ocupado & mascara).bit_count(), mascara.bit_count())
+                for local_id, mascara in self.mascaras_local.items()}
+
+    def intervalo(self, minuto):
+        """Intervalo do slot que começa em `minuto`; fora da grade, só o próprio minuto"""
+        i = self.indice.get(minuto)
+        return (minuto, self.fins[i]) if i is not None else (minuto, minuto + 1)
+
+
+class ModelosCompilados:
+    """
+    Grades semanais compiladas, reaproveitadas entre reconstruções da matriz
+
+    Cada dia da semana de um médico é compilado uma única vez por conjunto de
+    turnos (o próprio conteúdo de `horarios_disponiveis` serve de versão): a
+    recarga periódica só recompila o que mudou desde a última, e médicos com a
+    mesma grade compartilham o mesmo ModeloSemanal. `descartar` é chamado quando
+    a administração altera os horários de um médico.
+    """
+
+    def __init__(self):
+        self._por_turnos = {}  # tupla de turnos -> ModeloSemanal | None
+        self._assinaturas = {}  # medico_id -> tupla de 7 tuplas de turnos
+        self.compilacoes = 0
+
+    def compilar(self, configuracoes, completo=True):
+        """
+        Retorna medico_id -> [ModeloSemanal | None] * 7
+
+        Args:
+            configuracoes (list): Tuplas (medico_id, local_id, dia_semana, inicio, fim, duracao)
+            completo (bool): As configurações cobrem todos os médicos; grades que
+                não aparecem mais são esquecidas
+        """
+        modelos = {}
+        usados = {}
+        for medico_id, semana in agrupar_turnos(configuracoes).items():
+            assinatura = tuple(tuple(turnos) for turnos in semana)
+            grade = []
+            for turnos in assinatura:
+                if turnos not in self._por_turnos:
+                    slots = expandir_turnos(turnos)
+                    self._por_turnos[turnos] = ModeloSemanal(slots) if slots else None
+                    self.compilacoes += 1
+                grade.append(self._por_turnos[turnos])
+                usados[turnos] = grade[-1]
+            self._assinaturas[medico_id] = assinatura
+            modelos[medico_id] = grade
+        if completo:
+            self._por_turnos = usados
+            self._assinaturas = {medico_id: self._assinaturas[medico_id] for medico_id in modelos}
+        return modelos
+
+    def descartar(self, medico_id=None):
+        """Esquece as grades de um médico (None = todas)"""
+        if medico_id is None:
+            self._por_turnos = {}
+            self._assinaturas = {}
+            return
+        assinatura = self._assinaturas.pop(medico_id, ())
+        compartilhadas = {turnos for outra in self._assinaturas.values() for turnos in outra}
+        for turnos in assinatura:
+            if turnos not in compartilhadas:
+                self._por_turnos.pop(turnos, None)
+
+
+class LinhaDia:
+    """Ocupação de um médico em uma data do horizonte"""
+    __slots__ = ('modelo', 'ocupado', 'agendados', 'recorrentes')
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+        self.ocupado = 0
+        # Contadores por intervalo (inicio, fim) de agendamento e por minuto de
+        # série recorrente; incluem horários fora da grade
+        self.agendados = {}
+        self.recorrentes = {}
+
+    def situacao(self, inicio, fim):
+        """'agendado', 'recorrente' ou None para o intervalo [inicio, fim)"""
+        if any(a_inicio < fim and a_fim > inicio for a_inicio, a_fim in self.agendados):
+            return 'agendado'
+        # Séries recorrentes não guardam duração: ocupam o slot que contém seu início
+        if any(inicio <= minuto < fim for minuto in self.recorrentes):
+            return 'recorrente'
+        return None
+
+
+class MatrizOcupacao:
+    """
+    Índice em memória da agenda de todos os médicos no horizonte móvel
+
+    Cada médico/dia é uma linha com um bit por slot de `duracao_consulta`, derivada de
+    `horarios_disponiveis`. Agendamentos e agendamentos recorrentes ligam bits; as
+    consultas de disponibilidade são operações de bits sobre essas linhas, sem SQL.
+    As séries recorrentes ficam também em um índice de intervalos, que responde
+    bloqueios para datas além do horizonte.
+
+    A matriz é reconstruída quando o dia muda ou após `ttl` segundos (para refletir
+    alterações feitas por outros workers) e atualizada incrementalmente pelos
+    métodos registrar_*/liberar_*/recarregar_medico.
+    """
+
+    def __init__(self, fonte, dias=30, ttl=60):
+        self.fonte = fonte
+        self.dias = dias
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._inicio = None
+        self._carregado_em = None
+        self._geracao = None  # Identifica cada reconstrução (e o processo)
+        self._alteracoes = 0
+        self._versoes = {}  # medico_id -> versao_agenda do banco nos dados carregados
+        self._medicos = {}  # medico_id -> (nome, especialidade_id)
+        self._locais = {}  # local_id -> nome
+        self._modelos = {}  # medico_id -> [ModeloSemanal | None] * 7
+        self.compilados = ModelosCompilados()
+        self._linhas = {}  # medico_id -> [LinhaDia] * (dias + 1)
+        self.recorrencias = IndiceRecorrencias()
+        self._ouvintes = []  # callbacks(medico_id | None) chamados a cada alteração
+
+    # ------------------------------------------------------------------
+    # Construção
+    # ------------------------------------------------------------------
+
+    def ao_alterar(self, callback):
+        """Registra um callback chamado com o medico_id alterado (None = agenda inteira)"""
+        self._ouvintes.append(callback)
+
+    def _notificar(self, medico_id=None):
+        for callback in self._ouvintes:
+            callback(medico_id)
+
+    def invalidar(self):
+        """Força reconstrução completa no próximo acesso"""
+        with self._lock:
+            self._carregado_em = None
+            self._notificar()
+
+    def _garantir_atualizada(self):
+        if (self._carregado_em is None or self._inicio != date.today()
+                or _time.monotonic() - self._carregado_em > self.ttl):
+            self.reconstruir()
+
+    def reconstruir(self):
+        """
+        Recarrega toda a matriz a partir do banco
+
+        Os ouvintes recebem só os médicos cuja versão de agenda mudou desde a carga
+        anterior (nenhum, se nada mudou); a primeira carga, a virada do dia e
+        mudanças de especialidade ou de locais notificam a agenda inteira.
+        """
+        with self._lock:
+            anterior = None
+            if self._carregado_em is not None:
+                anterior = (self._inicio, self._medicos, self._locais, self._versoes)
+            inicio_carga = _time.perf_counter()
+            self._inicio = date.today()
+            fim = self._inicio + timedelta(days=self.dias)
+
+            # Lida antes dos dados: uma gravação no meio da carga deixa a versão
+            # guardada para trás, e a próxima sincronização recarrega o médico
+            versoes = self.fonte.versoes_agenda()
+            self._medicos = self.fonte.carregar_medicos()
+            self._locais = self.fonte.carregar_locais()
+            configuracoes = self.fonte.carregar_configuracoes()
+            self._modelos = self.compilados.compilar(configuracoes)
+            self._linhas = {}
+
+            agendamentos = self.fonte.carregar_agendamentos(None, self._inicio, fim)
+            for medico_id, data_ag, inicio, fim_ag in agendamentos:
+                self._marcar(medico_id, data_ag, inicio, fim_ag, 1)
+            recorrentes = self.fonte.carregar_recorrentes(None, date.min, date.max)
+            self.recorrencias.carregar(recorrentes)
+            for recorrente in recorrentes:
+                self._marcar_recorrente(*recorrente, delta=1)
+            self._versoes = versoes
+
+            self._geracao = uuid.uuid4().hex[:8]
+            self._alteracoes = 0
+            self._carregado_em = _time.monotonic()
+            alterados = self._alterados_desde(*anterior) if anterior else None
+            if alterados is None:
+                self._notificar()
+            else:
+                for medico_id in alterados:
+                    self._notificar(medico_id)
+            logger.info(
+                f"Matriz de ocupação reconstruída: {len(self._medicos)} médicos, "
+                f"{'todos' if alterados is None else len(alterados)} alterados, "
+                f"{self.dias + 1} dias em {(_time.perf_counter() - inicio_carga) * 1000:.1f}ms"
+            )
+
+    def _alterados_desde(self, inicio, medicos, locais, versoes):
+        """
+        Médicos cuja versão de agenda difere da carga anterior
+
+        Versão desconhecida (médico alterado incrementalmente) conta como
+        alteração. Returns None quando a mudança atinge a agenda inteira: outro
+        dia, locais diferentes ou médicos que entraram, saíram ou trocaram de
+        especialidade (buscas que não dependiam deles passam a depender).
+        """
+        especialidades = {medico_id: esp_id for medico_id, (_, esp_id) in self._medicos.items()}
+        if (inicio != self._inicio or locais != self._locais
+                or especialidades != {medico_id: esp_id for medico_id, (_, esp_id) in medicos.items()}):
+            return None
+        return {
+            medico_id for medico_id, dados in self._medicos.items()
+            if dados != medicos[medico_id] or versoes.get(medico_id) is None
+            or versoes[medico_id] != self._versoes.get(medico_id)
+        }
+
+    def recarregar_medico(self, medico_id):
+        """Reconstrói as linhas de um médico (após edição de horários ou do cadastro)"""
+        with self._lock:
+            if self._carregado_em is None or self._inicio != date.today():
+                self.reconstruir()
+                return
+            fim = self._inicio + timedelta(days=self.dias)
+
+            anterior = self._medicos.get(medico_id)
+            versao = self.fonte.versao_agenda(medico_id)
+            self._medicos = self.fonte.carregar_medicos()
+            self._locais = self.fonte.carregar_locais()
+            self.compilados.descartar(medico_id)
+            configuracoes = self.fonte.carregar_configuracoes([medico_id])
+            modelos = self.compilados.compilar(configuracoes, completo=False)
+            self._modelos.pop(medico_id, None)
+            self._modelos.update(modelos)
+            self._linhas.pop(medico_id, None)
+
+            agendamentos = self.fonte.carregar_agendamentos([medico_id], self._inicio, fim)
+            for _, data_ag, inicio, fim_ag in agendamentos:
+                self._marcar(medico_id, data_ag, inicio, fim_ag, 1)
+            self.recorrencias.remover_medico(medico_id)
+            recorrentes = self.fonte.carregar_recorrentes([medico_id], date.min, date.max)
+            for recorrente in recorrentes:
+                self.recorrencias.adicionar(*recorrente)
+                self._marcar_recorrente(*recorrente, delta=1)
+            self._versoes[medico_id] = versao
+            self._alteracoes += 1
+
+            # Mudança de especialidade/ativação altera buscas em que o médico não aparecia
+            atual = self._medicos.get(medico_id)
+            mesma_especialidade = anterior is not None and atual is not None and anterior[1] == atual[1]
+            self._notificar(medico_id if mesma_especialidade else None)
+
+    def _linhas_medico(self, medico_id):
+        linhas = self._linhas.get(medico_id)
+        if linhas is None:
+            modelos = self._modelos.get(medico_id, [None] * 7)
+            dia_semana = self._inicio.weekday()
+            linhas = [
+                LinhaDia(modelos[(dia_semana + i) % 7])
+                for i in range(self.dias + 1)
+            ]
+            self._linhas[medico_id] = linhas
+        return linhas
+
+    # ------------------------------------------------------------------
+    # Atualização incremental
+    # ------------------------------------------------------------------
+
+    def _marcar(self, medico_id, data_slot, inicio, fim, delta, recorrente=False):
+        """
+        Soma `delta` à ocupação de [inicio, fim) e recalcula os bits dos slots
+        que o intervalo sobrepõe (fim None = agendamento antigo sem hora_fim,
+        que ocupa só o minuto de início)
+        """
+        deslocamento = (data_slot - self._inicio).days
+        if not 0 <= deslocamento <= self.dias:
+            return
+        if fim is None or fim <= inicio:
+            fim = inicio + 1
+        linha = self._linhas_medico(medico_id)[deslocamento]
+        contadores, chave = (linha.recorrentes, inicio) if recorrente else (linha.agendados, (inicio, fim))
+        total = contadores.get(chave, 0) + delta
+        if total > 0:
+            contadores[chave] = total
+        else:
+            contadores.pop(chave, None)
+
+        modelo = linha.modelo
+        if modelo is None:
+            return
+        lo, hi = modelo.faixa_sobreposta(inicio, fim)
+        for i in range(lo, hi):
+            bit = 1 << i
+            if linha.situacao(modelo.inicios[i], modelo.fins[i]):
+                linha.ocupado |= bit
+            else:
+                linha.ocupado &= ~bit
+
+    def _marcar_recorrente(self, medico_id, dia_semana, minuto, data_inicio,
+                           data_fim, delta):
+        fim_horizonte = self._inicio + timedelta(days=self.dias)
+        inicio = max(data_inicio, self._inicio)
+        fim = min(data_fim, fim_horizonte) if data_fim else fim_horizonte
+        data_atual = inicio + timedelta(days=(dia_semana - inicio.weekday()) % 7)
+        while data_atual <= fim:
+            self._marcar(medico_id, data_atual, minuto, minuto + 1, delta, recorrente=True)
+            data_atual += timedelta(weeks=1)
+
+    def registrar_agendamento(self, medico_id, data_ag, hora, hora_fim=None):
+        """Marca como ocupados os slots que [hora, hora_fim) sobrepõe após um agendamento"""
+        with self._lock:
+            if self._carregado_em is not None:
+                self._marcar(medico_id, data_ag, minutos(hora),
+                             minutos(hora_fim) if hora_fim else None, 1)
+                self._alteracoes += 1
+                self._versoes.pop(medico_id, None)
+                self._notificar(medico_id)
+
+    def liberar_agendamento(self, medico_id, data_ag, hora, hora_fim=None):
+        """Libera os slots de um agendamento cancelado (mesmo intervalo do registro)"""
+        with self._lock:
+            if self._carregado_em is not None:
+                self._marcar(medico_id, data_ag, minutos(hora),
+                             minutos(hora_fim) if hora_fim else None, -1)
+                self._alteracoes += 1
+                self._versoes.pop(medico_id, None)
+                self._notificar(medico_id)
+
+    def registrar_recorrente(self, medico_id, dia_semana, hora, data_inicio, data_fim=None):
+        """Bloqueia as ocorrências de uma série recorrente dentro do horizonte"""
+        with self._lock:
+            if self._carregado_em is not None:
+                self.recorrencias.adicionar(medico_id, dia_semana, minutos(hora),
+                                            data_inicio, data_fim)
+                self._marcar_recorrente(medico_id, dia_semana, minutos(hora),
+                                        data_inicio, data_fim, delta=1)
+                self._alteracoes += 1
+                self._versoes.pop(medico_id, None)
+                self._notificar(medico_id)
+
+    def liberar_recorrente(self, medico_id, dia_semana, hora, data_inicio, data_fim=None):
+        """Libera as ocorrências de uma série recorrente desativada"""
+        with self._lock:
+            if self._carregado_em is not None:
+                self.recorrencias.remover(medico_id, dia_semana, minutos(hora),
+                                          data_inicio, data_fim)
+                self._marcar_recorrente(medico_id, dia_semana, minutos(hora),
+                                        data_inicio, data_fim, delta=-1)
+                self._alteracoes += 1
+                self._versoes.pop(medico_id, None)
+                self._notificar(medico_id)
+
+    def sincronizar(self, versoes, especialidade_id=None):
+        """
+        Recarrega os médicos cuja versão de agenda no banco difere da carregada
+
+        Pega alterações feitas por outro worker (ou por atualização incremental
+        neste, cuja versão fica desconhecida) sem esperar o ttl.
+
+        Args:
+            versoes (dict): medico_id -> versao_agenda (fonte.versoes_agenda)
+            especialidade_id (int): Especialidade a que `versoes` se restringe;
+                médicos dela ausentes em `versoes` foram desativados ou mudaram de
+                especialidade
+        """
+        with self._lock:
+            self._garantir_atualizada()
+            alterados = [medico_id for medico_id, versao in versoes.items()
+                         if self._versoes.get(medico_id) != versao]
+            alterados += [medico_id for medico_id, (_, esp_id) in self._medicos.items()
+                          if medico_id not in versoes
+                          and (especialidade_id is None or esp_id == especialidade_id)]
+            for medico_id in alterados:
+                logger.debug(f"Agenda do médico {medico_id} mudou no banco; recarregando")
+                self.recarregar_medico(medico_id)
+
+    def sincronizar_medico(self, medico_id, versao):
+        """
+        Recarrega um médico se `versao` (fonte.versao_agenda) difere da carregada
+
+        Args:
+            versao (int): versao_agenda atual no banco, ou None se o médico está
+                inativo ou não existe
+        """
+        with self._lock:
+            self._garantir_atualizada()
+            if self._versoes.get(medico_id) != versao or \
+                    (versao is None and medico_id in self._medicos):
+                logger.debug(f"Agenda do médico {medico_id} mudou no banco; recarregando")
+                self.recarregar_medico(medico_id)
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    @property
+    def versao(self):
+        """
+        Versão da agenda neste processo: muda a cada reconstrução ou alteração incremental
+
+        Não é comparável entre workers; para ETags use medicos.versao_agenda
+        (MotorDisponibilidade.etag).
+        """
+        with self._lock:
+            self._garantir_atualizada()
+            return f"{self._geracao}.{self._alteracoes}"
+
+    @property
+    def geracao(self):
+        """Identificador da reconstrução atual (muda a cada recarga completa)"""
+        with self._lock:
+            self._garantir_atualizada()
+            return self._geracao
+
+    @property
+    def ultimo_dia(self):
+        """Última data coberta pelo horizonte da matriz"""
+        with self._lock:
+            self._garantir_atualizada()
+            return self._inicio + timedelta(days=self.dias)
+
+    def situacao_slot(self, medico_id, data_slot, hora):
+        """
+        Situação de um slot: 'livre', 'agendado', 'recorrente' ou None quando a
+        matriz não cobre a data/médico (o chamador deve consultar o banco)
+        """
+        with self._lock:
+            self._garantir_atualizada()
+            deslocamento = (data_slot - self._inicio).days
+            if not 0 <= deslocamento <= self.dias:
+                return None
+            if medico_id not in self._medicos and medico_id not in self._linhas:
+                return None
+            linhas = self._linhas.get(medico_id)
+            if linhas is None:
+                return 'livre'
+            linha = linhas[deslocamento]
+            minuto = minutos(hora)
+            inicio, fim = linha.modelo.intervalo(minuto) if linha.modelo else (minuto, minuto + 1)
+            return linha.situacao(inicio, fim) or 'livre'
+
+    def fim_slot(self, medico_id, data_slot, minuto):
+        """Minuto de término do slot pela grade semanal do médico (None se fora da grade)"""
+        with self._lock:
+            self._garantir_atualizada()
+            modelo = self._modelos.get(medico_id, [None] * 7)[data_slot.weekday()]
+            if modelo is None or minuto not in modelo.indice:
+                return None
+            return modelo.fins[modelo.indice[minuto]]
+
+    def bloqueado_por_recorrente(self, medico_id, data_slot, inicio, fim):
+        """True se uma série recorrente ativa começa dentro de [inicio, fim) minutos (qualquer data)"""
+        with self._lock:
+            self._garantir_atualizada()
+            return self.recorrencias.bloqueia_intervalo(medico_id, data_slot, inicio, fim)
+
+    def esta_livre(self, medico_id, data_slot, hora):
+        """True/False para o slot, ou None quando fora da cobertura da matriz"""
+        situacao = self.situacao_slot(medico_id, data_slot, hora)
+        return None if situacao is None else situacao == 'livre'
+
+    def medicos_da_especialidade(self, especialidade_id):
+        """IDs dos médicos ativos de uma especialidade"""
+        with self._lock:
+            self._garantir_atualizada()
+            return [
+                medico_id for medico_id, (_, esp_id) in self._medicos.items()
+                if esp_id == especialidade_id
+            ]
+
+    def nome_medico(self, medico_id):
+        return self._medicos.get(medico_id, ('N/A', None))[0]
+
+    def nome_local(self, local_id):
+        return self._locais.get(local_id, 'N/A')
+
+    def horarios_livres(self, medico_ids, local_id=None, dias_semana=None,
+                        hora_min=None, hora_max=None, a_partir=None,
+                        dias=None, limite=None):
+        """
+        Lista os slots livres em ordem cronológica
+
+        Args:
+            medico_ids (list): Médicos considerados
+            local_id (int): Restringe aos slots deste local
+            dias_semana (set): Dias da semana aceitos (0=segunda)
+            hora_min/hora_max (int): Janela de horário em minutos [hora_min, hora_max)
+            a_partir (datetime): Ignora slots que começam até este instante
+            dias (int): Horizonte em dias (limitado ao horizonte da matriz)
+            limite (int): Quantidade máxima de slots retornados
+
+        Returns:
+            list: Tuplas (data, minuto, medico_id, local_id)
+        """
+        with self._lock:
+            self._garantir_atualizada()
+            horizonte = self.dias if dias is None else min(dias, self.dias)
+            fluxos = [
+                self._fluxo_medico(medico_id, local_id, dias_semana, hora_min,
+                                   hora_max, a_partir, horizonte)
+                for medico_id in medico_ids
+            ]
+            # Cada fluxo já é cronológico: o merge só avança o necessário para `limite`
+            return list(itertools.islice(heapq.merge(*fluxos), limite))
+
+    def _fluxo_medico(self, medico_id, local_id, dias_semana, hora_min, hora_max,
+                      a_partir, horizonte):
+        """Gera sob demanda os slots livres de um médico em ordem cronológica"""
+        linhas = self._linhas_medico(medico_id)
+        for deslocamento in range(horizonte + 1):
+            linha = linhas[deslocamento]
+            modelo = linha.modelo
+            if modelo is None:
+                continue
+            data_slot = self._inicio + timedelta(days=deslocamento)
+            if dias_semana is not None and data_slot.weekday() not in dias_semana:
+                continue
+
+            janela_min = hora_min
+            if a_partir is not None:
+                if data_slot < a_partir.date():
+                    continue
+                if data_slot == a_partir.date():
+                    corte = a_partir.hour * 60 + a_partir.minute + 1
+                    janela_min = corte if janela_min is None else max(janela_min, corte)
+
+            livres = modelo.capacidade & ~linha.ocupado
+            if local_id is not None:
+                livres &= modelo.mascaras_local.get(local_id, 0)
+            if janela_min is not None or hora_max is not None:
+                livres &= modelo.mascara_janela(janela_min, hora_max)
+            # Bits crescentes correspondem a horários crescentes
+            while livres:
+                bit = livres & -livres
+                i = bit.bit_length() - 1
+                yield (data_slot, modelo.inicios[i], medico_id, modelo.locais[i])
+                livres ^= bit
+
+    def horarios_livres_alem(self, medico_ids, data_inicio, data_fim, local_id=None,
+                             dias_semana=None, hora_min=None, hora_max=None,
+                             a_partir=None, limite=None):
+        """
+        Lista slots livres em datas além do horizonte da matriz, avaliados em lote
+
+        Os agendamentos do intervalo vêm de uma única consulta ao banco; grades
+        semanais e séries recorrentes já estão em memória. Os filtros são os de
+        horarios_livres.
+
+        Returns:
+            list: Tuplas (data, minuto, medico_id, local_id) em ordem cronológica
+        """
+        with self._lock:
+            self._garantir_atualizada()
+            semanas = {medico_id: self._modelos[medico_id]
+                       for medico_id in medico_ids if medico_id in self._modelos}
+        if not semanas or data_fim < data_inicio:
+            return []
+
+        ocupados = {}  # (medico_id, data) -> [(inicio, fim)]
+        for medico_id, data_ag, inicio, fim in self.fonte.carregar_agendamentos(
+                list(semanas), data_inicio, data_fim):
+            ocupados.setdefault((medico_id, data_ag), []).append((inicio, fim or inicio + 1))
+        with self._lock:
+            fluxos = [
+                self._fluxo_alem(medico_id, semana, ocupados, data_inicio, data_fim,
+                                 local_id, dias_semana, hora_min, hora_max, a_partir)
+                for medico_id, semana in semanas.items()
+            ]
+            return list(itertools.islice(heapq.merge(*fluxos), limite))
+
+    def _fluxo_alem(self, medico_id, semana, ocupados, data_inicio, data_fim,
+                    local_id, dias_semana, hora_min, hora_max, a_partir=None):
+        """Gera sob demanda os slots livres de um médico fora do horizonte da matriz"""
+        data_slot = data_inicio
+        if a_partir is not None:
+            data_slot = max(data_slot, a_partir.date())
+        while data_slot <= data_fim:
+            modelo = semana[data_slot.weekday()]
+            if modelo is not None and (dias_semana is None or data_slot.weekday() in dias_semana):
+                janela_min = hora_min
+                if a_partir is not None and data_slot == a_partir.date():
+                    corte = a_partir.hour * 60 + a_partir.minute + 1
+                    janela_min = corte if janela_min is None else max(janela_min, corte)
+                livres = modelo.capacidade
+                if local_id is not None:
+                    livres &= modelo.mascaras_local.get(local_id, 0)
+                if janela_min is not None or hora_max is not None:
+                    livres &= modelo.mascara_janela(janela_min, hora_max)
+                agendados = ocupados.get((medico_id, data_slot), ())
+                while livres:
+                    bit = livres & -livres
+                    i = bit.bit_length() - 1
+                    minuto, fim = modelo.inicios[i], modelo.fins[i]
+                    if (not any(a_inicio < fim and a_fim > minuto for a_inicio, a_fim in agendados)
+                            and not self.recorrencias.bloqueia_intervalo(medico_id, data_slot, minuto, fim)):
+                        yield (data_slot, minuto, medico_id, modelo.locais[i])
+                    livres ^= bit
+            data_slot += timedelta(days=1)
+
+    def ocupacao_diaria(self, medico_ids, data_fim):
+        """
+        Slots ocupados e totais por médico, local e dia, de hoje até `data_fim`
+
+        Dentro do horizonte a contagem sai direto das linhas de bits; além dele,
+        os agendamentos vêm de uma única consulta ao banco e as séries do índice de
+        recorrências, e cada dia vira uma linha de bits avulsa contada da mesma forma.
+
+        Args:
+            medico_ids (list): Médicos considerados (None = todos os ativos)
+            data_fim (date): Último dia contado
+
+        Returns:
+            dict: (medico_id, local_id, data) -> (ocupados, capacidade)
+        """
+        resultado = {}
+        with self._lock:
+            self._garantir_atualizada()
+            if medico_ids is None:
+                medico_ids = list(self._medicos)
+            ultimo = min(data_fim, self._inicio + timedelta(days=self.dias))
+            for medico_id in medico_ids:
+                if medico_id not in self._modelos:
+                    continue
+                linhas = self._linhas_medico(medico_id)
+                for deslocamento in range((ultimo - self._inicio).days + 1):
+                    linha = linhas[deslocamento]
+                    if linha.modelo is None:
+                        continue
+                    data_linha = self._inicio + timedelta(days=deslocamento)
+                    for local_id, contagem in linha.modelo.contar_por_local(linha.ocupado).items():
+                        resultado[(medico_id, local_id, data_linha)] = contagem
+            semanas = {medico_id: self._modelos[medico_id]
+                       for medico_id in medico_ids if medico_id in self._modelos}
+        data_inicio = ultimo + timedelta(days=1)
+        if not semanas or data_fim < data_inicio:
+            return resultado
+
+        ocupados = {}  # (medico_id, data) -> [(inicio, fim)]
+        for medico_id, data_ag, inicio, fim in self.fonte.carregar_agendamentos(
+                list(semanas), data_inicio, data_fim):
+            ocupados.setdefault((medico_id, data_ag), []).append((inicio, fim or inicio + 1))
+        with self._lock:
+            for medico_id, semana in semanas.items():
+                data_linha = data_inicio
+                while data_linha <= data_fim:
+                    modelo = semana[data_linha.weekday()]
+                    if modelo is not None:
+                        ocupado = 0
+                        for inicio, fim in ocupados.get((medico_id, data_linha), ()):
+                            ocupado |= modelo.mascara_sobreposta(inicio, fim)
+                        for minuto in self.recorrencias.minutos_ativos(medico_id, data_linha):
+                            ocupado |= modelo.mascara_sobreposta(minuto, minuto + 1)
+                        for local_id, contagem in modelo.contar_por_local(ocupado).items():
+                            resultado[(medico_id, local_id, data_linha)] = contagem
+                    data_linha += timedelta(days=1)
+        return resultado
+
+    def existe_livre(self, especialidade_id, **filtros):
+        """Responde se há algum slot livre para a especialidade com os filtros dados"""
+        medico_ids = self.medicos_da_especialidade(especialidade_id)
+        return bool(self.horarios_livres(medico_ids, limite=1, **filtros))
@@ -0,0 +1,328 @@
+import re
+import unicodedata
+from datetime import date, timedelta
+
+# Preferências de horário do paciente, guardadas nos dados da conversa (JSON):
+#   dias_semana: lista de dias aceitos (0=segunda)
+#   hora_min / hora_max: janela de início em minutos [hora_min, hora_max)
+#   medico_id: médico preferido
+#   data_inicio / data_fim: datas ISO (YYYY-MM-DD)
+
+PERIODOS = {
+    'manha': (0, 12 * 60),
+    'tarde': (12 * 60, 18 * 60),
+    'noite': (18 * 60, 24 * 60)
+}
+
+DIAS_SEMANA = {
+    'segunda': 0, 'terca': 1, 'quarta': 2, 'quinta': 3,
+    'sexta': 4, 'sabado': 5, 'domingo': 6
+}
+
+NOMES_DIAS = ['segunda', 'terça', 'quarta', 'quinta', 'sexta', 'sábado', 'domingo']
+
+# "segunda opção", "terça vez"... não são dias da semana
+_DIA_SEMANA = re.compile(
+    r'\b(segunda|terca|quarta|quinta|sexta|sabado|domingo)(?:[- ]feira)?\b(?!\s*(?:opcao|alternativa|vez))')
+# "depois das 14h", "antes das 10:30", "depois das 10", "antes das 2 da tarde": sem
+# "das"/"as" o número só é hora com o sufixo ("até 3 dias" não é horário)
+_LIMITE_HORA = (r'\s+(?:d?as\s+(?=\d)|(?=\d{1,2}\s*(?:h|:|horas?)))(\d{1,2})'
+                r'(?:\s*(?:h|:|horas?)\s*(\d{2})?)?(?![\d/])'
+                r'(?:\s*(?:horas?\s+)?da\s+(manha|tarde|noite)\b)?')
+_DEPOIS_DAS = re.compile(r'\b(?:depois|apos|a partir)' + _LIMITE_HORA)
+_ANTES_DAS = re.compile(r'\b(?:antes|ate)' + _LIMITE_HORA)
+_ENTRE = re.compile(r'\bentre\s+(?:as\s+)?(\d{1,2})\s*h?\s*e\s+(?:as\s+)?(\d{1,2})\s*h?')
+_A_PARTIR_DATA = re.compile(r'\b(?:a partir|depois|apos)\s+(?:de|do dia|da data|do)?\s*(\d{1,2})/(\d{1,2})')
+_DATA = re.compile(r'\b(\d{1,2})/(\d{1,2})\b')
+_HORA = re.compile(r'\b\d{1,2}\s*(?::\d{2}|h\b|h\d{2}|horas?\b)')
+_HORA_EXATA = re.compile(r'\b(\d{1,2})\s*(?::(\d{2})|h(\d{2})?\b|horas?\b)')
+# "2 da tarde", "10h30 da manhã", "8 horas da noite"
+_HORA_PERIODO = re.compile(
+    r'\b(\d{1,2})(?:(?::|h)(\d{2}))?\s*h?\s*(?:horas?\s+)?da\s+(manha|tarde|noite)\b')
+# "às 3", "3 horas": hora cheia sem "h" nem minutos, que pode ser da tarde
+_HORA_CHEIA = re.compile(r'(?:\bas\s+(\d{1,2})|\b(\d{1,2})\s*horas?)\b(?!\s*(?:[:/h]|da\s))')
+# "opção 3", "a 2", "o 1": número da opção só com essas palavras antes
+_OPCAO_NUMERO = re.compile(
+    r'\b(?:opcao|alternativa|numero|[oa])\s+(\d{1,2})\b'
+    r'(?!\s*(?:[:/h]|horas?\b|da\b|de\b|dias?\b|semanas?\b|mes(?:es)?\b))')
+_SO_NUMERO = re.compile(r'^(\d{1,2})[\s.!]*$')
+_ORDINAL_NUMERICO = re.compile(r'\b(\d{1,2})[oa]\b')
+# Femininos que também são dias da semana só valem seguidos de "opção"/"vez"
+ORDINAIS = {
+    'primeiro': 0, 'primeira': 0, 'segundo': 1, 'terceiro': 2, 'terceira': 2,
+    'quarto': 3, 'quinto': 4, 'sexto': 5, 'setimo': 6, 'setima': 6,
+    'oitavo': 7, 'oitava': 7, 'nono': 8, 'nona': 8, 'decimo': 9, 'decima': 9
+}
+_ORDINAL = re.compile(
+    r'\b(?:(' + '|'.join(ORDINAIS) + r'|ultim[oa])'
+    r'|(segunda|quarta|quinta|sexta)(?=\s+(?:opcao|alternativa|vez)\b))\b')
+_SEM_PREFERENCIA = re.compile(r'\b(qualquer (?:horario|dia|medico)|tanto faz|sem preferencia)\b')
+
+
+def normalizar(texto):
+    """Minúsculas, sem acentos e com espaços colapsados"""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.split())
+
+
+def menciona_horario(mensagem):
+    """True se a mensagem cita um horário específico (14:00, 9h, às 10, 2 da tarde)"""
+    texto = normalizar(mensagem)
+    return bool(_HORA.search(texto) or _HORA_PERIODO.search(texto) or _HORA_CHEIA.search(texto))
+
+
+def _horas_citadas(texto):
+    """
+    Horários 'HH:MM' que o texto normalizado pode estar citando
+
+    "14h", "14:30" e "2 da tarde" dão um só horário; "às 3" e "3 horas", sem
+    período, valem tanto 03:00 quanto 15:00. None se não cita horário.
+    """
+    periodo = _HORA_PERIODO.search(texto)
+    cheia = _HORA_CHEIA.search(texto)
+    if periodo:
+        hora, minuto = int(periodo.group(1)), int(periodo.group(2) or 0)
+        if periodo.group(3) in ('tarde', 'noite') and hora < 12:
+            hora += 12
+        horas = [hora]
+    elif cheia:
+        hora, minuto = int(cheia.group(1) or cheia.group(2)), 0
+        horas = [hora, hora + 12] if 0 < hora < 12 else [hora]
+    else:
+        exata = _HORA_EXATA.search(texto)
+        if not exata:
+            return None
+        hora, minuto = int(exata.group(1)), int(exata.group(2) or exata.group(3) or 0)
+        horas = [hora]
+    if hora > 23 or minuto > 59:
+        return None
+    return {f"{hora:02d}:{minuto:02d}" for hora in horas}
+
+
+def _dia_citado(texto, hoje):
+    """
+    Dia relativo citado no texto normalizado
+
+    Returns:
+        tuple: (data ISO de hoje/amanhã/depois de amanhã, dia da semana), None no
+        que não foi citado; (False, None) se cita mais de um dia da semana
+    """
+    if re.search(r'\bdepois de amanha\b', texto):
+        return (hoje + timedelta(days=2)).isoformat(), None
+    if re.search(r'\bamanha\b', texto):
+        return (hoje + timedelta(days=1)).isoformat(), None
+    if re.search(r'\bhoje\b', texto):
+        return hoje.isoformat(), None
+    dias = {DIAS_SEMANA[dia] for dia in _DIA_SEMANA.findall(texto)}
+    if len(dias) > 1:
+        return False, None
+    return None, dias.pop() if dias else None
+
+
+def _minutos_limite(encontrado):
+    """Minutos de um _DEPOIS_DAS/_ANTES_DAS, com "da tarde"/"da noite" somando 12h"""
+    hora, minuto = int(encontrado.group(1)), int(encontrado.group(2) or 0)
+    if encontrado.group(3) in ('tarde', 'noite') and hora < 12:
+        hora += 12
+    return hora * 60 + minuto
+
+
+def _data_futura(dia, mes, hoje):
+    """dd/mm sem ano: a próxima ocorrência a partir de hoje"""
+    try:
+        data = date(hoje.year, mes, dia)
+    except ValueError:
+        return None
+    if data < hoje:
+        try:
+            data = date(hoje.year + 1, mes, dia)
+        except ValueError:
+            return None
+    return data
+
+
+def extrair_preferencias(mensagem, medicos=None, hoje=None):
+    """
+    Extrai preferências de horário de uma mensagem livre
+
+    Args:
+        mensagem (str): Texto do paciente ("só de manhã", "sexta à tarde", ...)
+        medicos (dict): medico_id -> nome, para reconhecer o médico preferido
+        hoje (date): Data de referência (padrão: hoje)
+
+    Returns:
+        dict: Preferências encontradas (vazio se nenhuma)
+    """
+    hoje = hoje or date.today()
+    texto = normalizar(mensagem)
+    preferencias = {}
+
+    dias = sorted({DIAS_SEMANA[dia] for dia in _DIA_SEMANA.findall(texto)})
+    if 'fim de semana' in texto or 'final de semana' in texto:
+        dias = sorted(set(dias) | {5, 6})
+    if 'dia de semana' in texto or 'dias de semana' in texto or 'dia util' in texto or 'dias uteis' in texto:
+        dias = sorted(set(dias) | {0, 1, 2, 3, 4})
+    if dias:
+        preferencias['dias_semana'] = dias
+
+    for periodo, (inicio, fim) in PERIODOS.items():
+        if re.search(rf'\b{periodo}\b', texto):
+            preferencias['hora_min'] = min(preferencias.get('hora_min', inicio), inicio)
+            preferencias['hora_max'] = max(preferencias.get('hora_max', fim), fim)
+
+    entre = _ENTRE.search(texto)
+    if entre:
+        preferencias['hora_min'] = int(entre.group(1)) * 60
+        preferencias['hora_max'] = int(entre.group(2)) * 60
+    else:
+        depois = _DEPOIS_DAS.search(texto)
+        if depois:
+            preferencias['hora_min'] = _minutos_limite(depois)
+        antes = _ANTES_DAS.search(texto)
+        if antes:
+            preferencias['hora_max'] = _minutos_limite(antes)
+
+    a_partir = _A_PARTIR_DATA.search(texto)
+    data_citada = _DATA.search(texto)
+    if a_partir:
+        data = _data_futura(int(a_partir.group(1)), int(a_partir.group(2)), hoje)
+        if data:
+            preferencias['data_inicio'] = data.isoformat()
+    elif data_citada:
+        # Data específica: buscar a partir dela para que o horário pedido apareça
+        data = _data_futura(int(data_citada.group(1)), int(data_citada.group(2)), hoje)
+        if data:
+            preferencias['data_inicio'] = data.isoformat()
+    elif re.search(r'\bamanha\b', texto):
+        amanha = hoje + timedelta(days=1)
+        preferencias['data_inicio'] = preferencias['data_fim'] = amanha.isoformat()
+    elif re.search(r'\b(semana que vem|proxima semana)\b', texto):
+        proxima_segunda = hoje + timedelta(days=7 - hoje.weekday())
+        preferencias['data_inicio'] = proxima_segunda.isoformat()
+
+    for medico_id, nome in (medicos or {}).items():
+        partes = [parte for parte in normalizar(nome).replace('.', ' ').split()
+                  if len(parte) >= 4 and parte not in ('dr', 'dra')]
+        if any(re.search(rf'\b{re.escape(parte)}\b', texto) for parte in partes):
+            preferencias['medico_id'] = medico_id
+            break
+
+    return preferencias
+
+
+def escolher_horario(mensagem, horarios, numerados=True, hoje=None):
+    """
+    Resolve localmente a escolha de um horário da lista exibida
+
+    Reconhece data/hora explícitas ("20/10 às 14:00", "14h", "2 da tarde"),
+    com dia relativo junto do horário ("amanhã às 14h", "sexta 9h"), ordinais
+    ("o primeiro", "segunda opção", "3º") e, com `numerados`, o número da opção
+    quando vem sozinho ou nomeado ("2", "opção 3", "a 2"). "às 3" e "3 horas"
+    são horários, não opções. Perguntas e mensagens de preferência ("depois das
+    14h", "a partir de 20/10") não são escolhas.
+
+    Args:
+        mensagem (str): Resposta do paciente
+        horarios (list): Horários exibidos, na ordem mostrada (campos 'data' e 'hora')
+        numerados (bool): A lista foi exibida numerada
+        hoje (date): Data de referência para dd/mm sem ano e dias relativos
+
+    Returns:
+        int: Índice do horário escolhido, ou None se a mensagem não é uma escolha clara
+    """
+    if not horarios or '?' in mensagem:
+        return None
+    texto = normalizar(mensagem)
+    if _DEPOIS_DAS.search(texto) or _ANTES_DAS.search(texto) or _ENTRE.search(texto) \
+            or _A_PARTIR_DATA.search(texto):
+        return None
+
+    hoje = hoje or date.today()
+    data_citada = _DATA.search(texto)
+    horas = _horas_citadas(texto)
+    if data_citada or horas:
+        data, dia_semana = None, None
+        if data_citada:
+            data = _data_futura(int(data_citada.group(1)), int(data_citada.group(2)), hoje)
+            if data is None:
+                return None
+            data = data.isoformat()
+        else:
+            # "amanhã às 14h", "sexta 9h": o dia citado também precisa bater
+            data, dia_semana = _dia_citado(texto, hoje)
+            if data is False:
+                return None
+        candidatos = [i for i, horario in enumerate(horarios)
+                      if (data is None or horario['data'] == data)
+                      and (dia_semana is None
+                           or date.fromisoformat(horario['data']).weekday() == dia_semana)
+                      and (horas is None or horario['hora'] in horas)]
+        # Data e hora juntas identificam o slot (o primeiro, se houver mais de um médico
+        # ou, para um dia da semana, a data mais próxima)
+        if candidatos and (len(candidatos) == 1
+                           or (horas and (data or dia_semana is not None))):
+            return candidatos[0]
+        return None
+
+    ordinal = _ORDINAL.search(texto)
+    if ordinal:
+        palavra = ordinal.group(1) or ordinal.group(2)
+        if palavra.startswith('ultim'):
+            return len(horarios) - 1
+        indice = ORDINAIS.get(palavra, {'segunda': 1, 'quarta': 3, 'quinta': 4, 'sexta': 5}.get(palavra))
+        return indice if indice < len(horarios) else None
+
+    numero = _ORDINAL_NUMERICO.search(texto)
+    if not numero and numerados:
+        numero = _SO_NUMERO.match(texto) or _OPCAO_NUMERO.search(texto)
+    if not numero:
+        return None
+    indice = int(numero.group(1)) - 1
+    return indice if 0 <= indice < len(horarios) else None
+
+
+def aplicar_preferencias(atuais, mensagem, medicos=None, hoje=None):
+    """
+    Combina as preferências já guardadas com as da nova mensagem
+
+    Returns:
+        tuple: (preferências resultantes, True se a mensagem alterou as preferências)
+    """
+    if _SEM_PREFERENCIA.search(normalizar(mensagem)):
+        return {}, bool(atuais)
+    novas = extrair_preferencias(mensagem, medicos, hoje)
+    if not novas:
+        return dict(atuais or {}), False
+    resultado = dict(atuais or {})
+    if 'data_inicio' in novas and 'data_fim' not in novas:
+        resultado.pop('data_fim', None)
+    resultado.update(novas)
+    return resultado, True
+
+
+def descrever_preferencias(preferencias, medicos=None):
+    """Texto curto para o paciente: 'sexta, à tarde, com Dra. Maria'"""
+    partes = []
+    if preferencias.get('dias_semana'):
+        partes.append(', '.join(NOMES_DIAS[dia] for dia in preferencias['dias_semana']))
+    hora_min, hora_max = preferencias.get('hora_min'), preferencias.get('hora_max')
+    periodo = next((nome for nome, janela in PERIODOS.items()
+                    if janela == (hora_min, hora_max)), None)
+    if periodo:
+        partes.append({'manha': 'pela manhã', 'tarde': 'à tarde', 'noite': 'à noite'}[periodo])
+    elif hora_min is not None and hora_max is not None:
+        partes.append(f"entre {hora_min // 60:02d}:{hora_min % 60:02d} e {hora_max // 60:02d}:{hora_max % 60:02d}")
+    elif hora_min is not None:
+        partes.append(f"a partir das {hora_min // 60:02d}:{hora_min % 60:02d}")
+    elif hora_max is not None:
+        partes.append(f"antes das {hora_max // 60:02d}:{hora_max % 60:02d}")
+    if preferencias.get('data_inicio'):
+        inicio = date.fromisoformat(preferencias['data_inicio'])
+        if preferencias.get('data_fim') == preferencias['data_inicio']:
+            partes.append(f"em {inicio.strftime('%d/%m')}")
+        else:
+            partes.append(f"a partir de {inicio.strftime('%d/%m')}")
+    if preferencias.get('medico_id') and medicos:
+        partes.append(f"com {medicos.get(preferencias['medico_id'], 'o médico escolhido')}")
+    return ', '.join(partes)
@@ -0,0 +1,270 @@
+import logging
+import math
+import threading
+
+logger = logging.getLogger('SistemaAgendamento')
+
+# Prompts enviados ao Gemini. O texto fixo de cada modelo (instruções e exemplos) é
+# compactado uma única vez, sem a indentação e as linhas em branco das f-strings
+# antigas. O trecho com a lista de locais/especialidades é montado uma vez por
+# conteúdo e reaproveitado até esses dados mudarem; por turno só entra a mensagem.
+# Cada prompt registra uma estimativa de tokens por modelo (estatisticas()), identificado
+# por tipo e versão: dois textos diferentes nunca dividem a mesma contagem.
+
+# Estimativa grosseira para português: ~4 caracteres por token
+CARACTERES_POR_TOKEN = 4
+
+# Listas distintas guardadas por modelo (as especialidades variam por local)
+LIMITE_LISTAS = 32
+
+_lock = threading.Lock()
+_contagens = {}  # chave do modelo -> [prompts, tokens, modelo]
+_chaves = set()
+
+
+def compactar(texto):
+    """Remove indentação, linhas em branco e espaços repetidos"""
+    return '\n'.join(' '.join(linha.split()) for linha in texto.splitlines() if linha.strip())
+
+
+def estimar_tokens(texto):
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN)
+
+
+class ModeloPrompt:
+    """
+    Modelo de prompt com texto fixo pré-compilado
+
+    `texto` contém {mensagem} e, opcionalmente, {lista}; a lista chega pronta em
+    linhas e o prompt compilado para ela fica guardado enquanto as linhas forem
+    as mesmas. `tipo` e `versao` identificam o texto nas estatísticas; a mesma
+    identidade para dois textos é erro.
+
+    Raises:
+        ValueError: Já existe um modelo com o mesmo tipo e versão
+    """
+
+    def __init__(self, tipo, versao, texto):
+        self.tipo = tipo
+        self.versao = versao
+        self.chave = f"{tipo}.v{versao}"
+        if self.chave in _chaves:
+            raise ValueError(f"Modelo de prompt duplicado: {self.chave}")
+        _chaves.add(self.chave)
+        self.texto = compactar(texto)
+        self.tokens_fixos = estimar_tokens(self.texto.replace('{mensagem}', '').replace('{lista}', ''))
+        self._compilados = {}  # tuple(linhas) -> (antes da mensagem, depois da mensagem)
+
+    def _compilar(self, linhas):
+        partes = self._compilados.get(linhas)
+        if partes is None:
+            texto = self.texto.replace('{lista}', '\n'.join(compactar(linha) for linha in linhas))
+            partes = tuple(texto.split('{mensagem}', 1))
+            with _lock:
+                if len(self._compilados) >= LIMITE_LISTAS:
+                    self._compilados.clear()
+                self._compilados[linhas] = partes
+        return partes
+
+    def montar(self, mensagem, linhas=()):
+        """
+        Prompt final para a mensagem do usuário
+
+        Args:
+            mensagem (str): Mensagem do usuário (espaços colapsados)
+            linhas (iterable): Linhas da lista de opções, quando o modelo tem {lista}
+
+        Returns:
+            str: Prompt compacto
+        """
+        antes, depois = self._compilar(tuple(linhas))
+        prompt = antes + ' '.join(mensagem.split()) + depois
+        tokens = estimar_tokens(prompt)
+        with _lock:
+            contagem = _contagens.setdefault(self.chave, [0, 0, self])
+            contagem[0] += 1
+            contagem[1] += tokens
+        return prompt
+
+
+def estatisticas():
+    """Prompts montados e tokens estimados por modelo ('local.v1', 'local_simples.v1', ...)"""
+    with _lock:
+        return {
+            chave: {
+                'tipo': modelo.tipo,
+                'versao': modelo.versao,
+                'prompts': prompts,
+                'tokens_total': tokens,
+                'tokens_medio': round(tokens / prompts),
+                'tokens_fixos': modelo.tokens_fixos
+            }
+            for chave, (prompts, tokens, modelo) in _contagens.items()
+        }
+
+
+INTENCAO = ModeloPrompt('intencao', 1, """
+    Você é um assistente médico virtual especializado em agendamentos. Analise cuidadosamente a mensagem do usuário e classifique com máxima precisão.
+
+    Mensagem do usuário: "{mensagem}"
+
+    Classifique a mensagem em uma das categorias, considerando contexto, intenção e nuances:
+
+    1. "agendamento" - Qualquer intenção de agendar consulta, marcar horário, saudações iniciais (oi, olá, boa tarde), pedidos de ajuda para marcar consulta, menções de sintomas ou necessidade médica
+
+    2. "cancelamento" - Intenção clara de cancelar, desmarcar ou remover agendamento existente
+
+    3. "consulta" - Quer verificar, ver, listar seus agendamentos ou consultas já marcadas
+
+    4. "informacao" - Perguntas sobre a clínica (telefone, endereço, horários de funcionamento, médicos disponíveis, especialidades oferecidas, localização)
+
+    5. "fora_escopo" - Conversas casuais não relacionadas à clínica, perguntas pessoais, assuntos não médicos ou de agendamento
+
+    Exemplos:
+    - "oi" → agendamento
+    - "preciso de uma consulta" → agendamento
+    - "estou com dor de cabeça" → agendamento
+    - "quero cancelar minha consulta" → cancelamento
+    - "quais são meus agendamentos?" → consulta
+    - "qual o telefone da clínica?" → informacao
+    - "como está o tempo?" → fora_escopo
+
+    Responda APENAS com uma palavra: agendamento, cancelamento, consulta, informacao, fora_escopo
+""")
+
+SAUDACAO = ModeloPrompt('saudacao', 1, """
+    Analise se esta mensagem é uma saudação ou cumprimento que indica que o usuário quer COMEÇAR uma nova conversa:
+
+    Mensagem: "{mensagem}"
+
+    Responda APENAS "sim" se for uma saudação/cumprimento que indica início de conversa.
+    Responda APENAS "não" se não for uma saudação ou se for parte de uma conversa já em andamento.
+
+    Exemplos de SIM: "oi", "olá", "bom dia", "oi tudo bem", "olá, preciso agendar"
+    Exemplos de NÃO: "5", "sim", "cardiologia", "12345678901", "não"
+""")
+
+LOCAL = ModeloPrompt('local', 1, """
+    Você é um assistente médico especializado. O usuário está escolhendo um local para atendimento.
+
+    Mensagem do usuário: "{mensagem}"
+
+    Locais de atendimento disponíveis:
+    {lista}
+
+    Analise a mensagem do usuário e identifique qual local ele deseja:
+
+    Considere:
+    - Nomes de cidades (Contagem, Belo Horizonte, BH)
+    - Nomes dos locais
+    - Variações e apelidos (Contagem = CTG, Belo Horizonte = BH)
+    - Proximidade ou preferência mencionada
+
+    Se o usuário mencionou um local válido, responda apenas com o nome EXATO do local da lista.
+    Se não conseguir identificar ou se a mensagem for ambígua, responda "não encontrado".
+
+    Exemplos:
+    "quero em contagem" → Contagem
+    "prefiro bh" → Belo Horizonte
+    "o mais próximo" → não encontrado (precisa ser mais específico)
+
+    Resposta:
+""")
+
+ESPECIALIDADE = ModeloPrompt('especialidade', 1, """
+    Você é um médico especialista em triagem. O usuário está descrevendo sua necessidade médica.
+
+    Mensagem do usuário: "{mensagem}"
+
+    Especialidades disponíveis no local escolhido:
+    {lista}
+
+    ANALISE CUIDADOSAMENTE a mensagem e identifique qual especialidade é mais adequada considerando:
+
+    SINTOMAS E CONDIÇÕES:
+    - Dor de cabeça, enxaqueca, tontura → Clínica Geral ou Neurologia
+    - Dor no peito, palpitação, pressão alta → Cardiologia
+    - Problemas de pele, manchas, coceira → Dermatologia
+    - Problemas nos olhos, visão → Oftalmologia
+    - Problemas de criança, bebê → Pediatria
+    - Problemas femininos, gravidez → Ginecologia
+    - Dor nas costas, ossos, articulações → Ortopedia
+    - Ansiedade, depressão, problemas mentais → Psiquiatria
+    - Check-up, exames gerais → Clínica Geral
+
+    ESPECIALIDADES MENCIONADAS DIRETAMENTE:
+    - "cardiologista" → Cardiologia
+    - "dermatologista" → Dermatologia
+    - "ginecologista" → Ginecologia
+    - etc.
+
+    Se conseguir identificar uma especialidade adequada, responda apenas com o nome EXATO da especialidade da lista.
+    Se não conseguir identificar ou for ambíguo, responda "não encontrado".
+
+    Exemplos:
+    "estou com dor de cabeça" → Clínica Geral
+    "preciso de cardiologista" → Cardiologia
+    "problema na pele" → Dermatologia
+    "meu filho está doente" → Pediatria
+    "quero fazer check-up" → Clínica Geral
+
+    Resposta:
+""")
+
+# Variantes mais curtas usadas pelo serviço SQLite (resposta "indefinido")
+LOCAL_SIMPLES = ModeloPrompt('local_simples', 1, """
+    Você é um assistente médico especializado. O usuário está escolhendo um local para atendimento.
+
+    Mensagem do usuário: "{mensagem}"
+
+    Locais de atendimento disponíveis:
+    {lista}
+
+    Analise a mensagem e identifique qual local o usuário quer escolher.
+    Se não conseguir identificar um local específico, responda "indefinido".
+
+    Responda APENAS com o nome EXATO do local escolhido ou "indefinido".
+""")
+
+ESPECIALIDADE_SIMPLES = ModeloPrompt('especialidade_simples', 1, """
+    Você é um assistente médico especializado. O usuário está escolhendo uma especialidade médica.
+
+    Mensagem do usuário: "{mensagem}"
+
+    Especialidades médicas disponíveis:
+    {lista}
+
+    Analise a mensagem do usuário e identifique qual especialidade médica ele precisa.
+    Considere:
+    - Sintomas mencionados
+    - Tipo de problema de saúde
+    - Menção direta da especialidade
+    - Contexto médico
+
+    Se não conseguir identificar uma especialidade específica, responda "indefinido".
+
+    Responda APENAS com o nome EXATO da especialidade escolhida ou "indefinido".
+""")
+
+# Extração estruturada (extracao.py): todos os campos da mensagem em uma chamada
+EXTRACAO = ModeloPrompt('extracao', 1, """
+    Você extrai dados de agendamento da mensagem de um paciente de uma clínica médica.
+
+    {lista}
+
+    Mensagem do usuário: "{mensagem}"
+
+    Responda APENAS com um objeto JSON com as chaves abaixo, usando null para o que a mensagem não informa:
+    - "saudacao": true se a mensagem é uma saudação que começa uma nova conversa, senão false
+    - "intencao": agendamento, cancelamento, consulta, informacao ou fora_escopo (saudações e sintomas são agendamento)
+    - "local": nome EXATO de um dos locais (considere cidades e apelidos, como BH = Belo Horizonte)
+    - "especialidade": nome EXATO de uma das especialidades, citada diretamente ou indicada pelos sintomas
+    - "opcao": número do horário escolhido na lista de horários exibidos
+    - "data": data pedida no formato AAAA-MM-DD
+    - "dias_semana": lista de dias da semana aceitos (segunda, terça, quarta, quinta, sexta, sábado, domingo)
+    - "periodo": manha, tarde ou noite
+    - "hora_min" e "hora_max": limites de horário no formato HH:MM
+    - "cpf": CPF com 11 dígitos
+
+    Exemplo: "quero cardiologista em BH sexta de manhã" → {"saudacao": false, "intencao": "agendamento", "local": "Belo Horizonte", "especialidade": "Cardiologia", "opcao": null, "data": null, "dias_semana": ["sexta"], "periodo": "manha", "hora_min": null, "hora_max": null, "cpf": null}
+""")
@@ -0,0 +1,124 @@
+import bisect
+from datetime import date
+
+
+class SeriesHorario:
+    """
+    Intervalos [data_inicio, data_fim] das séries recorrentes de um mesmo
+    (medico_id, dia_semana, hora), ordenados pelo início
+
+    `fim_maximo[i]` guarda o maior fim entre os i+1 primeiros intervalos: uma data
+    está coberta se algum intervalo com início <= data termina em data ou depois,
+    o que se resolve com uma busca binária e uma leitura.
+    """
+    __slots__ = ('inicios', 'fins', 'fim_maximo')
+
+    def __init__(self):
+        self.inicios = []
+        self.fins = []
+        self.fim_maximo = []
+
+    def adicionar(self, data_inicio, data_fim):
+        i = bisect.bisect_right(self.inicios, data_inicio)
+        self.inicios.insert(i, data_inicio)
+        self.fins.insert(i, data_fim)
+        self._recalcular(i)
+
+    def remover(self, data_inicio, data_fim):
+        """Remove um intervalo; retorna False se ele não estava no índice"""
+        i = bisect.bisect_left(self.inicios, data_inicio)
+        while i < len(self.inicios) and self.inicios[i] == data_inicio:
+            if self.fins[i] == data_fim:
+                del self.inicios[i]
+                del self.fins[i]
+                del self.fim_maximo[i]
+                self._recalcular(i)
+                return True
+            i += 1
+        return False
+
+    def cobre(self, data_consulta):
+        i = bisect.bisect_right(self.inicios, data_consulta)
+        return i > 0 and self.fim_maximo[i - 1] >= data_consulta
+
+    def _recalcular(self, a_partir):
+        del self.fim_maximo[a_partir:]
+        maior = self.fim_maximo[-1] if self.fim_maximo else date.min
+        for fim in self.fins[a_partir:]:
+            maior = max(maior, fim)
+            self.fim_maximo.append(maior)
+
+    def __len__(self):
+        return len(self.inicios)
+
+
+class IndiceRecorrencias:
+    """
+    Índice em memória das séries recorrentes ativas por (medico_id, dia_semana, minuto)
+
+    Responde "este slot está bloqueado por uma série?" em O(log n) para qualquer
+    data, sem consultar `agendamentos_recorrentes`. Séries sem data_fim são
+    tratadas como abertas (date.max).
+    """
+
+    def __init__(self):
+        self._series = {}  # (medico_id, dia_semana, minuto) -> SeriesHorario
+        self._minutos = {}  # (medico_id, dia_semana) -> minutos com séries, ordenados
+
+    def carregar(self, recorrentes):
+        """Reconstrói o índice a partir de tuplas (medico_id, dia_semana, minuto, inicio, fim)"""
+        self._series = {}
+        self._minutos = {}
+        for recorrente in recorrentes:
+            self.adicionar(*recorrente)
+
+    def adicionar(self, medico_id, dia_semana, minuto, data_inicio, data_fim=None):
+        chave = (medico_id, dia_semana, minuto)
+        series = self._series.get(chave)
+        if series is None:
+            series = self._series[chave] = SeriesHorario()
+            bisect.insort(self._minutos.setdefault((medico_id, dia_semana), []), minuto)
+        series.adicionar(data_inicio, data_fim or date.max)
+
+    def remover(self, medico_id, dia_semana, minuto, data_inicio, data_fim=None):
+        chave = (medico_id, dia_semana, minuto)
+        series = self._series.get(chave)
+        if series is None or not series.remover(data_inicio, data_fim or date.max):
+            return False
+        if not series:
+            del self._series[chave]
+            minutos = self._minutos[(medico_id, dia_semana)]
+            minutos.remove(minuto)
+            if not minutos:
+                del self._minutos[(medico_id, dia_semana)]
+        return True
+
+    def remover_medico(self, medico_id):
+        """Descarta todas as séries de um médico (antes de recarregá-las)"""
+        for chave in [chave for chave in self._series if chave[0] == medico_id]:
+            del self._series[chave]
+        for chave in [chave for chave in self._minutos if chave[0] == medico_id]:
+            del self._minutos[chave]
+
+    def bloqueia(self, medico_id, data_slot, minuto):
+        """True se alguma série ativa ocupa o médico nesta data e horário"""
+        series = self._series.get((medico_id, data_slot.weekday(), minuto))
+        return series is not None and series.cobre(data_slot)
+
+    def bloqueia_intervalo(self, medico_id, data_slot, inicio, fim):
+        """True se alguma série ativa começa dentro de [inicio, fim) nesta data"""
+        dia_semana = data_slot.weekday()
+        minutos = self._minutos.get((medico_id, dia_semana), ())
+        for i in range(bisect.bisect_left(minutos, inicio), bisect.bisect_left(minutos, fim)):
+            if self._series[(medico_id, dia_semana, minutos[i])].cobre(data_slot):
+                return True
+        return False
+
+    def minutos_ativos(self, medico_id, data_slot):
+        """Minutos de início das séries ativas do médico nesta data"""
+        dia_semana = data_slot.weekday()
+        return [minuto for minuto in self._minutos.get((medico_id, dia_semana), ())
+                if self._series[(medico_id, dia_semana, minuto)].cobre(data_slot)]
+
+    def __len__(self):
+        return sum(len(series) for series in self._series.values())
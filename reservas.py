@@ -0,0 +1,183 @@
+import logging
+import os
+import re
+import shlex
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+
+logger = logging.getLogger('SistemaAgendamento')
+
+# Reservas temporárias de slot entre a escolha do horário e a confirmação.
+# Cada sessão de chat segura no máximo um slot; a reserva expira sozinha após o
+# TTL e some da disponibilidade exibida às demais sessões enquanto vale.
+# Slots são identificados por (medico_id, data ISO, minuto desde 00:00).
+
+TTL_PADRAO = 300
+
+
+class ReservasMemoria:
+    """Reservas em memória: suficiente com um único processo (python main.py)"""
+
+    def __init__(self, ttl=TTL_PADRAO):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._por_slot = {}  # (medico_id, data, minuto) -> (sessao, expira_em)
+        self._por_sessao = {}  # sessao -> (medico_id, data, minuto)
+
+    def reservar(self, medico_id, data_slot, minuto, sessao):
+        """
+        Reserva (ou renova) o slot para a sessão, liberando a reserva anterior dela
+
+        Returns:
+            bool: False se outra sessão já segura o slot
+        """
+        chave = (medico_id, data_slot.isoformat(), minuto)
+        agora = time.time()
+        with self._lock:
+            atual = self._por_slot.get(chave)
+            if atual is not None and atual[0] != sessao and atual[1] > agora:
+                return False
+            self._liberar(sessao)
+            if atual is not None and atual[0] != sessao:
+                self._por_sessao.pop(atual[0], None)
+            self._por_slot[chave] = (sessao, agora + self.ttl)
+            self._por_sessao[sessao] = chave
+            return True
+
+    def liberar(self, sessao):
+        """Libera a reserva da sessão (confirmação, recusa ou nova escolha)"""
+        with self._lock:
+            self._liberar(sessao)
+
+    def _liberar(self, sessao):
+        chave = self._por_sessao.pop(sessao, None)
+        if chave is not None and self._por_slot.get(chave, (None,))[0] == sessao:
+            del self._por_slot[chave]
+
+    def retidos(self, excluir_sessao=None):
+        """Slots reservados por outras sessões e ainda válidos"""
+        agora = time.time()
+        with self._lock:
+            for chave, (sessao, expira_em) in list(self._por_slot.items()):
+                if expira_em <= agora:
+                    del self._por_slot[chave]
+                    if self._por_sessao.get(sessao) == chave:
+                        del self._por_sessao[sessao]
+            return {
+                chave for chave, (sessao, _) in self._por_slot.items()
+                if sessao != excluir_sessao
+            }
+
+
+class ReservasSQLite:
+    """
+    Reservas em uma tabela SQLite compartilhada: vários workers do gunicorn
+    enxergam as mesmas reservas
+    """
+
+    def __init__(self, caminho, ttl=TTL_PADRAO):
+        self.caminho = caminho
+        self.ttl = ttl
+        with closing(self._conectar()) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS reservas_slot (
+                    medico_id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    minuto INTEGER NOT NULL,
+                    sessao TEXT NOT NULL UNIQUE,
+                    expira_em REAL NOT NULL,
+                    PRIMARY KEY (medico_id, data, minuto)
+                )
+            ''')
+
+    def _conectar(self):
+        # Autocommit: cada comando fora de BEGIN é uma transação própria
+        return sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+
+    def reservar(self, medico_id, data_slot, minuto, sessao):
+        """
+        Reserva (ou renova) o slot para a sessão, liberando a reserva anterior dela
+
+        Returns:
+            bool: False se outra sessão já segura o slot
+        """
+        chave = (medico_id, data_slot.isoformat(), minuto)
+        agora = time.time()
+        with closing(self._conectar()) as conn:
+            # BEGIN IMMEDIATE serializa as reservas entre processos
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM reservas_slot WHERE expira_em <= ?", (agora,))
+                dono = conn.execute(
+                    "SELECT sessao FROM reservas_slot WHERE medico_id = ? AND data = ? AND minuto = ?",
+                    chave).fetchone()
+                if dono is not None and dono[0] != sessao:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute("DELETE FROM reservas_slot WHERE sessao = ?", (sessao,))
+                conn.execute(
+                    "INSERT INTO reservas_slot (medico_id, data, minuto, sessao, expira_em) VALUES (?, ?, ?, ?, ?)",
+                    chave + (sessao, agora + self.ttl))
+                conn.execute("COMMIT")
+                return True
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+    def liberar(self, sessao):
+        """Libera a reserva da sessão (confirmação, recusa ou nova escolha)"""
+        with closing(self._conectar()) as conn:
+            conn.execute("DELETE FROM reservas_slot WHERE sessao = ?", (sessao,))
+
+    def retidos(self, excluir_sessao=None):
+        """Slots reservados por outras sessões e ainda válidos"""
+        with closing(self._conectar()) as conn:
+            rows = conn.execute(
+                "SELECT medico_id, data, minuto FROM reservas_slot WHERE expira_em > ? AND sessao != ?",
+                (time.time(), excluir_sessao or '')).fetchall()
+        return {tuple(row) for row in rows}
+
+
+def _workers():
+    """
+    Quantidade de processos que vão servir a aplicação
+
+    Lida de WEB_CONCURRENCY (padrão de workers do gunicorn) ou do -w/--workers
+    em GUNICORN_CMD_ARGS e na linha de comando do gunicorn; 1 se nada indica
+    vários processos.
+    """
+    argumentos = shlex.split(os.environ.get('GUNICORN_CMD_ARGS', ''))
+    if sys.argv and os.path.basename(sys.argv[0]).startswith('gunicorn'):
+        argumentos += sys.argv[1:]
+    workers = os.environ.get('WEB_CONCURRENCY', '1')
+    for i, argumento in enumerate(argumentos):
+        encontrado = re.match(r'^(?:-w|--workers)(?:=?(\d+))?$', argumento)
+        if encontrado:
+            workers = encontrado.group(1) or (argumentos[i + 1] if i + 1 < len(argumentos) else '1')
+    try:
+        return int(workers)
+    except ValueError:
+        return 1
+
+
+def criar_reservas():
+    """
+    Cria o armazenamento de reservas conforme o ambiente
+
+    RESERVAS_SLOT=sqlite usa a tabela compartilhada em RESERVAS_SLOT_DB e
+    RESERVAS_SLOT=memoria fica no processo. Sem RESERVAS_SLOT, vários workers
+    (WEB_CONCURRENCY ou -w do gunicorn maior que 1) usam SQLite, já que
+    reservas em memória não são vistas pelos outros processos; um processo só
+    (python main.py) usa memória. RESERVAS_SLOT_TTL define a validade em
+    segundos.
+    """
+    ttl = int(os.environ.get('RESERVAS_SLOT_TTL', TTL_PADRAO))
+    padrao = 'sqlite' if _workers() > 1 else 'memoria'
+    if os.environ.get('RESERVAS_SLOT', padrao).lower() == 'sqlite':
+        caminho = os.environ.get('RESERVAS_SLOT_DB', 'reservas_slot.db')
+        logger.info(f"Reservas de slot em SQLite: {caminho} (TTL {ttl}s)")
+        return ReservasSQLite(caminho, ttl)
+    return ReservasMemoria(ttl)
@@ -0,0 +1,154 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+
+# Módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FonteFalsa:
+    """
+    Adaptador de agenda em memória com a interface de FonteSQLite/FonteSQLAlchemy
+
+    Horários em minutos desde 00:00; `consultas` conta as chamadas por método.
+    Gravações devem passar por adicionar_medico/agendar/alterar, que incrementam
+    a versão da agenda como os triggers do banco.
+    """
+
+    slots_materializados = False
+
+    def __init__(self):
+        self.medicos = {}  # medico_id -> (nome, especialidade_id)
+        self.locais = {1: 'Centro', 2: 'Bairro'}
+        self.turnos = []  # (horario_id, medico_id, local_id, dia_semana, inicio, fim, duracao)
+        self.agendamentos = []  # (medico_id, data, inicio, fim)
+        self.recorrentes = []  # (medico_id, dia_semana, minuto, data_inicio, data_fim)
+        self.versoes = {}  # medico_id -> versao_agenda
+        self.consultas = {}
+
+    def _contar(self, metodo):
+        self.consultas[metodo] = self.consultas.get(metodo, 0) + 1
+
+    def adicionar_medico(self, medico_id, especialidade_id=1, local_id=1, inicio=8 * 60,
+                         fim=12 * 60, duracao=60, dias=range(7)):
+        self.medicos[medico_id] = (f"Dr. {medico_id}", especialidade_id)
+        for dia in dias:
+            self.turnos.append((len(self.turnos) + 1, medico_id, local_id, dia, inicio, fim, duracao))
+        self.alterar(medico_id)
+
+    def agendar(self, medico_id, data_ag, inicio, fim=None):
+        self.agendamentos.append((medico_id, data_ag, inicio, fim))
+        self.alterar(medico_id)
+
+    def alterar(self, medico_id):
+        self.versoes[medico_id] = self.versoes.get(medico_id, 0) + 1
+
+    def carregar_medicos(self):
+        self._contar('carregar_medicos')
+        return dict(self.medicos)
+
+    def versoes_agenda(self, especialidade_id=None):
+        self._contar('versoes_agenda')
+        return {medico_id: self.versoes.get(medico_id, 0)
+                for medico_id, (_, esp_id) in self.medicos.items()
+                if especialidade_id is None or esp_id == especialidade_id}
+
+    def versao_agenda(self, medico_id):
+        self._contar('versao_agenda')
+        return self.versoes.get(medico_id, 0) if medico_id in self.medicos else None
+
+    def carregar_locais(self):
+        self._contar('carregar_locais')
+        return dict(self.locais)
+
+    def carregar_configuracoes(self, medico_ids=None):
+        self._contar('carregar_configuracoes')
+        return [(medico_id, local_id, dia, inicio, fim, duracao)
+                for _, medico_id, local_id, dia, inicio, fim, duracao in self.turnos
+                if medico_ids is None or medico_id in medico_ids]
+
+    def carregar_turnos(self, medico_id):
+        self._contar('carregar_turnos')
+        return [(horario_id, local_id, dia, inicio, fim)
+                for horario_id, medico, local_id, dia, inicio, fim, _ in self.turnos
+                if medico == medico_id]
+
+    def carregar_agendamentos(self, medico_ids, data_inicio, data_fim):
+        self._contar('carregar_agendamentos')
+        return [agendamento for agendamento in self.agendamentos
+                if (medico_ids is None or agendamento[0] in medico_ids)
+                and data_inicio <= agendamento[1] <= data_fim]
+
+    def carregar_recorrentes(self, medico_ids, data_inicio, data_fim):
+        self._contar('carregar_recorrentes')
+        return [recorrente for recorrente in self.recorrentes
+                if (medico_ids is None or recorrente[0] in medico_ids)
+                and recorrente[3] <= data_fim
+                and (recorrente[4] is None or recorrente[4] >= data_inicio)]
+
+    def conflito_agendamento(self, medico_id, data_slot, inicio, fim):
+        self._contar('conflito_agendamento')
+        return any(medico == medico_id and data_ag == data_slot
+                   and a_inicio < fim and (a_fim or a_inicio + 1) > inicio
+                   for medico, data_ag, a_inicio, a_fim in self.agendamentos)
+
+    def agendamentos_existentes(self, slots):
+        self._contar('agendamentos_existentes')
+        return {(medico_id, data_slot, inicio) for medico_id, data_slot, inicio, fim in slots
+                if any(medico == medico_id and data_ag == data_slot
+                       and a_inicio < fim and (a_fim or a_inicio + 1) > inicio
+                       for medico, data_ag, a_inicio, a_fim in self.agendamentos)}
+
+
+@pytest.fixture
+def fonte():
+    """Dois médicos de especialidade 1 e um de especialidade 2, das 8h às 12h todos os dias"""
+    fonte = FonteFalsa()
+    fonte.adicionar_medico(1)
+    fonte.adicionar_medico(2, local_id=2)
+    fonte.adicionar_medico(3, especialidade_id=2)
+    return fonte
+
+
+@pytest.fixture
+def hoje():
+    return date.today()
+
+
+@pytest.fixture(scope='session')
+def app_sqlite(tmp_path_factory):
+    """
+    Módulo app_sqlite com banco, log e caches em um diretório temporário
+
+    database.py cria o banco no diretório atual ao ser importado; o caminho fica
+    absoluto para o restante da sessão de testes.
+    """
+    diretorio = tmp_path_factory.mktemp('app_sqlite')
+    os.environ.setdefault('GEMINI_API_KEY', 'teste')
+    anterior = os.getcwd()
+    os.chdir(diretorio)
+    try:
+        import app_sqlite
+        from database import db
+        db.db_path = str(diretorio / db.db_path)
+    finally:
+        os.chdir(anterior)
+    app_sqlite.app.config['TESTING'] = True
+    return app_sqlite
+
+
+@pytest.fixture
+def cliente(app_sqlite):
+    return app_sqlite.app.test_client()
+
+
+@pytest.fixture
+def paciente_id(app_sqlite):
+    from database import db
+
+    rows = db.execute_query("SELECT id FROM pacientes WHERE cpf = '00000000191'")
+    if rows:
+        return rows[0]['id']
+    return db.execute_insert("INSERT INTO pacientes (cpf, nome) VALUES ('00000000191', 'Paciente Teste')")
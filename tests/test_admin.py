@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+import pytest
+
+# Dados iniciais de database.py: médico 1 atende no local 1 (Contagem) de
+# segunda a sexta, das 8h às 17h
+
+
+@pytest.fixture
+def admin(cliente):
+    with cliente.session_transaction() as sessao:
+        sessao['admin_logado'] = True
+    return cliente
+
+
+@pytest.fixture
+def horarios_medico_1(app_sqlite):
+    """Remove ao final os horários cadastrados pelo teste para o médico 1"""
+    from database import db
+
+    anteriores = {row['id'] for row in db.execute_query(
+        "SELECT id FROM horarios_disponiveis WHERE medico_id = 1")}
+    yield lambda: db.execute_query(
+        "SELECT id, dia_semana, hora_inicio, hora_fim FROM horarios_disponiveis WHERE medico_id = 1")
+    for row in db.execute_query("SELECT id FROM horarios_disponiveis WHERE medico_id = 1"):
+        if row['id'] not in anteriores:
+            db.execute_update("DELETE FROM horarios_disponiveis WHERE id = ?", (row['id'],))
+    app_sqlite.motor_disponibilidade.matriz.recarregar_medico(1)
+
+
+def _mensagens(cliente):
+    with cliente.session_transaction() as sessao:
+        return [mensagem for _, mensagem in sessao.pop('_flashes', [])]
+
+
+def test_ocupacao_exige_login(cliente):
+    resposta = cliente.get('/admin/ocupacao')
+    assert resposta.status_code == 302
+    assert '/admin/login' in resposta.headers['Location']
+
+
+def test_mapa_de_ocupacao(admin):
+    mapa = admin.get('/admin/ocupacao?semanas=20').get_json()
+    assert mapa['success']
+    # Limitado a 8 semanas
+    assert len(mapa['datas']) == 8 * 7
+    linha = next(linha for linha in mapa['linhas'] if linha['medico_id'] == 1)
+    assert linha['local'] == 'Contagem'
+    assert len(linha['percentuais']) == len(mapa['datas'])
+    assert linha['capacidade'] > 0 and 0 <= linha['percentual'] <= 100
+
+
+def test_mapa_reflete_agendamento(admin, app_sqlite):
+    matriz = app_sqlite.motor_disponibilidade.matriz
+    mapa = admin.get('/admin/ocupacao').get_json()
+    linha = next(linha for linha in mapa['linhas'] if linha['medico_id'] == 1)
+    i, data_dia = next((i, data_dia) for i, data_dia in enumerate(mapa['datas'])
+                       if linha['percentuais'][i] == 0)
+    data_dia = date.fromisoformat(data_dia)
+
+    # 9 das 18 consultas do dia
+    matriz.registrar_agendamento(1, data_dia, '08:00', '12:30')
+    try:
+        linha = next(linha for linha in admin.get('/admin/ocupacao').get_json()['linhas']
+                     if linha['medico_id'] == 1)
+        assert linha['percentuais'][i] == 50
+    finally:
+        matriz.liberar_agendamento(1, data_dia, '08:00', '12:30')
+
+
+def test_horario_sobreposto_e_recusado(admin, horarios_medico_1):
+    antes = len(horarios_medico_1())
+    resposta = admin.post('/admin/horarios', data={
+        'medico_id': '1', 'local_id': '2', 'dia_semana': '0',
+        'hora_inicio': '16:00', 'hora_fim': '18:00', 'duracao_consulta': '30'})
+    assert resposta.status_code == 302
+    assert len(horarios_medico_1()) == antes
+    assert _mensagens(admin) == [
+        'Conflito de horário: o médico já atende em Contagem na Segunda das 08:00 às 17:00.']
+
+
+def test_horario_adjacente_e_cadastrado(admin, horarios_medico_1, app_sqlite, hoje):
+    admin.post('/admin/horarios', data={
+        'medico_id': '1', 'local_id': '2', 'dia_semana': '0',
+        'hora_inicio': '17:00', 'hora_fim': '18:00', 'duracao_consulta': '30'})
+    assert _mensagens(admin) == ['Horário cadastrado com sucesso!']
+    assert {(row['dia_semana'], row['hora_inicio']) for row in horarios_medico_1()} >= {(0, '17:00')}
+
+    # A matriz do processo já tem o novo turno
+    segunda = hoje + timedelta(days=7 - hoje.weekday())
+    matriz = app_sqlite.motor_disponibilidade.matriz
+    assert matriz.fim_slot(1, segunda, 17 * 60) == 17 * 60 + 30
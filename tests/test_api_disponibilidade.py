@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+import pytest
+
+# Dados iniciais de database.py: médico 1 (Clínica Geral) atende no local 1 de
+# segunda a sexta, das 8h às 17h, em consultas de 30 minutos
+URL = '/api/disponibilidade?local_id=1&especialidade_id=1&medico_id=1'
+
+
+@pytest.fixture
+def agendar(app_sqlite, paciente_id):
+    """Grava um agendamento direto no banco, como outro worker faria"""
+    from database import db
+
+    criados = []
+
+    def agendar(medico_id, data, hora, hora_fim):
+        criados.append(db.execute_insert(
+            """
+            INSERT INTO agendamentos (paciente_id, medico_id, especialidade_id, local_id,
+                                      data, hora, hora_fim)
+            VALUES (?, ?, 1, 1, ?, ?, ?)
+            """, (paciente_id, medico_id, data, hora, hora_fim)))
+
+    yield agendar
+    for agendamento_id in criados:
+        db.execute_update("DELETE FROM agendamentos WHERE id = ?", (agendamento_id,))
+
+
+def test_parametros_obrigatorios(cliente):
+    assert cliente.get('/api/disponibilidade?local_id=1').status_code == 400
+    assert cliente.get(URL + '&data_inicio=ontem').status_code == 400
+
+
+def test_paginacao_por_cursor(cliente):
+    primeira = cliente.get(URL + '&limite=3').get_json()
+    assert len(primeira['horarios']) == 3
+    assert primeira['proximo_cursor']
+    segunda = cliente.get(URL + '&limite=3&cursor=' + primeira['proximo_cursor']).get_json()
+    chaves = [(h['data'], h['hora']) for h in primeira['horarios'] + segunda['horarios']]
+    assert len(segunda['horarios']) == 3
+    assert chaves == sorted(chaves) and len(set(chaves)) == 6
+    assert cliente.get(URL + '&cursor=invalido').status_code == 400
+
+
+def test_etag_304_e_mudanca_no_banco(cliente, agendar):
+    resposta = cliente.get(URL + '&limite=5')
+    assert resposta.status_code == 200
+    etag = resposta.headers['ETag']
+    primeiro = resposta.get_json()['horarios'][0]
+
+    repetida = cliente.get(URL + '&limite=5', headers={'If-None-Match': etag})
+    assert repetida.status_code == 304
+    assert repetida.headers['ETag'] == etag
+
+    # Agendamento feito fora deste processo: nova ETag e o slot some da lista
+    agendar(1, primeiro['data'], primeiro['hora'], primeiro['hora_fim'])
+    atualizada = cliente.get(URL + '&limite=5', headers={'If-None-Match': etag})
+    assert atualizada.status_code == 200
+    assert atualizada.headers['ETag'] != etag
+    horarios = atualizada.get_json()['horarios']
+    assert (primeiro['data'], primeiro['hora']) not in {(h['data'], h['hora']) for h in horarios}
+
+
+def test_etag_de_outro_medico_nao_muda(cliente, agendar):
+    etag = cliente.get(URL).headers['ETag']
+    horario = cliente.get('/api/disponibilidade?local_id=1&especialidade_id=2&medico_id=2') \
+        .get_json()['horarios'][0]
+    agendar(2, horario['data'], horario['hora'], horario['hora_fim'])
+    assert cliente.get(URL, headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_verificar_disponibilidade_ve_agendamento_de_outro_worker(cliente, agendar):
+    horario = cliente.get(URL + '&limite=1').get_json()['horarios'][0]
+    corpo = {'medico_id': 1, 'data': horario['data'], 'hora': horario['hora']}
+    assert cliente.post('/api/verificar-disponibilidade', json=corpo).get_json()['disponivel']
+
+    agendar(1, horario['data'], horario['hora'], horario['hora_fim'])
+    resposta = cliente.post('/api/verificar-disponibilidade', json=corpo).get_json()
+    assert not resposta['disponivel']
+    assert resposta['motivo'] == 'Horário já ocupado por outro paciente'
+
+
+def test_verificacao_em_lote_valida_o_corpo(cliente):
+    url = '/api/verificar-disponibilidade/lote'
+    assert cliente.post(url, json={}).status_code == 400
+    assert cliente.post(url, json={'slots': []}).status_code == 400
+    assert cliente.post(url, json={'slots': [{'medico_id': 1}]}).status_code == 400
+    excesso = [{'medico_id': 1, 'data': '2030-01-07', 'hora': '08:00'}] * 501
+    assert cliente.post(url, json={'slots': excesso}).status_code == 400
+
+
+def test_verificacao_em_lote_alem_do_horizonte(cliente, agendar, hoje):
+    # 14 dias úteis fora da matriz, 252 slots: dois lotes de consulta ao banco (até 200)
+    inicio = hoje + timedelta(days=40)
+    dias = [inicio + timedelta(days=i) for i in range(30)
+            if (inicio + timedelta(days=i)).weekday() < 5]
+    slots = [{'medico_id': 1, 'data': dia.isoformat(),
+              'hora': f"{8 + i // 2:02d}:{30 * (i % 2):02d}"}
+             for dia in dias for i in range(18)][:252]
+    ocupado = slots[-1]
+    agendar(1, ocupado['data'], ocupado['hora'], '17:00')
+
+    resposta = cliente.post('/api/verificar-disponibilidade/lote', json={'slots': slots})
+    resultados = resposta.get_json()['resultados']
+    assert resposta.status_code == 200 and len(resultados) == 252
+    assert [r for r in resultados if not r['disponivel']] == [
+        dict(ocupado, disponivel=False, motivo='Horário já ocupado por outro paciente')]
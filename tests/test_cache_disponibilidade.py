@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from cache_disponibilidade import CacheDisponibilidade
+from disponibilidade import MotorDisponibilidade, PoliticaHorizonte
+from reservas import ReservasMemoria
+
+
+def test_acerto_e_falha():
+    cache = CacheDisponibilidade()
+    assert cache.obter('a') is None
+    cache.guardar('a', [1], medico_ids=[1])
+    assert cache.obter('a') == [1]
+    assert cache.estatisticas() == {'entradas': 1, 'acertos': 1, 'falhas': 1,
+                                    'taxa_acerto': 0.5}
+
+
+def test_invalidacao_por_medico():
+    cache = CacheDisponibilidade()
+    cache.guardar('a', 'A', medico_ids=[1, 2])
+    cache.guardar('b', 'B', medico_ids=[3])
+    cache.invalidar_medico(2)
+    assert cache.obter('a') is None
+    assert cache.obter('b') == 'B'
+    cache.invalidar_medico()
+    assert cache.obter('b') is None
+
+
+def test_resultado_calculado_antes_da_invalidacao_nao_e_guardado():
+    cache = CacheDisponibilidade()
+    epoca = cache.epoca
+    cache.invalidar_medico(1)
+    cache.guardar('a', 'A', medico_ids=[1], epoca=epoca)
+    assert cache.obter('a') is None
+
+
+def test_capacidade_descarta_o_menos_usado():
+    cache = CacheDisponibilidade(capacidade=2)
+    cache.guardar('a', 'A', medico_ids=[1])
+    cache.guardar('b', 'B', medico_ids=[1])
+    cache.obter('a')
+    cache.guardar('c', 'C', medico_ids=[1])
+    assert [cache.obter(chave) for chave in 'abc'] == ['A', None, 'C']
+
+
+def test_entrada_expirada():
+    cache = CacheDisponibilidade(ttl=-1)
+    cache.guardar('a', 'A', medico_ids=[1])
+    assert cache.obter('a') is None
+    assert cache.estatisticas()['entradas'] == 0
+
+
+def test_busca_em_cache_ate_alterar_a_agenda(fonte, hoje):
+    politica = PoliticaHorizonte(dias_busca=14, limite=3, antecedencia_horas=0,
+                                 dias_matriz=14, janelas=[14], dias_maximo=14)
+    motor = MotorDisponibilidade(fonte, politica, ReservasMemoria())
+    primeiros = motor.buscar_horarios(1)
+    assert motor.buscar_horarios(1) == primeiros
+    assert motor.cache.estatisticas()['acertos'] == 1
+
+    amanha = hoje + timedelta(days=1)
+    motor.matriz.registrar_agendamento(1, amanha, '08:00', '09:00')
+    assert motor.cache.estatisticas()['entradas'] == 0
+    motor.buscar_horarios(1)
+    # Médico de outra especialidade não invalida a busca
+    motor.matriz.registrar_agendamento(3, amanha, '08:00', '09:00')
+    motor.buscar_horarios(1)
+    assert motor.cache.estatisticas()['acertos'] == 2
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+
+from cliente_ia import ClienteIA
+
+
+class ModeloFalso:
+    """generate_content com latências programadas (uma por chamada, a última se repete)"""
+
+    def __init__(self, latencias=(0.0,), erro=None):
+        self.latencias = list(latencias)
+        self.erro = erro
+        self.chamadas = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, request_options=None, **opcoes):
+        with self._lock:
+            ordem = len(self.chamadas)
+            self.chamadas.append((prompt, request_options, opcoes))
+        time.sleep(self.latencias[min(ordem, len(self.latencias) - 1)])
+        if self.erro:
+            raise self.erro
+        return f"resposta {ordem}"
+
+
+def test_repassa_prazo_e_opcoes():
+    modelo = ModeloFalso()
+    cliente = ClienteIA(modelo, prazo=1.0, hedge=False)
+    config = {'response_mime_type': 'application/json'}
+    assert cliente.gerar("oi", generation_config=config) == "resposta 0"
+    prompt, request_options, opcoes = modelo.chamadas[0]
+    assert prompt == "oi"
+    assert 0 < request_options['timeout'] <= 1.0
+    assert opcoes == {'generation_config': config}
+
+
+def test_prazo_estourado():
+    cliente = ClienteIA(ModeloFalso([0.5]), prazo=0.1, hedge=False)
+    inicio = time.monotonic()
+    with pytest.raises(TimeoutError):
+        cliente.gerar("oi")
+    assert time.monotonic() - inicio < 0.4
+    assert cliente.estatisticas()['estouros'] == 1
+
+
+def test_hedge_vence_chamada_lenta():
+    modelo = ModeloFalso([0.5, 0.0])
+    cliente = ClienteIA(modelo, prazo=1.0)
+    cliente.atraso_hedge = lambda: 0.05
+    assert cliente.gerar("oi") == "resposta 1"
+    estatisticas = cliente.estatisticas()
+    assert estatisticas['hedges'] == 1
+    assert estatisticas['hedges_vencedores'] == 1
+
+
+def test_sem_hedge_quando_desligado():
+    modelo = ModeloFalso([0.1])
+    cliente = ClienteIA(modelo, prazo=1.0, hedge=False)
+    cliente.atraso_hedge = lambda: 0.01
+    assert cliente.gerar("oi") == "resposta 0"
+    assert len(modelo.chamadas) == 1
+
+
+def test_erro_do_modelo_propaga():
+    cliente = ClienteIA(ModeloFalso(erro=ValueError("quota")), prazo=1.0, hedge=False)
+    with pytest.raises(ValueError):
+        cliente.gerar("oi")
+    assert cliente.estatisticas()['erros'] == 1
+
+
+def test_orcamento_do_turno():
+    modelo = ModeloFalso()
+    cliente = ClienteIA(modelo, prazo=1.0, hedge=False)
+    with cliente.orcamento_turno(0):
+        with pytest.raises(TimeoutError):
+            cliente.gerar("oi")
+    assert modelo.chamadas == []
+    # Fora do bloco o orçamento não vale mais
+    assert cliente.gerar("oi") == "resposta 0"
+
+
+def test_atraso_hedge_inicial_e_p95():
+    cliente = ClienteIA(ModeloFalso(), hedge=False)
+    assert cliente.atraso_hedge() == 1.5
+    cliente._latencias.extend([0.1] * 19 + [2.0])
+    assert cliente.atraso_hedge() == 2.0
+    cliente._latencias.extend([0.1] * 20)
+    assert cliente.atraso_hedge() == 0.3
+
+
+def _em_paralelo(funcoes):
+    resultados = [None] * len(funcoes)
+
+    def executar(i):
+        try:
+            resultados[i] = funcoes[i]()
+        except Exception as e:
+            resultados[i] = e
+
+    threads = [threading.Thread(target=executar, args=(i,)) for i in range(len(funcoes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados
+
+
+def test_prompts_iguais_em_voo_viram_uma_chamada():
+    modelo = ModeloFalso([0.2])
+    cliente = ClienteIA(modelo, prazo=1.0, hedge=False)
+    resultados = _em_paralelo([lambda: cliente.gerar("Bom  dia"),
+                               lambda: cliente.gerar("bom dia"),
+                               lambda: cliente.gerar("BOM DIA")])
+    assert resultados == ["resposta 0"] * 3
+    assert len(modelo.chamadas) == 1
+    assert cliente.estatisticas()['coalescidas'] == 2
+
+
+def test_opcoes_diferentes_nao_coalescem():
+    modelo = ModeloFalso([0.2])
+    cliente = ClienteIA(modelo, prazo=1.0, hedge=False)
+    _em_paralelo([lambda: cliente.gerar("oi"),
+                  lambda: cliente.gerar("oi", generation_config={'response_mime_type': 'application/json'})])
+    assert len(modelo.chamadas) == 2
+
+
+def test_erro_do_lider_chega_aos_seguidores():
+    modelo = ModeloFalso([0.2], erro=ValueError("quota"))
+    cliente = ClienteIA(modelo, prazo=1.0, hedge=False)
+    resultados = _em_paralelo([lambda: cliente.gerar("oi"), lambda: cliente.gerar("oi")])
+    assert all(isinstance(resultado, ValueError) for resultado in resultados)
+    assert len(modelo.chamadas) == 1
+
+
+def test_chamada_concluida_nao_fica_em_voo():
+    modelo = ModeloFalso()
+    cliente = ClienteIA(modelo, prazo=1.0, hedge=False)
+    cliente.gerar("oi")
+    cliente.gerar("oi")
+    assert len(modelo.chamadas) == 2
+    assert cliente._em_voo == {}
@@ -0,0 +1,140 @@
+from datetime import timedelta
+
+import pytest
+
+from disponibilidade import MotorDisponibilidade, PoliticaHorizonte
+from reservas import ReservasMemoria
+
+
+def _motor(fonte):
+    politica = PoliticaHorizonte(dias_busca=14, limite=5, antecedencia_horas=0,
+                                 dias_matriz=14, janelas=[14, 60], dias_maximo=60)
+    return MotorDisponibilidade(fonte, politica, ReservasMemoria())
+
+
+@pytest.fixture
+def motor(fonte):
+    return _motor(fonte)
+
+
+def test_etag_igual_entre_workers(fonte):
+    assert _motor(fonte).etag(1) == _motor(fonte).etag(1)
+
+
+def test_etag_custa_uma_consulta(motor, fonte):
+    motor.etag(1)
+    fonte.consultas.clear()
+    motor.etag(1)
+    assert fonte.consultas == {'versoes_agenda': 1}
+
+
+def test_etag_muda_com_gravacao_de_outro_worker(motor, fonte, hoje):
+    etag = motor.etag(1)
+    amanha = hoje + timedelta(days=1)
+    assert motor.matriz.situacao_slot(1, amanha, '08:00') == 'livre'
+    fonte.agendar(1, amanha, 8 * 60, 9 * 60)
+    assert motor.etag(1) != etag
+    # A verificação da ETag já trouxe o médico alterado para a matriz deste processo
+    assert motor.matriz.situacao_slot(1, amanha, '08:00') == 'agendado'
+
+
+def test_etag_por_medico(motor, fonte, hoje):
+    etag = motor.etag(1, medico_id=1)
+    fonte.agendar(2, hoje + timedelta(days=1), 8 * 60, 9 * 60)
+    assert motor.etag(1, medico_id=1) == etag
+    assert motor.etag(2) == motor.etag(2)
+
+
+def test_etag_reflete_reservas_de_outras_sessoes(motor):
+    etag = motor.etag(1)
+    horario = motor.buscar_horarios(1)[0]
+    assert motor.reservar_horario(horario, 'sessao-a')
+    assert motor.etag(1, sessao='sessao-a') == etag
+    assert motor.etag(1, sessao='sessao-b') != etag
+
+
+def test_situacao_slot_responde_pela_matriz(motor, fonte, hoje):
+    amanha = hoje + timedelta(days=1)
+    assert motor.situacao_slot(1, amanha, '08:00') == 'livre'
+    fonte.consultas.clear()
+    assert motor.situacao_slot(1, amanha, '08:00') == 'livre'
+    assert fonte.consultas == {'versao_agenda': 1}
+
+
+def test_situacao_slot_ve_agendamento_de_outro_worker(motor, fonte, hoje):
+    amanha = hoje + timedelta(days=1)
+    assert motor.situacao_slot(1, amanha, '08:00') == 'livre'
+    fonte.agendar(1, amanha, 8 * 60, 9 * 60)
+    assert motor.situacao_slot(1, amanha, '08:00') == 'agendado'
+
+
+def test_situacao_slot_fora_do_horizonte_consulta_o_banco(motor, fonte, hoje):
+    distante = hoje + timedelta(days=40)
+    fonte.agendar(1, distante, 8 * 60, 9 * 60)
+    assert motor.situacao_slot(1, distante, '08:00') == 'agendado'
+    assert motor.situacao_slot(1, distante, '09:00') == 'livre'
+
+
+def test_situacao_slot_reservado_por_outra_sessao(motor, hoje):
+    horario = motor.buscar_horarios(1)[0]
+    assert motor.reservar_horario(horario, 'sessao-a')
+    data_slot = hoje.fromisoformat(horario['data'])
+    hora = horario['hora']
+    assert motor.situacao_slot(horario['medico_id'], data_slot, hora, sessao='sessao-a') == 'livre'
+    assert motor.situacao_slot(horario['medico_id'], data_slot, hora, sessao='sessao-b') == 'reservado'
+
+
+def _datas(slots):
+    return sorted({slot[0] for slot in slots})
+
+
+def test_data_pedida_alem_do_horizonte_da_matriz(motor, fonte, hoje):
+    # Matriz de 14 dias: o dia 40 vem da busca em lote além do horizonte
+    dia = hoje + timedelta(days=40)
+    fonte.agendar(1, dia, 8 * 60, 9 * 60)
+    preferencias = {'data_inicio': dia.isoformat(), 'data_fim': dia.isoformat()}
+    slots = motor.buscar_slots(1, preferencias=preferencias)
+    assert _datas(slots) == [dia]
+    assert (dia, 8 * 60, 1, 1) not in slots
+    assert (dia, 8 * 60, 2, 2) in slots
+
+
+def test_data_fim_alem_do_horizonte_segue_em_janelas(motor, hoje):
+    preferencias = {'data_inicio': (hoje + timedelta(days=12)).isoformat(),
+                    'data_fim': (hoje + timedelta(days=20)).isoformat()}
+    slots = motor.buscar_slots(1, limite=100, preferencias=preferencias)
+    assert _datas(slots) == [hoje + timedelta(days=d) for d in range(12, 21)]
+
+
+def test_data_fim_limitada_ao_maximo_da_politica(motor, hoje):
+    dia = (hoje + timedelta(days=90)).isoformat()
+    assert motor.buscar_slots(1, preferencias={'data_inicio': dia, 'data_fim': dia}) == []
+
+
+def test_intervalo_alem_do_horizonte_com_cursor(motor, hoje):
+    inicio, fim = hoje + timedelta(days=13), hoje + timedelta(days=16)
+    vistos, cursor = [], None
+    while True:
+        pagina, cursor = motor.buscar_intervalo(1, data_inicio=inicio, data_fim=fim,
+                                                cursor=cursor, limite=7)
+        vistos += [(h['data'], h['hora'], h['medico_id']) for h in pagina]
+        if cursor is None:
+            break
+    # Médicos 1 e 2, das 8h às 12h, em 4 dias
+    assert len(vistos) == len(set(vistos)) == 2 * 4 * 4
+    assert vistos == sorted(vistos)
+    assert vistos[-1][0] == fim.isoformat()
+
+
+def test_conflito_turno_em_outro_local(motor):
+    # Médico 1 atende das 8h às 12h todos os dias no local 1
+    conflito = motor.conflito_turno(1, 2, '11:00', '13:00')
+    assert conflito == {'local_id': 1, 'local': 'Centro', 'dia_semana': 'Quarta',
+                        'hora_inicio': '08:00', 'hora_fim': '12:00'}
+    assert motor.conflito_turno(1, 2, '12:00', '13:00') is None
+
+
+def test_conflito_turno_ignora_o_turno_editado(motor, fonte):
+    horario_id = next(turno[0] for turno in fonte.turnos if turno[1] == 1 and turno[3] == 2)
+    assert motor.conflito_turno(1, 2, '07:00', '13:00', horario_id=horario_id) is None
+    assert motor.conflito_turno(1, 3, '07:00', '13:00', horario_id=horario_id) is not None
@@ -0,0 +1,92 @@
+import json
+from datetime import date
+
+import pytest
+
+from extracao import combinar, interpretar, preferencias_locais, resumir, tem_conteudo
+
+# Sexta-feira
+HOJE = date(2026, 10, 16)
+
+
+def test_cumprimento_nao_vira_periodo():
+    assert preferencias_locais("boa tarde, quero cardiologista em BH", HOJE) == {}
+    assert preferencias_locais("Boa noite! preciso de um dermatologista", HOJE) == {}
+    assert preferencias_locais("bom dia", HOJE) == {}
+
+
+def test_periodo_pedido_depois_do_cumprimento():
+    assert preferencias_locais("boa noite, quero consulta de tarde", HOJE) == {
+        'hora_min': 12 * 60, 'hora_max': 18 * 60}
+    assert preferencias_locais("boa tarde, sexta de manhã", HOJE) == {
+        'dias_semana': [4], 'hora_min': 0, 'hora_max': 12 * 60}
+
+
+LOCAIS = [(1, 'Contagem', 'Contagem'), (2, 'Belo Horizonte', 'Belo Horizonte')]
+ESPECIALIDADES = [(1, 'Clínica Geral'), (2, 'Cardiologia')]
+
+
+def _interpretar(bruto, opcoes=0):
+    return interpretar(json.dumps(bruto), LOCAIS, ESPECIALIDADES, opcoes, HOJE)
+
+
+def test_interpretar_campos_validos():
+    campos = interpretar(
+        '```json\n{"saudacao": false, "intencao": "agendamento", "local": "belo horizonte", '
+        '"especialidade": "Cardiologia", "dias_semana": ["sexta-feira"], "periodo": "manhã", '
+        '"cpf": "123.456.789-01"}\n```',
+        LOCAIS, ESPECIALIDADES, 0, HOJE)
+    assert campos == {
+        'saudacao': False, 'intencao': 'agendamento',
+        'local_id': 2, 'local_nome': 'Belo Horizonte',
+        'especialidade_id': 2, 'especialidade_nome': 'Cardiologia',
+        'opcao': None, 'cpf': '12345678901',
+        'preferencias': {'dias_semana': [4], 'hora_min': 0, 'hora_max': 12 * 60}}
+
+
+def test_interpretar_descarta_valores_invalidos():
+    campos = _interpretar({'saudacao': 'sim', 'intencao': 'comprar', 'local': 'Betim',
+                           'especialidade': 'Cardio', 'opcao': 7, 'cpf': '123',
+                           'data': '2026-10-01', 'hora_min': '25:00', 'dias_semana': 'feriado'},
+                          opcoes=5)
+    assert campos['saudacao'] is False
+    assert campos['intencao'] is None
+    assert campos['local_id'] is None and campos['especialidade_id'] is None
+    assert campos['opcao'] is None and campos['cpf'] is None
+    assert campos['preferencias'] == {}
+
+
+def test_interpretar_opcao_e_horas():
+    campos = _interpretar({'opcao': '2', 'data': '2026-10-20', 'hora_min': '14:00',
+                           'hora_max': '17:30'}, opcoes=3)
+    assert campos['opcao'] == 1
+    assert campos['preferencias'] == {'data_inicio': '2026-10-20', 'data_fim': '2026-10-20',
+                                      'hora_min': 14 * 60, 'hora_max': 17 * 60 + 30}
+
+
+def test_interpretar_sem_json():
+    with pytest.raises(ValueError):
+        interpretar("não sei", LOCAIS, ESPECIALIDADES)
+    with pytest.raises(ValueError):
+        interpretar("[1, 2]", LOCAIS, ESPECIALIDADES)
+
+
+def test_tem_conteudo():
+    assert not tem_conteudo("oi, quero marcar uma consulta")
+    assert not tem_conteudo("Boa tarde!")
+    assert tem_conteudo("boa tarde, cardiologista")
+    assert tem_conteudo("dor no peito")
+
+
+def test_combinar_e_resumir():
+    primeiro = _interpretar({'local': 'Contagem', 'periodo': 'tarde', 'cpf': '12345678901'})
+    extraido = combinar(None, primeiro)
+    assert extraido == {'local_id': 1, 'local_nome': 'Contagem',
+                        'preferencias': {'hora_min': 12 * 60, 'hora_max': 18 * 60}}
+    extraido = combinar(extraido, _interpretar({'especialidade': 'Clínica Geral',
+                                                'dias_semana': ['segunda']}))
+    assert extraido['local_id'] == 1 and extraido['especialidade_id'] == 1
+    assert extraido['preferencias'] == {'hora_min': 12 * 60, 'hora_max': 18 * 60,
+                                        'dias_semana': [0]}
+    assert resumir(extraido) == "Clínica Geral, em Contagem, segunda, à tarde"
+    assert resumir({}) == ""
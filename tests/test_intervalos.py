@@ -0,0 +1,72 @@
+from intervalos import (agrupar_turnos, dividir, expandir_turnos, intersectar, sobreposicoes,
+                        subtrair, unir)
+
+
+def test_unir():
+    assert unir([]) == []
+    assert unir([(60, 120), (0, 30), (30, 45)]) == [(0, 45), (60, 120)]
+    assert unir([(0, 100), (10, 20)]) == [(0, 100)]
+    # Intervalos vazios ou invertidos são ignorados
+    assert unir([(10, 10), (20, 5)]) == []
+
+
+def test_subtrair():
+    assert subtrair([(0, 100)], []) == [(0, 100)]
+    assert subtrair([(0, 100)], [(20, 30), (50, 60)]) == [(0, 20), (30, 50), (60, 100)]
+    assert subtrair([(0, 100)], [(0, 100)]) == []
+    assert subtrair([(0, 100)], [(-10, 10), (90, 200)]) == [(10, 90)]
+    # Adjacentes não removem nada
+    assert subtrair([(10, 20)], [(0, 10), (20, 30)]) == [(10, 20)]
+    assert subtrair([(0, 10), (20, 30)], [(5, 25)]) == [(0, 5), (25, 30)]
+
+
+def test_intersectar():
+    assert intersectar([(0, 60)], [(30, 90)]) == [(30, 60)]
+    assert intersectar([(0, 10), (20, 30)], [(5, 25)]) == [(5, 10), (20, 25)]
+    assert intersectar([(0, 10)], [(10, 20)]) == []
+    assert intersectar([], [(0, 10)]) == []
+
+
+def test_sobreposicoes():
+    assert sobreposicoes([]) == []
+    assert sobreposicoes([(0, 60, 'a'), (60, 120, 'b')]) == []
+    assert sobreposicoes([(0, 60, 'a'), (30, 90, 'b'), (45, 50, 'c')]) == [
+        ('a', 'b'), ('a', 'c'), ('b', 'c')]
+    assert sobreposicoes([(0, 60, 'a'), (0, 60, 'b')]) == [('a', 'b')]
+
+
+def test_dividir():
+    assert list(dividir(480, 600, 30)) == [480, 510, 540, 570]
+    # Sobra menor que uma consulta não vira slot
+    assert list(dividir(480, 590, 30)) == [480, 510, 540]
+    assert list(dividir(480, 500, 30)) == []
+    assert list(dividir(480, 600, 0)) == []
+    assert list(dividir(480, 600, None)) == []
+
+
+def test_expandir_turnos_separados():
+    slots = expandir_turnos([(480, 540, 30, 1), (840, 900, 30, 2)])
+    assert slots == [(480, 1, 30), (510, 1, 30), (840, 2, 30), (870, 2, 30)]
+
+
+def test_expandir_turnos_sobrepostos():
+    # O segundo turno só contribui com o trecho que o primeiro não cobre
+    slots = expandir_turnos([(480, 600, 30, 1), (540, 660, 20, 2)])
+    assert slots == [(480, 1, 30), (510, 1, 30), (540, 1, 30), (570, 1, 30),
+                     (600, 2, 20), (620, 2, 20), (640, 2, 20)]
+    inicios = [inicio for inicio, _, _ in slots]
+    fins = [inicio + duracao for inicio, _, duracao in slots]
+    assert all(fim <= proximo for fim, proximo in zip(fins, inicios[1:]))
+
+
+def test_expandir_turnos_invalidos():
+    assert expandir_turnos([(600, 480, 30, 1), (480, 600, 0, 1)]) == []
+    assert expandir_turnos([]) == []
+
+
+def test_agrupar_turnos():
+    turnos = agrupar_turnos([(1, 10, 0, 480, 600, 30), (1, 20, 0, 840, 900, 30),
+                             (2, 10, 4, 480, 540, None)])
+    assert turnos[1][0] == [(480, 600, 30, 10), (840, 900, 30, 20)]
+    assert turnos[1][1:] == [[]] * 6
+    assert turnos[2][4] == [(480, 540, None, 10)]
@@ -0,0 +1,120 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+from mapa_ocupacao import MapaOcupacao
+from ocupacao import MatrizOcupacao
+
+
+@pytest.fixture
+def matriz(fonte):
+    return MatrizOcupacao(fonte, dias=30, ttl=3600)
+
+
+@pytest.fixture
+def mapa(matriz):
+    return MapaOcupacao(matriz)
+
+
+@pytest.fixture
+def calculados(mapa, monkeypatch):
+    """Registra os médicos passados a cada recálculo (None = mapa inteiro)"""
+    chamadas = []
+    calcular = mapa._calcular
+
+    def registrar(medico_ids, hoje):
+        chamadas.append(None if medico_ids is None else sorted(medico_ids))
+        return calcular(medico_ids, hoje)
+
+    monkeypatch.setattr(mapa, '_calcular', registrar)
+    return chamadas
+
+
+def _agendar(fonte, matriz, medico_id, data_ag, inicio, fim):
+    """Grava no banco falso e avisa a matriz, como fazem as rotas de agendamento"""
+    fonte.agendar(medico_id, data_ag, inicio * 60, fim * 60)
+    matriz.registrar_agendamento(medico_id, data_ag, f"{inicio:02d}:00", f"{fim:02d}:00")
+
+
+def _linha(relatorio, medico_id):
+    return next(linha for linha in relatorio['linhas'] if linha['medico_id'] == medico_id)
+
+
+def test_percentuais_por_medico_e_dia(mapa, matriz, fonte, hoje):
+    amanha = hoje + timedelta(days=1)
+    _agendar(fonte, matriz, 1, amanha, 8, 9)
+    _agendar(fonte, matriz, 1, amanha, 10, 11)
+    relatorio = mapa.obter(semanas=4)
+    assert len(relatorio['datas']) == 28
+    linha = _linha(relatorio, 1)
+    assert linha['local'] == 'Centro'
+    assert linha['percentuais'][1] == 50
+    assert linha['capacidade'] == 4 * 28
+    assert linha['ocupados'] == 2
+    assert _linha(relatorio, 2)['ocupados'] == 0
+
+
+def test_agendamento_recalcula_so_o_medico(mapa, matriz, fonte, calculados, hoje):
+    mapa.obter()
+    _agendar(fonte, matriz, 2, hoje + timedelta(days=3), 9, 10)
+    relatorio = mapa.obter()
+    assert calculados == [None, [2]]
+    assert _linha(relatorio, 2)['percentuais'][3] == 25
+    mapa.obter()
+    assert len(calculados) == 2
+
+
+def test_recarga_sem_mudancas_nao_recalcula(mapa, matriz, calculados):
+    mapa.obter()
+    matriz.reconstruir()
+    mapa.obter()
+    assert calculados == [None]
+
+
+def test_recarga_recalcula_so_medicos_alterados_no_banco(mapa, matriz, fonte, calculados, hoje):
+    mapa.obter()
+    # Agendamento feito por outro worker: só aparece na recarga
+    fonte.agendar(3, hoje + timedelta(days=2), 8 * 60, 9 * 60)
+    matriz.reconstruir()
+    relatorio = mapa.obter()
+    assert calculados == [None, [3]]
+    assert _linha(relatorio, 3)['percentuais'][2] == 25
+
+
+def test_novo_medico_refaz_o_mapa(mapa, matriz, fonte, calculados):
+    mapa.obter()
+    fonte.adicionar_medico(4)
+    matriz.reconstruir()
+    relatorio = mapa.obter()
+    assert calculados == [None, None]
+    assert _linha(relatorio, 4)['ocupados'] == 0
+
+
+def test_alteracoes_concorrentes_com_leitura(mapa, matriz, fonte, hoje):
+    mapa.obter()
+    erros = []
+
+    def agendar(medico_id):
+        try:
+            for dia in range(1, 15):
+                _agendar(fonte, matriz, medico_id, hoje + timedelta(days=dia), 8, 9)
+        except Exception as erro:  # pragma: no cover - falha do teste
+            erros.append(erro)
+
+    def ler():
+        try:
+            for _ in range(30):
+                mapa.obter()
+        except Exception as erro:  # pragma: no cover - falha do teste
+            erros.append(erro)
+
+    threads = [threading.Thread(target=agendar, args=(medico_id,)) for medico_id in (1, 2, 3)]
+    threads += [threading.Thread(target=ler) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not erros
+    relatorio = mapa.obter()
+    assert all(_linha(relatorio, medico_id)['ocupados'] == 14 for medico_id in (1, 2, 3))
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+import pytest
+
+from ocupacao import MatrizOcupacao
+
+
+@pytest.fixture
+def matriz(fonte):
+    return MatrizOcupacao(fonte, dias=30, ttl=3600)
+
+
+def test_alteracoes_antes_da_carga_sao_ignoradas(matriz, hoje):
+    # A primeira consulta carrega tudo do banco, onde a alteração já está
+    matriz.registrar_agendamento(1, hoje + timedelta(days=1), '09:00', '10:00')
+    assert matriz.situacao_slot(1, hoje + timedelta(days=1), '09:00') == 'livre'
+
+
+def test_registrar_e_liberar_agendamento(matriz, hoje):
+    amanha = hoje + timedelta(days=1)
+    assert matriz.situacao_slot(1, amanha, '09:00') == 'livre'
+    matriz.registrar_agendamento(1, amanha, '09:00', '10:00')
+    assert matriz.situacao_slot(1, amanha, '09:00') == 'agendado'
+    assert matriz.situacao_slot(2, amanha, '09:00') == 'livre'
+    matriz.liberar_agendamento(1, amanha, '09:00', '10:00')
+    assert matriz.situacao_slot(1, amanha, '09:00') == 'livre'
+
+
+def test_agendamento_sobrepoe_varios_slots(matriz, hoje):
+    amanha = hoje + timedelta(days=1)
+    matriz.situacao_slot(1, amanha, '08:00')
+    matriz.registrar_agendamento(1, amanha, '08:30', '10:00')
+    assert [matriz.situacao_slot(1, amanha, hora) for hora in ('08:00', '09:00', '10:00')] == \
+        ['agendado', 'agendado', 'livre']
+
+
+def test_registrar_e_liberar_recorrente(matriz, hoje):
+    dia = hoje + timedelta(days=2)
+    matriz.situacao_slot(1, dia, '10:00')
+    matriz.registrar_recorrente(1, dia.weekday(), '10:00', hoje)
+    assert matriz.situacao_slot(1, dia, '10:00') == 'recorrente'
+    assert matriz.situacao_slot(1, dia + timedelta(days=7), '10:00') == 'recorrente'
+    assert matriz.situacao_slot(1, dia + timedelta(days=1), '10:00') == 'livre'
+    matriz.liberar_recorrente(1, dia.weekday(), '10:00', hoje)
+    assert matriz.situacao_slot(1, dia, '10:00') == 'livre'
+
+
+def test_fora_do_horizonte_ou_medico_desconhecido(matriz, hoje):
+    assert matriz.situacao_slot(1, hoje + timedelta(days=31), '08:00') is None
+    assert matriz.situacao_slot(99, hoje, '08:00') is None
+
+
+def test_recarregar_medico_le_o_banco(matriz, fonte, hoje):
+    amanha = hoje + timedelta(days=1)
+    matriz.situacao_slot(1, amanha, '08:00')
+    fonte.agendar(1, amanha, 8 * 60, 9 * 60)
+    assert matriz.situacao_slot(1, amanha, '08:00') == 'livre'
+    matriz.recarregar_medico(1)
+    assert matriz.situacao_slot(1, amanha, '08:00') == 'agendado'
+
+
+def test_recarregar_medico_com_nova_grade(matriz, fonte, hoje):
+    amanha = hoje + timedelta(days=1)
+    assert matriz.fim_slot(1, amanha, 13 * 60) is None
+    fonte.turnos = [turno for turno in fonte.turnos if turno[1] != 1]
+    fonte.adicionar_medico(1, inicio=13 * 60, fim=15 * 60, duracao=30)
+    matriz.recarregar_medico(1)
+    assert matriz.fim_slot(1, amanha, 13 * 60) == 13 * 60 + 30
+    assert matriz.fim_slot(1, amanha, 8 * 60) is None
+
+
+def test_sincronizar_medico_so_recarrega_quando_a_versao_muda(matriz, fonte, hoje):
+    amanha = hoje + timedelta(days=1)
+    matriz.situacao_slot(1, amanha, '08:00')
+    fonte.consultas.clear()
+    matriz.sincronizar_medico(1, fonte.versao_agenda(1))
+    assert fonte.consultas == {'versao_agenda': 1}
+
+    fonte.agendar(1, amanha, 8 * 60, 9 * 60)
+    matriz.sincronizar_medico(1, fonte.versao_agenda(1))
+    assert matriz.situacao_slot(1, amanha, '08:00') == 'agendado'
+
+
+def test_sincronizar_medico_desativado(matriz, fonte):
+    assert 3 in matriz.medicos_da_especialidade(2)
+    del fonte.medicos[3]
+    matriz.sincronizar_medico(3, fonte.versao_agenda(3))
+    assert 3 not in matriz.medicos_da_especialidade(2)
@@ -0,0 +1,161 @@
+from datetime import date
+
+from preferencias import (aplicar_preferencias, descrever_preferencias, escolher_horario,
+                          extrair_preferencias, menciona_horario)
+
+# Sexta-feira
+HOJE = date(2026, 10, 16)
+
+HORARIOS = [
+    {'data': '2026-10-16', 'hora': '14:00'},
+    {'data': '2026-10-17', 'hora': '09:00'},
+    {'data': '2026-10-17', 'hora': '14:00'},
+    {'data': '2026-10-19', 'hora': '02:00'},
+    {'data': '2026-10-23', 'hora': '14:00'},
+]
+
+
+def test_numero_da_opcao():
+    assert escolher_horario("2", HORARIOS, hoje=HOJE) == 1
+    assert escolher_horario("opção 3", HORARIOS, hoje=HOJE) == 2
+    assert escolher_horario("2", HORARIOS, numerados=False, hoje=HOJE) is None
+    assert escolher_horario("9", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("a 2", HORARIOS, hoje=HOJE) == 1
+    assert escolher_horario("quero a opção 4", HORARIOS, hoje=HOJE) == 3
+    assert escolher_horario("2 e 3", HORARIOS, hoje=HOJE) is None
+
+
+def test_numero_solto_nao_e_opcao():
+    tres = HORARIOS[:3]
+    # "às 3" é horário (03:00 ou 15:00), e nenhuma das três opções é nesse horário
+    assert escolher_horario("as 3", tres, hoje=HOJE) is None
+    assert escolher_horario("às 3", tres, hoje=HOJE) is None
+    assert escolher_horario("3 horas", tres, hoje=HOJE) is None
+    assert escolher_horario("quero 3 horários", tres, hoje=HOJE) is None
+    assert escolher_horario("daqui a 3 dias", tres, hoje=HOJE) is None
+    assert escolher_horario("amanhã às 9", tres, hoje=HOJE) == 1
+    assert escolher_horario("às 2", tres, hoje=HOJE) is None
+    assert escolher_horario("amanhã às 2", tres, hoje=HOJE) == 2
+
+
+def test_pergunta_nao_e_escolha():
+    assert escolher_horario("3 horários?", HORARIOS[:3], hoje=HOJE) is None
+    assert escolher_horario("pode ser o 2?", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("amanhã às 14h?", HORARIOS, hoje=HOJE) is None
+
+
+def test_ordinais():
+    assert escolher_horario("o primeiro", HORARIOS, hoje=HOJE) == 0
+    assert escolher_horario("segunda opção", HORARIOS, hoje=HOJE) == 1
+    assert escolher_horario("o último", HORARIOS, hoje=HOJE) == 4
+    assert escolher_horario("3º", HORARIOS, hoje=HOJE) == 2
+
+
+def test_hora_com_periodo_nao_e_numero_da_opcao():
+    # Duas opções às 14:00 em datas diferentes: ambíguo, fica para o Gemini
+    assert escolher_horario("2 da tarde", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("9 da manhã", HORARIOS, hoje=HOJE) == 1
+    assert escolher_horario("2h da manhã", HORARIOS, hoje=HOJE) == 3
+    assert escolher_horario("10 da noite", HORARIOS, hoje=HOJE) is None
+
+
+def test_dia_relativo_com_hora():
+    assert escolher_horario("amanhã às 14h", HORARIOS, hoje=HOJE) == 2
+    assert escolher_horario("amanhã às 2 da tarde", HORARIOS, hoje=HOJE) == 2
+    assert escolher_horario("hoje 14:00", HORARIOS, hoje=HOJE) == 0
+    assert escolher_horario("segunda às 2h", HORARIOS, hoje=HOJE) == 3
+    # Sexta mais próxima com horário às 14h
+    assert escolher_horario("sexta 14h", HORARIOS, hoje=HOJE) == 0
+
+
+def test_dia_relativo_sem_horario_correspondente():
+    assert escolher_horario("amanhã às 10h", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("depois de amanhã às 14h", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("terça 14h", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("segunda ou sexta às 14h", HORARIOS, hoje=HOJE) is None
+
+
+def test_data_e_hora_explicitas():
+    assert escolher_horario("17/10 às 14:00", HORARIOS, hoje=HOJE) == 2
+    assert escolher_horario("17/10", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("23/10", HORARIOS, hoje=HOJE) == 4
+    assert escolher_horario("31/02 14h", HORARIOS, hoje=HOJE) is None
+
+
+def test_preferencia_nao_e_escolha():
+    assert escolher_horario("depois das 14h", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("a partir de 20/10", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("amanhã à tarde", HORARIOS, hoje=HOJE) is None
+    assert escolher_horario("", [], hoje=HOJE) is None
+
+
+def test_menciona_horario():
+    assert menciona_horario("às 14h")
+    assert menciona_horario("pode ser 2 da tarde?")
+    assert menciona_horario("sexta às 3")
+    assert not menciona_horario("segunda opção")
+
+def test_extrair_periodos_e_dias():
+    assert extrair_preferencias("sexta de manhã", hoje=HOJE) == {
+        'dias_semana': [4], 'hora_min': 0, 'hora_max': 12 * 60}
+    assert extrair_preferencias("fim de semana à noite", hoje=HOJE) == {
+        'dias_semana': [5, 6], 'hora_min': 18 * 60, 'hora_max': 24 * 60}
+    assert extrair_preferencias("manhã ou tarde", hoje=HOJE) == {
+        'hora_min': 0, 'hora_max': 18 * 60}
+    assert extrair_preferencias("terça-feira ou quinta", hoje=HOJE) == {'dias_semana': [1, 3]}
+    assert extrair_preferencias("dias úteis", hoje=HOJE) == {'dias_semana': [0, 1, 2, 3, 4]}
+    assert extrair_preferencias("segunda opção", hoje=HOJE) == {}
+    assert extrair_preferencias("segunda alternativa", hoje=HOJE) == {}
+
+
+def test_extrair_horas():
+    assert extrair_preferencias("depois das 14h", hoje=HOJE) == {'hora_min': 14 * 60}
+    assert extrair_preferencias("antes das 10:30", hoje=HOJE) == {'hora_max': 10 * 60 + 30}
+    assert extrair_preferencias("entre 9 e 11h", hoje=HOJE) == {
+        'hora_min': 9 * 60, 'hora_max': 11 * 60}
+
+
+def test_extrair_horas_sem_sufixo():
+    assert extrair_preferencias("depois das 10", hoje=HOJE) == {'hora_min': 10 * 60}
+    assert extrair_preferencias("antes das 9", hoje=HOJE) == {'hora_max': 9 * 60}
+    assert extrair_preferencias("depois das 2 da tarde", hoje=HOJE) == {
+        'hora_min': 14 * 60, 'hora_max': 18 * 60}
+    # Sem "das" o número precisa do sufixo; dd/mm continua sendo data
+    assert extrair_preferencias("até 3 dias", hoje=HOJE) == {}
+    assert extrair_preferencias("a partir das 20/10", hoje=HOJE) == {'data_inicio': '2026-10-20'}
+
+
+def test_extrair_datas():
+    assert extrair_preferencias("a partir de 20/10", hoje=HOJE) == {'data_inicio': '2026-10-20'}
+    # dd/mm já passado é do ano seguinte
+    assert extrair_preferencias("dia 10/01", hoje=HOJE) == {'data_inicio': '2027-01-10'}
+    assert extrair_preferencias("amanhã", hoje=HOJE) == {
+        'data_inicio': '2026-10-17', 'data_fim': '2026-10-17'}
+    assert extrair_preferencias("semana que vem", hoje=HOJE) == {'data_inicio': '2026-10-19'}
+    assert extrair_preferencias("31/02", hoje=HOJE) == {}
+
+
+def test_extrair_medico():
+    medicos = {1: 'Dr. João Silva', 2: 'Dra. Maria Santos'}
+    assert extrair_preferencias("com a dra maria", medicos, hoje=HOJE) == {'medico_id': 2}
+    assert extrair_preferencias("com o dr", medicos, hoje=HOJE) == {}
+
+
+def test_aplicar_preferencias():
+    atuais = {'hora_min': 0, 'hora_max': 12 * 60, 'data_fim': '2026-10-20'}
+    assert aplicar_preferencias(atuais, "tanto faz", hoje=HOJE) == ({}, True)
+    assert aplicar_preferencias({}, "tanto faz", hoje=HOJE) == ({}, False)
+    assert aplicar_preferencias(atuais, "ok", hoje=HOJE) == (atuais, False)
+    # Nova data inicial descarta a data final anterior
+    assert aplicar_preferencias(atuais, "a partir de 25/10", hoje=HOJE) == (
+        {'hora_min': 0, 'hora_max': 12 * 60, 'data_inicio': '2026-10-25'}, True)
+
+
+def test_descrever_preferencias():
+    assert descrever_preferencias({'dias_semana': [4], 'hora_min': 0, 'hora_max': 720}) == \
+        'sexta, pela manhã'
+    assert descrever_preferencias({'hora_min': 9 * 60, 'hora_max': 11 * 60}) == \
+        'entre 09:00 e 11:00'
+    assert descrever_preferencias({'data_inicio': '2026-10-17', 'data_fim': '2026-10-17',
+                                   'medico_id': 2}, {2: 'Dra. Maria'}) == \
+        'em 17/10, com Dra. Maria'
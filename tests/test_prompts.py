@@ -0,0 +1,37 @@
+import pytest
+
+import prompts
+
+
+def test_compactar_remove_indentacao_e_linhas_vazias():
+    assert prompts.compactar("\n    a   b\n\n    c\n") == 'a b\nc'
+
+
+def test_montar_insere_mensagem_e_lista():
+    prompt = prompts.LOCAL_SIMPLES.montar("  quero   em bh ", ['Contagem', 'Belo Horizonte'])
+    assert 'Mensagem do usuário: "quero em bh"' in prompt
+    assert 'Contagem\nBelo Horizonte' in prompt
+
+
+def test_variantes_tem_identidades_distintas():
+    modelos = [prompts.INTENCAO, prompts.SAUDACAO, prompts.LOCAL, prompts.ESPECIALIDADE,
+               prompts.LOCAL_SIMPLES, prompts.ESPECIALIDADE_SIMPLES, prompts.EXTRACAO]
+    assert len({modelo.chave for modelo in modelos}) == len(modelos)
+    with pytest.raises(ValueError):
+        prompts.ModeloPrompt('local', 1, "{mensagem}")
+
+
+def test_estatisticas_separadas_por_modelo():
+    antes = prompts.estatisticas()
+    prompts.LOCAL.montar("bh", ['Belo Horizonte'])
+    prompts.LOCAL_SIMPLES.montar("bh", ['Belo Horizonte'])
+    prompts.LOCAL_SIMPLES.montar("contagem", ['Belo Horizonte'])
+    depois = prompts.estatisticas()
+
+    def montados(chave):
+        return depois[chave]['prompts'] - antes.get(chave, {}).get('prompts', 0)
+
+    assert montados('local.v1') == 1
+    assert montados('local_simples.v1') == 2
+    assert depois['local.v1']['tokens_fixos'] == prompts.LOCAL.tokens_fixos
+    assert depois['local_simples.v1']['tokens_fixos'] == prompts.LOCAL_SIMPLES.tokens_fixos
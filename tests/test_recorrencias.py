@@ -0,0 +1,57 @@
+from datetime import date
+
+from recorrencias import IndiceRecorrencias, SeriesHorario
+
+SEGUNDA = date(2026, 10, 19)
+TERCA = date(2026, 10, 20)
+
+
+def test_series_cobre_intervalos_aninhados():
+    series = SeriesHorario()
+    series.adicionar(date(2026, 1, 1), date(2026, 12, 31))
+    series.adicionar(date(2026, 3, 1), date(2026, 3, 31))
+    assert series.cobre(date(2026, 6, 1))
+    assert not series.cobre(date(2025, 12, 31))
+    assert not series.cobre(date(2027, 1, 1))
+    assert series.remover(date(2026, 1, 1), date(2026, 12, 31))
+    assert not series.cobre(date(2026, 6, 1))
+    assert series.cobre(date(2026, 3, 15))
+    assert not series.remover(date(2026, 1, 1), date(2026, 12, 31))
+    assert len(series) == 1
+
+
+def test_bloqueia_por_dia_e_minuto():
+    indice = IndiceRecorrencias()
+    indice.carregar([(1, 0, 600, date(2026, 10, 1), None)])
+    assert indice.bloqueia(1, SEGUNDA, 600)
+    assert not indice.bloqueia(1, SEGUNDA, 630)
+    assert not indice.bloqueia(1, TERCA, 600)
+    assert not indice.bloqueia(2, SEGUNDA, 600)
+    # Série sem data_fim fica aberta
+    assert indice.bloqueia(1, date(2030, 10, 21), 600)
+    assert not indice.bloqueia(1, date(2026, 9, 28), 600)
+
+
+def test_bloqueia_intervalo():
+    indice = IndiceRecorrencias()
+    indice.adicionar(1, 0, 610, date(2026, 10, 1), date(2026, 10, 31))
+    assert indice.bloqueia_intervalo(1, SEGUNDA, 600, 630)
+    assert not indice.bloqueia_intervalo(1, SEGUNDA, 570, 610)
+    assert not indice.bloqueia_intervalo(1, SEGUNDA, 611, 640)
+    assert not indice.bloqueia_intervalo(1, date(2026, 11, 2), 600, 630)
+    assert indice.minutos_ativos(1, SEGUNDA) == [610]
+
+
+def test_remover_e_remover_medico():
+    indice = IndiceRecorrencias()
+    indice.adicionar(1, 0, 600, date(2026, 10, 1))
+    indice.adicionar(1, 0, 660, date(2026, 10, 1), date(2026, 12, 1))
+    indice.adicionar(2, 0, 600, date(2026, 10, 1))
+    assert len(indice) == 3
+    assert not indice.remover(1, 0, 600, date(2026, 10, 2))
+    assert indice.remover(1, 0, 600, date(2026, 10, 1))
+    assert indice.minutos_ativos(1, SEGUNDA) == [660]
+    indice.remover_medico(1)
+    assert not indice.bloqueia(1, SEGUNDA, 660)
+    assert indice.bloqueia(2, SEGUNDA, 600)
+    assert len(indice) == 1
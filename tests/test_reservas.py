@@ -0,0 +1,101 @@
+from datetime import date
+
+import pytest
+
+import reservas
+from reservas import ReservasMemoria, ReservasSQLite, criar_reservas
+
+DIA = date(2026, 10, 19)
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(reservas.time, 'time', relogio)
+    return relogio
+
+
+@pytest.fixture(params=['memoria', 'sqlite'])
+def armazenamento(request, tmp_path, relogio):
+    if request.param == 'memoria':
+        return ReservasMemoria(ttl=60)
+    return ReservasSQLite(str(tmp_path / 'reservas.db'), ttl=60)
+
+
+def test_slot_reservado_fica_com_uma_sessao(armazenamento):
+    assert armazenamento.reservar(1, DIA, 540, 'a')
+    assert not armazenamento.reservar(1, DIA, 540, 'b')
+    # Renovar a própria reserva é permitido
+    assert armazenamento.reservar(1, DIA, 540, 'a')
+    assert armazenamento.retidos(excluir_sessao='b') == {(1, '2026-10-19', 540)}
+    assert armazenamento.retidos(excluir_sessao='a') == set()
+
+
+def test_nova_escolha_libera_a_anterior(armazenamento):
+    armazenamento.reservar(1, DIA, 540, 'a')
+    armazenamento.reservar(1, DIA, 600, 'a')
+    assert armazenamento.retidos() == {(1, '2026-10-19', 600)}
+    assert armazenamento.reservar(1, DIA, 540, 'b')
+
+
+def test_liberar(armazenamento):
+    armazenamento.reservar(1, DIA, 540, 'a')
+    armazenamento.liberar('a')
+    assert armazenamento.retidos() == set()
+    assert armazenamento.reservar(1, DIA, 540, 'b')
+
+
+def test_reserva_expira_apos_ttl(armazenamento, relogio):
+    armazenamento.reservar(1, DIA, 540, 'a')
+    relogio.agora += 59
+    assert not armazenamento.reservar(1, DIA, 540, 'b')
+    relogio.agora += 2
+    assert armazenamento.retidos() == set()
+    assert armazenamento.reservar(1, DIA, 540, 'b')
+
+
+def test_sqlite_compartilhado_entre_instancias(tmp_path, relogio):
+    caminho = str(tmp_path / 'reservas.db')
+    worker_1, worker_2 = ReservasSQLite(caminho, ttl=60), ReservasSQLite(caminho, ttl=60)
+    assert worker_1.reservar(1, DIA, 540, 'a')
+    assert not worker_2.reservar(1, DIA, 540, 'b')
+
+
+@pytest.fixture
+def ambiente(monkeypatch, tmp_path):
+    for variavel in ('RESERVAS_SLOT', 'WEB_CONCURRENCY', 'GUNICORN_CMD_ARGS'):
+        monkeypatch.delenv(variavel, raising=False)
+    monkeypatch.setenv('RESERVAS_SLOT_DB', str(tmp_path / 'reservas.db'))
+    monkeypatch.setattr(reservas.sys, 'argv', ['main.py'])
+    return monkeypatch
+
+
+def test_um_processo_usa_memoria(ambiente):
+    assert isinstance(criar_reservas(), ReservasMemoria)
+
+
+def test_varios_workers_usam_sqlite(ambiente):
+    ambiente.setenv('WEB_CONCURRENCY', '4')
+    assert isinstance(criar_reservas(), ReservasSQLite)
+
+
+def test_workers_na_linha_do_gunicorn(ambiente):
+    ambiente.setattr(reservas.sys, 'argv', ['/usr/bin/gunicorn', '-w', '3', 'main:app'])
+    assert isinstance(criar_reservas(), ReservasSQLite)
+    ambiente.setattr(reservas.sys, 'argv', ['/usr/bin/gunicorn', 'main:app'])
+    ambiente.setenv('GUNICORN_CMD_ARGS', '--workers=2 --timeout 30')
+    assert isinstance(criar_reservas(), ReservasSQLite)
+
+
+def test_variavel_explicita_prevalece(ambiente):
+    ambiente.setenv('WEB_CONCURRENCY', '4')
+    ambiente.setenv('RESERVAS_SLOT', 'memoria')
+    assert isinstance(criar_reservas(), ReservasMemoria)
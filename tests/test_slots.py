@@ -0,0 +1,133 @@
+from datetime import date, timedelta
+
+import pytest
+
+from disponibilidade import FonteSQLite, MotorDisponibilidade, PoliticaHorizonte
+from ocupacao import MatrizOcupacao
+from reservas import ReservasMemoria
+
+# Dados iniciais de database.py: médicos 3 a 6 atendem no local 1 de segunda a
+# sexta, das 8h às 18h, em consultas de 30 minutos
+
+
+@pytest.fixture
+def db(app_sqlite):
+    from database import db
+    return db
+
+
+@pytest.fixture
+def dia(hoje):
+    """Uma segunda-feira além do horizonte de 30 dias da matriz"""
+    dia = hoje + timedelta(days=35)
+    return dia + timedelta(days=-dia.weekday())
+
+
+@pytest.fixture
+def gravados(db):
+    """Apaga ao final as linhas gravadas pelo teste: gravar(tabela, sql, params)"""
+    linhas = []
+
+    def gravar(tabela, sql, params):
+        linhas.append((tabela, db.execute_insert(sql, params)))
+        return linhas[-1][1]
+
+    yield gravar
+    for tabela, linha_id in reversed(linhas):
+        db.execute_update(f"DELETE FROM {tabela} WHERE id = ?", (linha_id,))
+
+
+def _slots(db, medico_id, data_slot, ate='09:30'):
+    return [tuple(row) for row in db.execute_query(
+        "SELECT hora, estado FROM slots WHERE medico_id = ? AND data = ? AND hora < ? ORDER BY hora",
+        (medico_id, data_slot.isoformat(), ate))]
+
+
+def test_leitura_igual_a_geracao_da_matriz(db, hoje):
+    fonte = FonteSQLite()
+    inicio, fim = hoje + timedelta(days=31), hoje + timedelta(days=90)
+    esperado = MatrizOcupacao(fonte).horarios_livres_alem([3, 4], inicio, fim)
+    assert fonte.horarios_livres([3, 4], inicio, fim) == esperado
+    assert fonte.horarios_livres([3, 4], inicio, fim, local_id=1, dias_semana={2},
+                                 hora_min=10 * 60, limite=5) == \
+        [slot for slot in esperado if slot[0].weekday() == 2 and slot[1] >= 10 * 60][:5]
+    # Já gerado: a próxima leitura não gera nada
+    assert db.garantir_slots([3, 4], fim) == 0
+
+
+def test_consulta_usa_o_indice(db):
+    plano = ' '.join(row['detail'] for row in db.execute_query(
+        """
+        EXPLAIN QUERY PLAN
+        SELECT data, hora, medico_id, local_id FROM slots
+        WHERE estado = 'livre' AND data >= '2026-01-01' AND data <= '2026-12-31'
+        AND medico_id IN (3, 4) ORDER BY data, hora, medico_id LIMIT 10
+        """))
+    assert 'idx_slots_estado_data' in plano and 'TEMP B-TREE' not in plano
+
+
+def test_agendamento_e_cancelamento(db, gravados, paciente_id, dia):
+    db.garantir_slots([3], dia)
+    agendamento_id = gravados('agendamentos', """
+        INSERT INTO agendamentos (paciente_id, medico_id, especialidade_id, local_id,
+                                  data, hora, hora_fim)
+        VALUES (?, 3, 3, 1, ?, '08:15', '09:00')
+    """, (paciente_id, dia.isoformat()))
+    assert _slots(db, 3, dia) == [('08:00', 'agendado'), ('08:30', 'agendado'),
+                                  ('09:00', 'livre')]
+
+    db.execute_update("UPDATE agendamentos SET status = 'cancelado' WHERE id = ?",
+                      (agendamento_id,))
+    assert _slots(db, 3, dia) == [('08:00', 'livre'), ('08:30', 'livre'), ('09:00', 'livre')]
+
+
+def test_agendamento_anterior_a_geracao(db, gravados, paciente_id, hoje):
+    dia = hoje + timedelta(days=200)
+    dia -= timedelta(days=dia.weekday())
+    gravados('agendamentos', """
+        INSERT INTO agendamentos (paciente_id, medico_id, especialidade_id, local_id,
+                                  data, hora, hora_fim)
+        VALUES (?, 4, 4, 1, ?, '09:00', '09:30')
+    """, (paciente_id, dia.isoformat()))
+    assert (dia, 9 * 60, 4, 1) not in FonteSQLite().horarios_livres([4], dia, dia)
+    assert _slots(db, 4, dia, ate='10:00')[-2:] == [('09:00', 'agendado'), ('09:30', 'livre')]
+
+
+def test_serie_recorrente(db, gravados, paciente_id, hoje, dia):
+    db.garantir_slots([3], dia + timedelta(days=7))
+    serie_id = gravados('agendamentos_recorrentes', """
+        INSERT INTO agendamentos_recorrentes (paciente_id, medico_id, especialidade_id,
+                                              local_id, dia_semana, hora, data_inicio)
+        VALUES (?, 3, 3, 1, 0, '08:40', ?)
+    """, (paciente_id, hoje.isoformat()))
+    for segunda in (dia, dia + timedelta(days=7)):
+        assert _slots(db, 3, segunda) == [('08:00', 'livre'), ('08:30', 'recorrente'),
+                                          ('09:00', 'livre')]
+    assert _slots(db, 3, dia + timedelta(days=1)) == [('08:00', 'livre'), ('08:30', 'livre'),
+                                                      ('09:00', 'livre')]
+
+    db.execute_update("UPDATE agendamentos_recorrentes SET ativo = 0 WHERE id = ?", (serie_id,))
+    assert _slots(db, 3, dia) == [('08:00', 'livre'), ('08:30', 'livre'), ('09:00', 'livre')]
+
+
+def test_grade_alterada_gera_de_novo(db, dia):
+    db.garantir_slots([5], dia)
+    db.execute_update("UPDATE horarios_disponiveis SET duracao_consulta = 60 WHERE medico_id = 5")
+    try:
+        assert _slots(db, 5, dia) == []
+        livres = FonteSQLite().horarios_livres([5], dia, dia)
+        assert [minuto for _, minuto, _, _ in livres] == list(range(8 * 60, 18 * 60, 60))
+    finally:
+        db.execute_update("UPDATE horarios_disponiveis SET duracao_consulta = 30 WHERE medico_id = 5")
+
+
+def test_motor_busca_alem_da_matriz_na_tabela(db, hoje, dia):
+    politica = PoliticaHorizonte(dias_busca=14, limite=5, antecedencia_horas=0,
+                                 dias_matriz=14, janelas=[14, 60], dias_maximo=60)
+    motor = MotorDisponibilidade(FonteSQLite(), politica, ReservasMemoria())
+    db.execute_update("DELETE FROM slots_gerados WHERE medico_id = 6")
+    preferencias = {'data_inicio': dia.isoformat(), 'data_fim': dia.isoformat()}
+    slots = motor.buscar_slots(6, preferencias=preferencias)
+    assert [(slot[0], slot[1]) for slot in slots] == [(dia, 8 * 60 + 30 * i) for i in range(5)]
+    gerado = db.execute_query("SELECT data_fim FROM slots_gerados WHERE medico_id = 6")
+    assert date.fromisoformat(gerado[0]['data_fim']) >= dia